@@ -0,0 +1,118 @@
+"""Terraform Plan Benchmark
+
+Compares the legacy three pass plan (plan, plan -out, show -json) against the
+single pass plan in TerraformRunner.plan, using a stand-in terraform binary
+that sleeps to simulate the cost of refreshing state and rendering a plan.
+
+Usage:
+  plan_benchmark.py [--iterations=<n>] [--refresh-secs=<s>] [--show-secs=<s>]
+
+Options:
+  --iterations=<n>    Number of plans to run per mode [default: 5]
+  --refresh-secs=<s>  Simulated duration of a plan that refreshes state [default: 1.0]
+  --show-secs=<s>     Simulated duration of rendering a saved plan [default: 0.1]
+
+"""
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import time
+from docopt import docopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.base import TerraformRunDetails, TerraformPlanError
+from shared.tf_runner import TerraformRunner
+
+FAKE_TERRAFORM = """#!/usr/bin/env python3
+import json, os, sys, time
+args = sys.argv[1:]
+if args[0] == "plan":
+	time.sleep(float(os.environ["FAKE_TF_REFRESH_SECS"]))
+	if "-out" in args:
+		open(args[args.index("-out") + 1], "w").write("binary plan")
+	print("Plan: 1 to add, 0 to change, 0 to destroy.")
+elif args[0] == "show":
+	time.sleep(float(os.environ["FAKE_TF_SHOW_SECS"]))
+	if "-json" in args:
+		print(json.dumps({"format_version": "1.2", "resource_changes": []}))
+	else:
+		print("Plan: 1 to add, 0 to change, 0 to destroy.")
+"""
+
+
+class CountingRunner(TerraformRunner):
+	"""A TerraformRunner that counts every subprocess it spawns."""
+
+	def __init__(self) -> None:
+		super().__init__()
+		self.subprocess_count = 0
+
+	async def _run_cmd_in_dir(self, command: list[str], data: TerraformRunDetails, **kwargs) -> tuple:
+		self.subprocess_count += 1
+		return await super()._run_cmd_in_dir(command, data, **kwargs)
+
+
+async def legacy_plan(runner: CountingRunner, data: TerraformRunDetails, activity_id: str) -> None:
+	"""The plan sequence TerraformRunner.plan used before the single pass plan."""
+
+	await runner._run_cmd_in_dir(["terraform", "plan"], data)
+
+	tfplan_binary_filename = f"{activity_id}.binary"
+	plan_returncode, _, plan_stderr = \
+		await runner._run_cmd_in_dir(["terraform", "plan", "-out", tfplan_binary_filename], data)
+
+	if plan_returncode != 0:
+		await runner._run_cmd_in_dir(["rm", tfplan_binary_filename], data)
+		raise TerraformPlanError(f"Terraform plan errored: {plan_stderr}")
+
+	await runner._run_cmd_in_dir(["terraform", "show", "-json", tfplan_binary_filename], data)
+	await runner._run_cmd_in_dir(["rm", tfplan_binary_filename], data)
+
+
+async def single_pass_plan(runner: CountingRunner, data: TerraformRunDetails, activity_id: str) -> None:
+	await runner.plan(data, activity_id)
+
+
+async def run_mode(name: str, plan_fn, data: TerraformRunDetails, iterations: int) -> None:
+	runner = CountingRunner()
+	start = time.perf_counter()
+
+	for i in range(iterations):
+		await plan_fn(runner, data, f"bench-{i}")
+
+	elapsed = time.perf_counter() - start
+	print(f"{name:<12} wall-clock: {elapsed / iterations:.3f}s/plan  "
+		f"subprocesses: {runner.subprocess_count / iterations:.1f}/plan")
+
+
+async def main(arguments) -> None:
+	iterations = int(arguments["--iterations"])
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		bin_dir = os.path.join(tmp_dir, "bin")
+		os.makedirs(bin_dir)
+		terraform_path = os.path.join(bin_dir, "terraform")
+
+		with open(terraform_path, "w") as fh:
+			fh.write(FAKE_TERRAFORM)
+
+		os.chmod(terraform_path, os.stat(terraform_path).st_mode | stat.S_IEXEC)
+
+		data = TerraformRunDetails(
+			directory=tmp_dir,
+			env_vars={
+				"PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+				"FAKE_TF_REFRESH_SECS": arguments["--refresh-secs"],
+				"FAKE_TF_SHOW_SECS": arguments["--show-secs"],
+			},
+		)
+
+		await run_mode("legacy", legacy_plan, data, iterations)
+		await run_mode("single-pass", single_pass_plan, data, iterations)
+
+
+if __name__ == "__main__":
+	asyncio.run(main(docopt(__doc__)))
@@ -0,0 +1,245 @@
+"""Workflow Replay Benchmark
+
+Replays ProvisionInfraWorkflow and DeprovisionInfraWorkflow histories the way
+a worker does after a cache miss or a restart, and reports replays per second,
+per history latency and peak memory, with and without the EncryptionCodec.
+
+The recorded histories in tests/histories are always replayed. Synthetic
+histories are recorded once, by running the happy path, approval, API failure,
+ephemeral and destroy scenarios with mocked activities on a time skipping test
+server, for every plan size. They are kept in the histories directory and only
+recorded again with --record, so later runs replay the same histories offline.
+
+Usage:
+  replay_benchmark.py [--iterations=<n>] [--plan-sizes=<bytes>] [--histories-dir=<dir>] [--record] [--no-synthetic] [--unsandboxed]
+
+Options:
+  --iterations=<n>       Number of times every history is replayed [default: 5]
+  --plan-sizes=<bytes>   Comma separated sizes of the synthetic plans [default: 1024,65536,1048576]
+  --histories-dir=<dir>  Where synthetic histories are kept [default: benchmarks/histories]
+  --record               Record the synthetic histories again, even if they exist
+  --no-synthetic         Only replay the recorded histories in tests/histories
+  --unsandboxed          Replay without the workflow sandbox
+
+"""
+import asyncio
+import dataclasses
+import glob
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+from docopt import docopt
+from temporalio import activity, converter
+from temporalio.client import Client, WorkflowHistory
+from temporalio.testing import WorkflowEnvironment
+from temporalio.worker import Replayer, UnsandboxedWorkflowRunner, Worker
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.base import ApplyDecisionDetails, TerraformRunDetails, TerraformRunResult
+from shared.codec import EncryptionCodec
+from workflows.apply import ProvisionInfraWorkflow
+from workflows.destroy import DeprovisionInfraWorkflow
+
+RECORDED_HISTORIES = os.path.join(os.path.dirname(__file__), "..", "tests", "histories", "*_encrypted.json")
+BENCHMARK_TASK_QUEUE = "replay-benchmark"
+
+# Run details of each synthetic scenario, on top of the defaults
+SCENARIOS = {
+	"happy_path": {},
+	"approval": {"soft_fail_policy": True},
+	"api_failure": {"simulate_api_failure": True},
+	"ephemeral": {"ephemeral": True, "ephemeral_ttl": 60},
+	"destroy": {},
+}
+
+# Rough size of a resource change in the plan JSON, used to size the summary with the plan
+BYTES_PER_CHANGE = 512
+
+
+def data_converter(encrypted: bool) -> converter.DataConverter:
+	if not encrypted:
+		return converter.default()
+
+	return dataclasses.replace(
+		converter.default(),
+		payload_codec=EncryptionCodec(),
+		failure_converter_class=converter.DefaultFailureConverterWithEncodedAttributes,
+	)
+
+
+@activity.defn(name="terraform_init")
+async def terraform_init_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform has been successfully initialized!", ""
+
+
+@activity.defn(name="terraform_plan")
+async def terraform_plan_mocked(data: TerraformRunDetails) -> tuple:
+	plan_bytes = int(data.env_vars["BENCHMARK_PLAN_BYTES"])
+	changes = [
+		{"address": f"kubernetes_config_map.bench[{i}]", "type": "kubernetes_config_map", "action": "create", "after": {}}
+		for i in range(max(1, plan_bytes // BYTES_PER_CHANGE))
+	]
+	summary = {
+		"digest": f"bench-{plan_bytes}",
+		"counts": {"create": len(changes)},
+		"by_action": {"create": list(range(len(changes)))},
+		"by_type": {"kubernetes_config_map": list(range(len(changes)))},
+		"changes": changes,
+	}
+	return "+" * plan_bytes, summary
+
+
+@activity.defn(name="policy_check")
+async def policy_check_mocked(data: TerraformRunDetails) -> bool:
+	return not data.soft_fail_policy
+
+
+@activity.defn(name="terraform_apply")
+async def terraform_apply_mocked(data: TerraformRunDetails) -> TerraformRunResult:
+	if data.simulate_api_failure and activity.info().attempt < 5:
+		raise RuntimeError("Terraform cannot reach the API")
+	return TerraformRunResult(counts={"add": 1, "change": 0, "remove": 0}, state_serial=2, log_path="/tmp/apply.log")
+
+
+@activity.defn(name="terraform_destroy")
+async def terraform_destroy_mocked(data: TerraformRunDetails) -> TerraformRunResult:
+	return TerraformRunResult(counts={"add": 0, "change": 0, "remove": 1}, state_serial=3, log_path="/tmp/destroy.log")
+
+
+@activity.defn(name="terraform_output")
+async def terraform_output_mocked(data: TerraformRunDetails) -> dict:
+	return {"kuard_url": {"value": "http://localhost:8080", "type": "string", "sensitive": False}}
+
+
+async def record_history(client: Client, scenario: str, plan_bytes: int, workflow_id: str) -> WorkflowHistory:
+	"""Run a scenario to completion and return its history."""
+
+	data = TerraformRunDetails(
+		directory="terraform/minikube_kuard",
+		id=workflow_id,
+		env_vars={"BENCHMARK_PLAN_BYTES": str(plan_bytes)},
+		# The test server doesn't have the custom search attributes
+		include_custom_search_attrs=False,
+		**SCENARIOS[scenario],
+	)
+
+	workflow = DeprovisionInfraWorkflow if scenario == "destroy" else ProvisionInfraWorkflow
+	handle = await client.start_workflow(workflow.run, data, id=workflow_id, task_queue=BENCHMARK_TASK_QUEUE)
+
+	if scenario == "approval":
+		while await handle.query(ProvisionInfraWorkflow.get_current_status) != "awaiting approval decision":
+			await asyncio.sleep(0.1)
+		await handle.signal(
+			ProvisionInfraWorkflow.signal_apply_decision, ApplyDecisionDetails(is_approved=True, reason="benchmark")
+		)
+
+	await handle.result()
+	return await handle.fetch_history()
+
+
+async def record_synthetic_histories(histories_dir: str, plan_sizes: List[int]) -> None:
+	os.makedirs(histories_dir, exist_ok=True)
+
+	for encrypted in (False, True):
+		async with await WorkflowEnvironment.start_time_skipping(data_converter=data_converter(encrypted)) as env:
+			async with Worker(
+				env.client,
+				task_queue=BENCHMARK_TASK_QUEUE,
+				workflows=[ProvisionInfraWorkflow, DeprovisionInfraWorkflow],
+				activities=[
+					terraform_init_mocked,
+					terraform_plan_mocked,
+					policy_check_mocked,
+					terraform_apply_mocked,
+					terraform_destroy_mocked,
+					terraform_output_mocked,
+				],
+			):
+				for scenario in SCENARIOS:
+					for plan_bytes in plan_sizes:
+						name = f"{scenario}-{plan_bytes}-{'encrypted' if encrypted else 'plain'}"
+						history = await record_history(env.client, scenario, plan_bytes, f"replay-benchmark-{name}")
+						with open(os.path.join(histories_dir, f"{name}.json"), "w") as fh:
+							fh.write(history.to_json())
+						print(f"Recorded {name}: {len(history.events)} event(s)")
+
+
+def load_histories(paths: List[str]) -> List[Tuple[str, WorkflowHistory]]:
+	histories = []
+
+	for path in sorted(paths):
+		with open(path, "r") as fh:
+			history_json = fh.read()
+		workflow_id = json.loads(history_json)["events"][0]["workflowExecutionStartedEventAttributes"].get("workflowId")
+		histories.append((os.path.basename(path), WorkflowHistory.from_json(workflow_id or path, history_json)))
+
+	return histories
+
+
+async def replay_group(
+	name: str, histories: List[Tuple[str, WorkflowHistory]], encrypted: bool, iterations: int, sandboxed: bool
+) -> None:
+	"""Replay every history of a group, reporting throughput and latency from
+	timed passes, and the peak Python memory of a separate traced pass."""
+
+	replayer_kwargs = {} if sandboxed else {"workflow_runner": UnsandboxedWorkflowRunner()}
+	replayer = Replayer(
+		workflows=[ProvisionInfraWorkflow, DeprovisionInfraWorkflow],
+		data_converter=data_converter(encrypted),
+		**replayer_kwargs,
+	)
+
+	latencies: Dict[str, List[float]] = {history_name: [] for history_name, _ in histories}
+	start = time.perf_counter()
+
+	for _ in range(iterations):
+		for history_name, history in histories:
+			replay_start = time.perf_counter()
+			await replayer.replay_workflow(history)
+			latencies[history_name].append(time.perf_counter() - replay_start)
+
+	elapsed = time.perf_counter() - start
+
+	# Tracing slows everything down, so memory is measured on its own pass
+	tracemalloc.start()
+	for _, history in histories:
+		await replayer.replay_workflow(history)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	replays = iterations * len(histories)
+	print(f"\n{name}: {replays / elapsed:.1f} replays/s, peak Python memory {peak / 1024 / 1024:.1f} MiB")
+	for history_name, samples in latencies.items():
+		print(f"  {history_name:<48} median {statistics.median(samples) * 1000:8.2f}ms  max {max(samples) * 1000:8.2f}ms")
+
+
+async def main(arguments) -> None:
+	iterations = int(arguments["--iterations"])
+	sandboxed = not arguments["--unsandboxed"]
+
+	await replay_group("recorded (encrypted)", load_histories(glob.glob(RECORDED_HISTORIES)), True, iterations, sandboxed)
+
+	if arguments["--no-synthetic"]:
+		return
+
+	histories_dir = arguments["--histories-dir"]
+	if arguments["--record"] or not glob.glob(os.path.join(histories_dir, "*.json")):
+		plan_sizes = [int(size) for size in arguments["--plan-sizes"].split(",")]
+		await record_synthetic_histories(histories_dir, plan_sizes)
+
+	for codec in ("plain", "encrypted"):
+		histories = load_histories(glob.glob(os.path.join(histories_dir, f"*-{codec}.json")))
+		await replay_group(f"synthetic ({codec})", histories, codec == "encrypted", iterations, sandboxed)
+
+	# Includes the Rust core and the codec buffers, which tracemalloc doesn't see
+	print(f"\nPeak resident set size: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+	asyncio.run(main(docopt(__doc__)))
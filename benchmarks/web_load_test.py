@@ -0,0 +1,86 @@
+"""Web Server Load Test
+
+Sends requests to a running web server from a number of concurrent clients,
+and reports the requests per second, the latency percentiles and the errors
+of every path. Run it against the web server before and after a change to
+compare them, e.g. with 'poetry run python web_server.py' in another shell.
+
+Paths that query a workflow need a Temporal server and a worker, and the ID
+of a workflow they can answer for, e.g. one started from the UI.
+
+Usage:
+  web_load_test.py [--url=<url>] [--paths=<paths>] [--concurrency=<n>] [--requests=<n>] [--warmup=<n>]
+
+Options:
+  --url=<url>          Base URL of the web server [default: http://localhost:3000]
+  --paths=<paths>      Comma separated paths to request, in turn [default: /]
+  --concurrency=<n>    Number of clients sending requests at once [default: 50]
+  --requests=<n>       Number of requests sent per path [default: 2000]
+  --warmup=<n>         Number of requests sent per path before measuring [default: 50]
+
+"""
+import asyncio
+import itertools
+import statistics
+import time
+from typing import Dict, List, Tuple
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from docopt import docopt
+
+
+def percentile(samples: List[float], percent: float) -> float:
+	ordered = sorted(samples)
+	return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def load(session: ClientSession, url: str, requests: int, concurrency: int) -> Tuple[float, List[float], int]:
+	"""Send requests to a URL from concurrent clients, returning the elapsed
+	time, the latency of every request and the number of failed requests."""
+
+	latencies: List[float] = []
+	errors = 0
+	counter = itertools.count()
+
+	async def client() -> None:
+		nonlocal errors
+		while next(counter) < requests:
+			start = time.perf_counter()
+			try:
+				async with session.get(url) as response:
+					await response.read()
+					if response.status >= 400:
+						errors += 1
+			except Exception:
+				errors += 1
+			latencies.append(time.perf_counter() - start)
+
+	start = time.perf_counter()
+	await asyncio.gather(*(client() for _ in range(concurrency)))
+	return time.perf_counter() - start, latencies, errors
+
+
+async def main(arguments) -> None:
+	concurrency = int(arguments["--concurrency"])
+	requests = int(arguments["--requests"])
+	warmup = int(arguments["--warmup"])
+	paths = [path.strip() for path in arguments["--paths"].split(",") if path.strip()]
+	results: Dict[str, Tuple[float, List[float], int]] = {}
+
+	connector = TCPConnector(limit=concurrency)
+	async with ClientSession(connector=connector, timeout=ClientTimeout(total=60)) as session:
+		for path in paths:
+			url = arguments["--url"].rstrip("/") + path
+			await load(session, url, warmup, min(concurrency, warmup or 1))
+			results[path] = await load(session, url, requests, concurrency)
+
+	print(f"{concurrency} concurrent client(s), {requests} request(s) per path")
+	print(f"{'rps':>10} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10} {'errors':>8}  path")
+	for path, (elapsed, latencies, errors) in results.items():
+		print(
+			f"{len(latencies) / elapsed:>10.1f} {statistics.median(latencies) * 1000:>10.2f} "
+			f"{percentile(latencies, 99) * 1000:>10.2f} {max(latencies) * 1000:>10.2f} {errors:>8}  {path}"
+		)
+
+
+if __name__ == "__main__":
+	asyncio.run(main(docopt(__doc__)))
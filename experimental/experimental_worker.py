@@ -5,6 +5,9 @@ from temporalio.worker import Worker
 from shared.activities import ProvisioningActivities
 from workflows.apply import ProvisionInfraWorkflow
 from workflows.destroy import DeprovisionInfraWorkflow
+from workflows.stacks import ProvisionStacksWorkflow, DeprovisionStacksWorkflow
+from workflows.stack_entity import StackEntityWorkflow
+from workflows.drift import DriftDetectionWorkflow, StackDriftCheckWorkflow
 from temporalio.client import Client
 from shared.base import TEMPORAL_ADDRESS, TEMPORAL_NAMESPACE, TEMPORAL_API_KEY
 
@@ -42,14 +45,24 @@ async def main() -> None:
 	worker: Worker = Worker(
 		client,
 		task_queue=TEMPORAL_TASK_QUEUE,
-		workflows=[ProvisionInfraWorkflow, DeprovisionInfraWorkflow],
+		workflows=[
+			ProvisionInfraWorkflow,
+			DeprovisionInfraWorkflow,
+			ProvisionStacksWorkflow,
+			DeprovisionStacksWorkflow,
+			StackEntityWorkflow,
+			DriftDetectionWorkflow,
+			StackDriftCheckWorkflow,
+		],
 		activities=[
 			activities.terraform_init,
 			activities.terraform_plan,
+			activities.terraform_drift_check,
 			activities.terraform_apply,
 			activities.terraform_destroy,
 			activities.terraform_output,
 			activities.policy_check,
+			activities.cleanup_workspace,
 		]
 	)
 
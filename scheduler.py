@@ -4,7 +4,8 @@ import logging
 import os
 from datetime import timedelta
 from workflows.destroy import DeprovisionInfraWorkflow
-from shared.base import TerraformRunDetails, get_temporal_client, TEMPORAL_TASK_QUEUE
+from workflows.drift import DriftDetectionWorkflow
+from shared.base import TerraformRunDetails, DriftDetectionDetails, get_temporal_client, TEMPORAL_TASK_QUEUE
 
 from temporalio.common import TypedSearchAttributes, SearchAttributeKey, \
 	SearchAttributePair
@@ -64,6 +65,37 @@ async def main():
 
 	print(f"Destroy schedule created with ID: {minikube_kuard_schedule_id}")
 
+	# Create the hourly drift detection schedule. Each check in a run is
+	# delayed at random on top of the schedule's own jitter, so runs don't
+	# line up with other hourly jobs and checks don't start all at once.
+	drift_schedule_id = f"drift-detection-schedule-{uuid.uuid4()}"
+	await client.create_schedule(
+		drift_schedule_id,
+		Schedule(
+			action=ScheduleActionStartWorkflow(
+				DriftDetectionWorkflow.run,
+				DriftDetectionDetails(
+					id="drift-detection",
+					runs=[
+						TerraformRunDetails(
+							directory=minikube_kuard_dir,
+							env_vars=tcloud_env_vars,
+						),
+					],
+				),
+				id=f"scheduled-drift-detection-{uuid.uuid4()}",
+				task_queue=TEMPORAL_TASK_QUEUE,
+			),
+			spec=ScheduleSpec(
+				intervals=[ScheduleIntervalSpec(every=timedelta(hours=1))],
+				jitter=timedelta(minutes=5),
+			),
+			state=ScheduleState(note="Fleet wide drift detection schedule."),
+		),
+	)
+
+	print(f"Drift detection schedule created with ID: {drift_schedule_id}")
+
 if __name__ == "__main__":
 	# Run the main function
 	asyncio.run(main())
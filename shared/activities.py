@@ -1,28 +1,129 @@
-import json
+import time
 import asyncio
+import dataclasses
 
-from typing import Tuple
+from datetime import datetime, timezone
+from typing import Optional, Tuple, Union
 from temporalio import activity
-from temporalio.exceptions import ActivityError
+from temporalio.api.enums.v1 import TaskQueueType
+from temporalio.api.taskqueue.v1 import TaskQueue
+from temporalio.api.workflowservice.v1 import DescribeTaskQueueRequest
+from temporalio.client import Client
+from temporalio.common import MetricMeter
+from temporalio.exceptions import ActivityError, ApplicationError
+from shared.plan_summary import PlanSummary, summarize_plan
+from shared.policy import PolicyEngine, load_policy_rules
+from shared.tf_progress import ApplyProgress, ProgressTracker
+from shared.tf_capture import CapturedOutput
 from shared.tf_runner import TerraformRunner
-from shared.base import TerraformRunDetails, TerraformApplyError, \
+from shared.offload import ParsingPool
+from shared.tf_scheduler import TerraformScheduler
+from shared.workspace import WorkspaceManager
+from shared.base import TerraformRunDetails, TerraformRunResult, DriftResult, TerraformApplyError, \
 	TerraformInitError, TerraformPlanError, TerraformOutputError, \
 	TerraformMissingEnvVarsError, TerraformAPIFailureError, \
-		TerraformDestroyError, TerraformRecoverableError
+		TerraformDestroyError, TerraformRecoverableError, POLICY_RULES_FILE, HOST_POLLER_GONE_SECS, \
+	TEMPORAL_TASK_QUEUE
 
 
 class ProvisioningActivities:
 
-	def __init__(self) -> None:
-		self._runner = TerraformRunner()
-
-	# Heartbeat function to be run concurrently
-	async def _heartbeat(self, duration: int=1):
+	def __init__(
+		self,
+		metric_meter: Optional[MetricMeter] = None,
+		host_task_queue: str = "",
+		client: Optional[Client] = None,
+	) -> None:
+		# Advertised by init, when this worker also polls a task queue of its own
+		self._host_task_queue = host_task_queue
+		# Looks up whether a host still polls its task queue
+		self._client = client
+		self._scheduler = TerraformScheduler(metric_meter=metric_meter)
+		self._parsing_pool = ParsingPool()
+		self._runner = TerraformRunner(scheduler=self._scheduler, parsing_pool=self._parsing_pool)
+		self._workspaces = WorkspaceManager()
+		# Compiled once, when the worker starts, rather than for every check
+		self._policy = PolicyEngine(load_policy_rules(POLICY_RULES_FILE))
+
+	def _with_run_id(self, data: TerraformRunDetails) -> TerraformRunDetails:
+		"""Key the run by its workflow ID when it has no ID of its own. Isolated
+		runs need an ID of their own, their state is picked up by the later
+		workflows of the same stack, e.g. the one that deprovisions it."""
+
+		if data.id:
+			return data
+
+		if data.isolated_workspace:
+			raise ApplicationError(
+				"Isolated workspaces require a TerraformRunDetails.id",
+				type="TerraformMissingRunIdError",
+				non_retryable=True,
+			)
+
+		return dataclasses.replace(data, id=activity.info().workflow_id)
+
+	def _prepare_run(self, data: TerraformRunDetails) -> TerraformRunDetails:
+		"""Point the run at its own isolated workspace, if it asked for one."""
+
+		data = self._with_run_id(data)
+
+		if not data.isolated_workspace:
+			return data
+
+		return dataclasses.replace(data, directory=self._workspaces.ensure(data))
+
+	def _save_state(self, data: TerraformRunDetails) -> None:
+		"""Save the state of an isolated run, so that it survives a host change."""
+
+		if data.isolated_workspace:
+			self._workspaces.save_state(self._with_run_id(data))
+
+	async def prewarm(self, directories: list[str]) -> None:
+		"""Initialize Terraform directories before any workflow needs them."""
+
+		await self._runner.prewarm(directories)
+
+	def _progress_tracker(self, plan_summary: Optional[PlanSummary] = None) -> ProgressTracker:
+		"""Track the progress of an apply or destroy, picking up from where
+		the previous attempt got to if this is a retry."""
+
+		info = activity.info()
+		resumed = None
+
+		# Heartbeats from before progress was reported are plain strings
+		if info.heartbeat_details and isinstance(info.heartbeat_details[0], dict):
+			resumed = ApplyProgress.from_dict(info.heartbeat_details[0])
+			activity.logger.info(
+				f"Attempt {resumed.attempt} completed {resumed.completed} of {resumed.planned} resource(s), "
+				f"resuming with attempt {info.attempt}"
+			)
+
+		return ProgressTracker(plan_summary=plan_summary, resumed=resumed, attempt=info.attempt)
+
+	# Heartbeat function to be run concurrently, reporting the progress once
+	# per interval however many events Terraform emits in between.
+	async def _heartbeat(self, progress: Optional[ProgressTracker] = None, duration: int=1):
 		while True:
 			activity.logger.info(f"Sleeping for {duration} second(s) then heartbeating")
-			activity.heartbeat("Sending heartbeat...")
+			activity.heartbeat(progress.progress().to_dict() if progress else "Sending heartbeat...")
 			await asyncio.sleep(duration)
 
+	async def _run_result(
+		self, data: TerraformRunDetails, progress: ProgressTracker, stdout: CapturedOutput, started: float
+	) -> TerraformRunResult:
+		"""Summarize a finished apply or destroy for the workflow history."""
+
+		snapshot = await self._runner.state_snapshot(self._prepare_run(data))
+
+		return TerraformRunResult(
+			counts=progress.change_counts,
+			failed=progress.progress().failed,
+			duration_secs=round(time.monotonic() - started, 3),
+			state_serial=snapshot.serial if snapshot else 0,
+			diagnostics=progress.diagnostics,
+			log_path=stdout.log_path,
+		)
+
 	@activity.defn
 	async def terraform_init(self, data: TerraformRunDetails) -> tuple:
 		"""Initialize the Terraform configuration."""
@@ -35,7 +136,7 @@ class ProvisioningActivities:
 		activity.logger.info("Sleeping for 3 seconds to slow execution down")
 
 		try:
-			init_stdout, init_stderr = await self._runner.init(data)
+			init_stdout, init_stderr = await self._runner.init(self._prepare_run(data))
 			activity.logger.debug(f"Terraform init succeeded: {init_stdout}")
 		except TerraformInitError as tfie:
 			activity.logger.error(f"Terraform init errored: {init_stderr}")
@@ -44,7 +145,38 @@ class ProvisioningActivities:
 			activity.logger.error(f"Terraform init errored: {init_stderr}")
 			raise ae
 
-		return init_stdout, init_stderr
+		# The rest of the run is routed to this host's task queue, where the
+		# directory is now initialized.
+		return init_stdout, init_stderr, self._host_task_queue
+
+	@activity.defn
+	async def host_task_queue_polled(self, task_queue: str) -> bool:
+		"""Whether the host behind a task queue is still up, only too busy to
+		pick anything up. A host whose activity slots are all taken stops
+		polling its own task queue, but its workflow worker, which identifies
+		itself by the same task queue, keeps polling the shared one. Without a
+		client, the host is assumed gone."""
+
+		if self._client is None:
+			return False
+
+		now = datetime.now(timezone.utc)
+		for name, task_queue_type in (
+			(task_queue, TaskQueueType.TASK_QUEUE_TYPE_ACTIVITY),
+			(TEMPORAL_TASK_QUEUE, TaskQueueType.TASK_QUEUE_TYPE_WORKFLOW),
+		):
+			response = await self._client.workflow_service.describe_task_queue(DescribeTaskQueueRequest(
+				namespace=self._client.namespace,
+				task_queue=TaskQueue(name=name),
+				task_queue_type=task_queue_type,
+			))
+			for poller in response.pollers:
+				from_host = name == task_queue or poller.identity.endswith(f"@{task_queue}")
+				seen_secs = (now - poller.last_access_time.ToDatetime(tzinfo=timezone.utc)).total_seconds()
+				if from_host and seen_secs < HOST_POLLER_GONE_SECS:
+					return True
+
+		return False
 
 	@activity.defn
 	async def terraform_plan(self, data: TerraformRunDetails) -> tuple:
@@ -54,7 +186,7 @@ class ProvisioningActivities:
 		# raise TerraformRecoverableError("This is a recoverable error")
 
 		activity.logger.info("Terraform plan")
-		plan_json_stdout, plan_json_stderr, plan_stdout, plan_stderr = "", "", "", ""
+		plan_stdout, plan_stderr = "", ""
 		activity_id = activity.info().activity_id
 
 		if not data.env_vars:
@@ -62,20 +194,50 @@ class ProvisioningActivities:
 			raise TerraformMissingEnvVarsError("Missing environment variables, cannot proceed.")
 
 		try:
-			plan_json_stdout, plan_json_stderr, plan_stdout, plan_stderr = await self._runner.plan(data, activity_id)
-			self._runner.set_plan(json.loads(plan_json_stdout))
-			activity.logger.debug(f"Terraform plan succeeded: {plan_json_stdout}")
+			plan_stdout, plan_stderr, plan_summary = await self._runner.plan(self._prepare_run(data), activity_id)
+			activity.logger.debug(f"Terraform plan succeeded: {plan_summary.counts}, digest {plan_summary.digest}")
 		except TerraformPlanError as tfpe:
-			activity.logger.error(f"Terraform plan errored: {plan_json_stderr}, {plan_stderr}")
+			activity.logger.error(f"Terraform plan errored: {plan_stderr}")
 			raise tfpe
 		except ActivityError as ae:
-			activity.logger.error(f"Terraform plan errored: {plan_json_stderr}, {plan_stderr}")
+			activity.logger.error(f"Terraform plan errored: {plan_stderr}")
 			raise ae
 
-		return plan_stdout, plan_json_stdout
+		# Only the text plan, for people, and the compact summary, for the
+		# steps after the plan, end up in the history, never the plan JSON.
+		return plan_stdout, plan_summary
 
 	@activity.defn
-	async def terraform_apply(self, data: TerraformRunDetails) -> str:
+	async def terraform_drift_check(self, data: TerraformRunDetails) -> DriftResult:
+		"""Check the Terraform configuration for drift, returning the plan only
+		when there is some."""
+
+		activity.logger.info("Terraform drift check")
+
+		if not data.env_vars:
+			activity.logger.debug("Missing environment variables, cannot proceed.")
+			raise TerraformMissingEnvVarsError("Missing environment variables, cannot proceed.")
+
+		drifted, plan_stdout, plan_summary = \
+			await self._runner.drift_check(self._prepare_run(data), activity.info().activity_id)
+
+		if not drifted:
+			activity.logger.debug(f"No drift in {data.directory}")
+			return DriftResult(directory=data.directory)
+
+		activity.logger.info(f"Drift in {data.directory}: {plan_summary.counts}, digest {plan_summary.digest}")
+		return DriftResult(
+			directory=data.directory,
+			status="drifted",
+			digest=plan_summary.digest,
+			counts=plan_summary.counts,
+			plan=plan_stdout,
+		)
+
+	# Runs from before the compact result returned the output as a string,
+	# workflows replaying them still decode it with this annotation.
+	@activity.defn
+	async def terraform_apply(self, data: TerraformRunDetails) -> Union[TerraformRunResult, str]:
 		"""Apply the Terraform configuration."""
 
 		activity.logger.info("Terraform apply")
@@ -87,23 +249,32 @@ class ProvisioningActivities:
 			await asyncio.sleep(3)
 			activity.logger.info("Sleeping for 3 seconds to slow execution down")
 
+		started = time.monotonic()
 		try:
-			heartbeat_task = asyncio.create_task(self._heartbeat())
-			runner_apply_task = asyncio.create_task(self._runner.apply(data))
-
-			# Await the apply task
-			apply_stdout, apply_stderr = await runner_apply_task
-
-			# Cancel the heartbeat task after the long task completes
-			heartbeat_task.cancel()
+			progress = self._progress_tracker(data.plan_summary)
+			heartbeat_task = asyncio.create_task(self._heartbeat(progress))
+			runner_apply_task = asyncio.create_task(
+				self._runner.apply(self._prepare_run(data), on_event=progress.feed_line)
+			)
 
 			try:
-				# Wait for the heartbeat task to fully cancel
-				await heartbeat_task
-			except asyncio.CancelledError:
-				activity.logger.debug("Apply heartbeat cancelled.")
-
-			activity.logger.debug(f"Terraform apply succeeded: {apply_stdout}")
+				# Await the apply task, if the activity is cancelled or times out
+				# this also cancels it, which stops the Terraform process.
+				apply_stdout, apply_stderr = await runner_apply_task
+			finally:
+				# Cancel the heartbeat task after the long task completes
+				heartbeat_task.cancel()
+
+				try:
+					# Wait for the heartbeat task to fully cancel
+					await heartbeat_task
+				except asyncio.CancelledError:
+					activity.logger.debug("Apply heartbeat cancelled.")
+
+				# Even a failed apply can change the state
+				self._save_state(data)
+
+			activity.logger.debug(f"Terraform apply succeeded: {apply_stdout.summary()}")
 		except TerraformApplyError as tfae:
 			activity.logger.error(f"Terraform apply errored: {apply_stderr}")
 			raise tfae
@@ -111,18 +282,20 @@ class ProvisioningActivities:
 			activity.logger.error(f"Terraform apply errored: {apply_stderr}")
 			raise ae
 
-		return apply_stdout
+		# Only return a summary of the run and the path of the full log, rather
+		# than its output, which the workflow would carry in its history.
+		return await self._run_result(data, progress, apply_stdout, started)
 
 	@activity.defn
 	async def terraform_output(self, data: TerraformRunDetails) -> dict:
 		"""Show the output of the Terraform run."""
 
 		activity.logger.info("Terraform output")
-		output_stdout, output_stderr = "", ""
+		outputs, output_stderr = {}, ""
 
 		try:
-			output_stdout, output_stderr = await self._runner.output(data)
-			activity.logger.debug(f"Terraform output succeeded: {output_stdout}")
+			outputs, output_stderr = await self._runner.output(self._prepare_run(data))
+			activity.logger.debug(f"Terraform output succeeded: {outputs}")
 		except TerraformOutputError as tfoe:
 			activity.logger.error(f"Terraform output errored: {output_stderr}")
 			raise tfoe
@@ -130,32 +303,43 @@ class ProvisioningActivities:
 			activity.logger.error(f"Terraform output errored: {output_stderr}")
 			raise ae
 
-		return json.loads(output_stdout)
+		return outputs
 
+	# Runs from before the compact result returned the output as a string,
+	# workflows replaying them still decode it with this annotation.
 	@activity.defn
-	async def terraform_destroy(self, data: TerraformRunDetails) -> str:
+	async def terraform_destroy(self, data: TerraformRunDetails) -> Union[TerraformRunResult, str]:
 		"""Destroy the Terraform configuration."""
 
 		activity.logger.info("Terraform destroy")
 		destroy_stdout, destroy_stderr = "", ""
 
+		started = time.monotonic()
 		try:
-			heartbeat_task = asyncio.create_task(self._heartbeat())
-			runner_destroy_task = asyncio.create_task(self._runner.destroy(data))
-
-			# Await the destroy task
-			destroy_stdout, destroy_stderr = await runner_destroy_task
-
-			# Cancel the heartbeat task after the long task completes
-			heartbeat_task.cancel()
+			progress = self._progress_tracker()
+			heartbeat_task = asyncio.create_task(self._heartbeat(progress))
+			runner_destroy_task = asyncio.create_task(
+				self._runner.destroy(self._prepare_run(data), on_event=progress.feed_line)
+			)
 
 			try:
-				# Wait for the heartbeat task to fully cancel
-				await heartbeat_task
-			except asyncio.CancelledError:
-				activity.logger.debug("Destroy heartbeat cancelled.")
-
-			activity.logger.debug(f"Terraform destroy succeeded: {destroy_stdout}")
+				# Await the destroy task, if the activity is cancelled or times out
+				# this also cancels it, which stops the Terraform process.
+				destroy_stdout, destroy_stderr = await runner_destroy_task
+			finally:
+				# Cancel the heartbeat task after the long task completes
+				heartbeat_task.cancel()
+
+				try:
+					# Wait for the heartbeat task to fully cancel
+					await heartbeat_task
+				except asyncio.CancelledError:
+					activity.logger.debug("Destroy heartbeat cancelled.")
+
+				# Even a failed destroy can change the state
+				self._save_state(data)
+
+			activity.logger.debug(f"Terraform destroy succeeded: {destroy_stdout.summary()}")
 		except TerraformDestroyError as tfde:
 			activity.logger.error(f"Terraform destroy errored: {destroy_stderr}")
 			raise tfde
@@ -163,7 +347,9 @@ class ProvisioningActivities:
 			activity.logger.error(f"Terraform destroy errored: {destroy_stderr}")
 			raise ae
 
-		return destroy_stdout
+		# Only return a summary of the run and the path of the full log, rather
+		# than its output, which the workflow would carry in its history.
+		return await self._run_result(data, progress, destroy_stdout, started)
 
 	@activity.defn
 	async def policy_check(self, data: TerraformRunDetails) -> bool:
@@ -171,8 +357,27 @@ class ProvisioningActivities:
 		checking for admin users being added at the account level."""
 
 		activity.logger.info("Policy check (could be external but isn't for now)")
-		await asyncio.sleep(3)
-		activity.logger.info("Sleeping for 3 seconds to slow execution down")
+
+		# Runs from before the plan summary existed only carry the plan JSON
+		plan_summary = data.plan_summary
+		if plan_summary is None and data.plan:
+			plan_summary = await self._parsing_pool.run(len(data.plan), summarize_plan, data.plan)
+
+		if plan_summary is not None:
+			decision = self._policy.evaluate(plan_summary)
+			for violation in decision.violations:
+				activity.logger.warning(f"Policy {violation.rule} failed for {violation.address}: {violation.message}")
+			if not decision.passed:
+				return False
 
 		# Return false to fail the policy check, use not to invert the flag
 		return not data.soft_fail_policy
+
+	@activity.defn
+	async def cleanup_workspace(self, data: TerraformRunDetails) -> None:
+		"""Garbage collect the isolated workspace of a finished run."""
+
+		activity.logger.info("Cleanup workspace")
+		data = self._with_run_id(data)
+		self._workspaces.release(data)
+		self._runner.discard_saved_plans(data)
@@ -1,14 +1,15 @@
 import os
+import socket
 import dataclasses
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from typing_extensions import runtime
 from temporalio.client import Client
 from temporalio.service import  TLSConfig
 from temporalio import converter
 from temporalio.runtime import Runtime
 
-from shared.codec import CompressionCodec, EncryptionCodec
+from shared.plan_summary import PlanSummary
 
 # Get the Temporal host URL from environment variable, default to "localhost:7233" if not set
 TEMPORAL_ADDRESS = os.environ.get("TEMPORAL_ADDRESS", "localhost:7233")
@@ -23,15 +24,103 @@ TEMPORAL_NAMESPACE = os.environ.get("TEMPORAL_NAMESPACE", "default")
 # Get the Temporal task queue from environment variable, default to "provision-infra" if not set
 TEMPORAL_TASK_QUEUE = os.environ.get("TEMPORAL_TASK_QUEUE", "provision-infra")
 
+# Task queue only this host's worker polls, so that every step of a run lands where its workspace was initialized
+TEMPORAL_HOST_TASK_QUEUE = os.environ.get("TEMPORAL_HOST_TASK_QUEUE", f"{TEMPORAL_TASK_QUEUE}-{socket.gethostname()}")
+
+# How long an activity waits on a host's task queue before checking whether the host is still
+# there, and how many other hosts a run moves to before it falls back to the shared task queue
+HOST_TASK_QUEUE_SCHEDULE_TO_START_SECS = int(os.environ.get("HOST_TASK_QUEUE_SCHEDULE_TO_START_SECS", 60))
+HOST_AFFINITY_MAX_REROUTES = int(os.environ.get("HOST_AFFINITY_MAX_REROUTES", 2))
+
+# Seconds without a poll from a host after which it is considered gone, idle workers poll at least
+# every minute
+HOST_POLLER_GONE_SECS = int(os.environ.get("HOST_POLLER_GONE_SECS", 180))
+
 # Get the Temporal Cloud API key from environment variable
 TEMPORAL_API_KEY = os.environ.get("TEMPORAL_API_KEY", "")
 
 # Determine if payloads should be encrypted based on the value of the "ENCRYPT_PAYLOADS" environment variable
 ENCRYPT_PAYLOADS = os.getenv("ENCRYPT_PAYLOADS", 'false').lower() in ('true', '1', 't')
 
+# Determine if large payloads should be offloaded to a blob store based on the "CLAIM_CHECK_PAYLOADS" environment variable
+CLAIM_CHECK_PAYLOADS = os.getenv("CLAIM_CHECK_PAYLOADS", 'false').lower() in ('true', '1', 't')
+
 # Set the Terraform common timeout in seconds
 TERRAFORM_COMMON_TIMEOUT_SECS = 300
 
+# Directory that full Terraform command output is spilled to, the runner defaults to a temp dir if not set
+TERRAFORM_LOG_DIR = os.environ.get("TERRAFORM_LOG_DIR", "")
+
+# Maximum size of a single Terraform log file before it is rotated, and the number of backups kept
+TERRAFORM_LOG_MAX_BYTES = int(os.environ.get("TERRAFORM_LOG_MAX_BYTES", 50 * 1024 * 1024))
+TERRAFORM_LOG_BACKUP_COUNT = int(os.environ.get("TERRAFORM_LOG_BACKUP_COUNT", 3))
+
+# Total size of the Terraform log directory, the least recently written logs are removed past it, 0 keeps them all
+TERRAFORM_LOG_DIR_MAX_BYTES = int(os.environ.get("TERRAFORM_LOG_DIR_MAX_BYTES", 1024 * 1024 * 1024))
+
+# Shared provider plugin cache used by every Terraform run on this worker
+TERRAFORM_PLUGIN_CACHE_DIR = os.environ.get(
+	"TERRAFORM_PLUGIN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".terraform.d", "plugin-cache"))
+
+# Maximum number of concurrent Terraform processes on this worker, 0 sizes it to the host
+TERRAFORM_MAX_CONCURRENCY = int(os.environ.get("TERRAFORM_MAX_CONCURRENCY", 0))
+
+# Memory a single Terraform process is expected to need, used to size the concurrency to the host
+TERRAFORM_MEMORY_PER_PROCESS_MB = int(os.environ.get("TERRAFORM_MEMORY_PER_PROCESS_MB", 512))
+
+# Time a cancelled Terraform process is given to stop gracefully after an interrupt, before it is killed
+TERRAFORM_CANCEL_GRACE_SECS = float(os.environ.get("TERRAFORM_CANCEL_GRACE_SECS", 20))
+
+# Concurrent resource operations shared by all adaptive runs on this worker, 0 sizes it to the host
+TERRAFORM_PARALLELISM_BUDGET = int(os.environ.get("TERRAFORM_PARALLELISM_BUDGET", 0))
+
+# Plans, state files and outputs at least this large are parsed in a process pool, off the event loop
+PARSE_OFFLOAD_THRESHOLD_BYTES = int(os.environ.get("PARSE_OFFLOAD_THRESHOLD_BYTES", 4 * 1024 * 1024))
+PARSE_OFFLOAD_MAX_WORKERS = int(os.environ.get("PARSE_OFFLOAD_MAX_WORKERS", 2))
+
+# Time the event loop may be blocked before the worker reports a stall, and what blocked it
+EVENT_LOOP_STALL_THRESHOLD_SECS = float(os.environ.get("EVENT_LOOP_STALL_THRESHOLD_SECS", 1.0))
+
+# Statuses that are immediately followed by the next one, so they are kept out of the history
+COALESCED_PROVISION_STATUSES = ("uninitialized", "initialized", "planned", "policy_checked")
+COALESCE_UPSERTS_PATCH = "coalesce-search-attribute-upserts"
+
+# Requests a stack entity workflow accepts
+STACK_REQUEST_KINDS = ("plan", "apply", "destroy")
+
+# History a stack entity workflow may grow to before it continues as new
+STACK_ENTITY_MAX_HISTORY_EVENTS = int(os.environ.get("STACK_ENTITY_MAX_HISTORY_EVENTS", 10000))
+STACK_ENTITY_MAX_HISTORY_BYTES = int(os.environ.get("STACK_ENTITY_MAX_HISTORY_BYTES", 10 * 1024 * 1024))
+
+# Drift checks run at once across the fleet, and the most each one is delayed by to spread them out
+DRIFT_MAX_IN_FLIGHT = int(os.environ.get("DRIFT_MAX_IN_FLIGHT", 10))
+DRIFT_MAX_JITTER_SECS = int(os.environ.get("DRIFT_MAX_JITTER_SECS", 60))
+
+# JSON file with the policy rules plans are checked against, the built in rules are used if not set
+POLICY_RULES_FILE = os.environ.get("POLICY_RULES_FILE", "")
+
+# Root directory of the isolated, per run, Terraform workspaces, a temp dir if not set
+TERRAFORM_WORKSPACE_ROOT = os.environ.get("TERRAFORM_WORKSPACE_ROOT", "")
+
+# Directory the state of isolated runs is saved to, shared by every worker so that a run can move
+# to another host, 'state' under TERRAFORM_WORKSPACE_ROOT if not set
+TERRAFORM_STATE_DIR = os.environ.get("TERRAFORM_STATE_DIR", "")
+
+# Directory that binary plans are saved to between the plan and the apply of a run, a temp dir if not set
+TERRAFORM_PLAN_DIR = os.environ.get("TERRAFORM_PLAN_DIR", "")
+
+# Comma separated Terraform directories to initialize when the worker starts up
+TERRAFORM_PREWARM_DIRS = [
+	d.strip() for d in os.environ.get("TERRAFORM_PREWARM_DIRS", "./terraform/minikube_kuard").split(",") if d.strip()
+]
+
+# Runs the web server lists, and the SQLite file they are kept in across restarts, in memory only if not set
+RUN_REGISTRY_MAX_RUNS = int(os.environ.get("RUN_REGISTRY_MAX_RUNS", 1000))
+RUN_REGISTRY_DB = os.environ.get("RUN_REGISTRY_DB", "")
+
+# Runs listed per page of the historical runs table
+RUN_REGISTRY_PAGE_SIZE = int(os.environ.get("RUN_REGISTRY_PAGE_SIZE", 20))
+
 
 async def get_temporal_client(runtime: Optional[Runtime] = None) -> Client:
 	tls_config = False
@@ -50,11 +139,24 @@ async def get_temporal_client(runtime: Optional[Runtime] = None) -> Client:
 			client_private_key=client_key,
 		)
 
+	# The codecs and their libraries are only loaded by processes that connect
+	from shared.codec import ChainedCodec, ClaimCheckCodec, EncryptionCodec
+
+	payload_codecs = []
+
 	if ENCRYPT_PAYLOADS:
 		print("Using encryption codec")
+		payload_codecs.append(EncryptionCodec())
+
+	# Offload after encrypting, so that the blobs are encrypted at rest too
+	if CLAIM_CHECK_PAYLOADS:
+		print("Using claim check codec")
+		payload_codecs.append(ClaimCheckCodec())
+
+	if payload_codecs:
 		data_converter = dataclasses.replace(
 			converter.default(),
-			payload_codec=EncryptionCodec(),
+			payload_codec=payload_codecs[0] if len(payload_codecs) == 1 else ChainedCodec(payload_codecs),
 			failure_converter_class=converter.DefaultFailureConverterWithEncodedAttributes
 		)
 
@@ -96,6 +198,103 @@ class TerraformRunDetails:
 	soft_fail_policy: bool = False
 	hard_fail_policy: bool = False
 	simulate_api_failure: bool = False
+	isolated_workspace: bool = False
+	# Fail the run when its plan isn't applied, for runs that others depend on
+	require_apply: bool = False
+	plan_summary: Optional[PlanSummary] = None
+	# Terraform execution options, 0 and empty values leave Terraform's defaults
+	parallelism: int = 0
+	adaptive_parallelism: bool = False
+	refresh: bool = True
+	lock_timeout: str = ""
+	targets: List[str] = field(default_factory=list)
+
+@dataclass
+class WorkflowSnapshot:
+	status: str
+	progress: int
+	reason: str = ""
+	plan_digest: str = ""
+	# Only filled in when the caller doesn't already have the plan with this digest
+	plan: Optional[str] = None
+
+@dataclass
+class StackRequest:
+	# One of STACK_REQUEST_KINDS
+	kind: str
+	seq: int = 0
+	# Number of identical requests folded into this one while it was queued
+	merged: int = 0
+
+@dataclass
+class StackEntityState:
+	run: TerraformRunDetails
+	pending: List[StackRequest] = field(default_factory=list)
+	status: str = "idle"
+	outputs: dict = field(default_factory=dict)
+	plan_digest: str = ""
+	next_seq: int = 1
+	processed: int = 0
+
+@dataclass
+class StackDetails:
+	name: str
+	run: TerraformRunDetails
+	# Names of the stacks that must be provisioned before this one
+	depends_on: List[str] = field(default_factory=list)
+
+@dataclass
+class MultiStackRunDetails:
+	id: str
+	stacks: List[StackDetails] = field(default_factory=list)
+	max_in_flight: int = 4
+	# Stop at the first failed stack, rather than carrying on with every stack that doesn't depend on it
+	fail_fast: bool = True
+
+@dataclass
+class StackResult:
+	name: str
+	status: str = "pending"
+	outputs: dict = field(default_factory=dict)
+	error: str = ""
+
+@dataclass
+class DriftDetectionDetails:
+	id: str
+	runs: List[TerraformRunDetails] = field(default_factory=list)
+	max_in_flight: int = DRIFT_MAX_IN_FLIGHT
+	max_jitter_secs: int = DRIFT_MAX_JITTER_SECS
+
+@dataclass
+class DriftResult:
+	directory: str
+	# One of "in_sync", "drifted" or "failed"
+	status: str = "in_sync"
+	digest: str = ""
+	counts: Dict[str, int] = field(default_factory=dict)
+	# Only filled in when there is drift
+	plan: str = ""
+	error: str = ""
+
+@dataclass
+class TerraformRunResult:
+	"""What an apply or destroy leaves in the workflow history, the full output
+	stays in the log on the worker that ran it."""
+
+	# Resources added, changed, imported and removed, as Terraform reported them
+	counts: Dict[str, int] = field(default_factory=dict)
+	failed: int = 0
+	duration_secs: float = 0.0
+	# Serial of the local state afterwards, 0 when the state lives in a remote backend
+	state_serial: int = 0
+	# Errors and warnings Terraform reported, as "severity: summary"
+	diagnostics: List[str] = field(default_factory=list)
+	log_path: str = ""
+
+	def summary(self) -> str:
+		counts = ", ".join(f"{count} {action}" for action, count in self.counts.items()) or "no changes reported"
+		return f"{counts} in {self.duration_secs:.1f}s, state serial {self.state_serial}, " \
+			f"{len(self.diagnostics)} diagnostic(s), full log: {self.log_path}"
 
 @dataclass
 class ApplyDecisionDetails:
@@ -1,14 +1,22 @@
 import os
-import cramjam
-from typing import Iterable, List
+import asyncio
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Sequence
 
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from temporalio.api.common.v1 import Payload
 from temporalio.converter import PayloadCodec
 
 default_key = b"sa-rocks!sa-rocks!sa-rocks!yeah!"
 default_key_id = "sa-rocks!sa-rocks!sa-rocks!yeah!"
 
+# Payloads larger than this are moved out of the workflow history by the claim check codec
+default_claim_check_threshold = int(os.environ.get("CLAIM_CHECK_THRESHOLD_BYTES", 128 * 1024))
+default_claim_check_dir = os.environ.get(
+    "CLAIM_CHECK_STORE_DIR", os.path.join(tempfile.gettempdir(), "temporal-claim-check")
+)
+
 
 class EncryptionCodec(PayloadCodec):
     def __init__(self, key_id: str = default_key_id, key: bytes = default_key) -> None:
@@ -16,7 +24,9 @@ class EncryptionCodec(PayloadCodec):
         self.key_id = key_id
         # We are using direct AESGCM to be compatible with samples from
         # TypeScript and Go. Pure Python samples may prefer the higher-level,
-        # safer APIs.
+        # safer APIs. Imported here, so that only processes that encrypt
+        # payloads pay for loading cryptography.
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
         self.encryptor = AESGCM(key)
 
     async def encode(self, payloads: Iterable[Payload]) -> List[Payload]:
@@ -58,7 +68,10 @@ class EncryptionCodec(PayloadCodec):
         return self.encryptor.decrypt(data[:12], data[12:], None)
 
 class CompressionCodec(PayloadCodec):
+    # cramjam is imported on first use, like cryptography above
+
     async def encode(self, payloads: Iterable[Payload]) -> List[Payload]:
+        import cramjam
         return [
             Payload(
                 metadata={
@@ -70,6 +83,7 @@ class CompressionCodec(PayloadCodec):
         ]
 
     async def decode(self, payloads: Iterable[Payload]) -> List[Payload]:
+        import cramjam
         ret: List[Payload] = []
         for p in payloads:
             if p.metadata.get("encoding", b"").decode() != "binary/snappy":
@@ -77,3 +91,114 @@ class CompressionCodec(PayloadCodec):
                 continue
             ret.append(Payload.FromString(bytes(cramjam.snappy.decompress(p.data))))
         return ret
+
+
+class BlobStore(ABC):
+    """Content addressed storage for payloads that are too large for history."""
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        ...
+
+
+class LocalFileBlobStore(BlobStore):
+    """Stores blobs as files on a local (or shared) filesystem. Every worker,
+    client and codec server that reads the payloads needs access to it."""
+
+    def __init__(self, root: str = default_claim_check_dir) -> None:
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    async def put(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(self._put, key, data)
+
+    def _put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        # Content addressed, so an existing blob already holds these bytes
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._get, key)
+
+    def _get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as fh:
+            return fh.read()
+
+
+class ClaimCheckCodec(PayloadCodec):
+    def __init__(
+        self,
+        store: Optional[BlobStore] = None,
+        threshold_bytes: int = default_claim_check_threshold,
+    ) -> None:
+        super().__init__()
+        self.store = store or LocalFileBlobStore()
+        self.threshold_bytes = threshold_bytes
+
+    async def encode(self, payloads: Iterable[Payload]) -> List[Payload]:
+        ret: List[Payload] = []
+        for p in payloads:
+            data = p.SerializeToString()
+            # Small payloads stay in history as they are
+            if len(data) <= self.threshold_bytes:
+                ret.append(p)
+                continue
+            key = hashlib.sha256(data).hexdigest()
+            await self.store.put(key, data)
+            ret.append(
+                Payload(
+                    metadata={
+                        "encoding": b"binary/claim-check",
+                        "claim-check-key": key.encode(),
+                        "claim-check-size": str(len(data)).encode(),
+                    },
+                    data=b"",
+                )
+            )
+        return ret
+
+    async def decode(self, payloads: Iterable[Payload]) -> List[Payload]:
+        ret: List[Payload] = []
+        for p in payloads:
+            if p.metadata.get("encoding", b"").decode() != "binary/claim-check":
+                ret.append(p)
+                continue
+            key = p.metadata.get("claim-check-key", b"").decode()
+            data = await self.store.get(key)
+            if hashlib.sha256(data).hexdigest() != key:
+                raise ValueError(f"Claim check blob {key} does not match its key.")
+            ret.append(Payload.FromString(data))
+        return ret
+
+
+class ChainedCodec(PayloadCodec):
+    """Applies several codecs in order when encoding, and in reverse order
+    when decoding."""
+
+    def __init__(self, codecs: Sequence[PayloadCodec]) -> None:
+        super().__init__()
+        self.codecs = list(codecs)
+
+    async def encode(self, payloads: Iterable[Payload]) -> List[Payload]:
+        ret = list(payloads)
+        for codec in self.codecs:
+            ret = await codec.encode(ret)
+        return ret
+
+    async def decode(self, payloads: Iterable[Payload]) -> List[Payload]:
+        ret = list(payloads)
+        for codec in reversed(self.codecs):
+            ret = await codec.decode(ret)
+        return ret
@@ -17,7 +17,7 @@ from aiohttp import hdrs, web
 from google.protobuf import json_format
 from temporalio.api.common.v1 import Payload, Payloads
 
-from codec import CompressionCodec, EncryptionCodec
+from codec import ChainedCodec, ClaimCheckCodec, CompressionCodec, EncryptionCodec
 
 DEFAULT_PORT = 8081
 
@@ -57,6 +57,8 @@ def build_codec_server(arguments) -> web.Application:
 	codecs = {
 		"encryption_codec": EncryptionCodec(),
 		"compression_codec": CompressionCodec(),
+		"claim_check_codec": ClaimCheckCodec(),
+		"encryption_claim_check_codec": ChainedCodec([EncryptionCodec(), ClaimCheckCodec()]),
 	}
 	for route,codec in codecs.items():
 		app.add_routes(
@@ -0,0 +1,95 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from datetime import timedelta
+from typing import Optional
+
+from temporalio.common import MetricMeter
+
+from shared.base import EVENT_LOOP_STALL_THRESHOLD_SECS
+
+logger = logging.getLogger(__name__)
+
+# Innermost frames of the blocking stack included in a stall report
+STALL_STACK_FRAMES = 15
+
+
+class EventLoopMonitor:
+	"""Measures how late the event loop runs a periodic tick, and reports any
+	stall longer than the threshold together with the stack that caused it.
+
+	The stack has to be captured while the loop is still blocked, so a
+	watchdog thread checks on the tick and takes the loop thread's current
+	frame with sys._current_frames, which only needs the GIL for a moment."""
+
+	def __init__(
+		self,
+		threshold_secs: float = EVENT_LOOP_STALL_THRESHOLD_SECS,
+		interval_secs: float = 0.1,
+		metric_meter: Optional[MetricMeter] = None,
+	) -> None:
+		self.threshold_secs = threshold_secs
+		self.interval_secs = interval_secs
+		self.stall_count = 0
+		self._last_tick = time.monotonic()
+		self._loop_thread_id: Optional[int] = None
+		self._reported_tick: Optional[float] = None
+		self._tick_task: Optional[asyncio.Task] = None
+		self._watchdog: Optional[threading.Thread] = None
+		self._stopped = threading.Event()
+
+		metric_meter = metric_meter or MetricMeter.noop
+		self._lag_histogram = metric_meter.create_histogram_timedelta(
+			"event_loop_lag", "How late the event loop ran a scheduled callback", "ms")
+		self._stall_counter = metric_meter.create_counter(
+			"event_loop_stalls", "Times the event loop was blocked for longer than the threshold")
+
+	def start(self) -> None:
+		"""Start monitoring the running event loop."""
+
+		self._loop_thread_id = threading.get_ident()
+		self._last_tick = time.monotonic()
+		self._stopped.clear()
+		self._tick_task = asyncio.get_running_loop().create_task(self._tick())
+		self._watchdog = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+		self._watchdog.start()
+
+	async def stop(self) -> None:
+		self._stopped.set()
+
+		if self._tick_task is not None:
+			self._tick_task.cancel()
+			try:
+				await self._tick_task
+			except asyncio.CancelledError:
+				pass
+
+		if self._watchdog is not None:
+			self._watchdog.join(timeout=self.interval_secs * 2)
+
+	async def _tick(self) -> None:
+		while True:
+			scheduled_at = time.monotonic()
+			await asyncio.sleep(self.interval_secs)
+			self._last_tick = time.monotonic()
+			self._lag_histogram.record(timedelta(seconds=max(0.0, self._last_tick - scheduled_at - self.interval_secs)))
+
+	def _watch(self) -> None:
+		while not self._stopped.wait(self.interval_secs):
+			last_tick = self._last_tick
+			blocked_secs = time.monotonic() - last_tick
+
+			# Report every stall once, while it is happening
+			if blocked_secs < self.threshold_secs or self._reported_tick == last_tick:
+				continue
+
+			self._reported_tick = last_tick
+			self.stall_count += 1
+			self._stall_counter.add(1)
+
+			frame = sys._current_frames().get(self._loop_thread_id)
+			stack = "".join(traceback.format_stack(frame)[-STALL_STACK_FRAMES:]) if frame else "<unknown>\n"
+			logger.warning(f"Event loop blocked for at least {blocked_secs:.2f}s, in:\n{stack}")
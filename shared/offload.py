@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional, TypeVar
+
+from shared.base import PARSE_OFFLOAD_THRESHOLD_BYTES, PARSE_OFFLOAD_MAX_WORKERS
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class ParsingPool:
+	"""Runs CPU heavy parsing of large documents, like plans, state files and
+	outputs, in a pool of processes rather than on the event loop.
+
+	Parsing JSON holds the GIL for as long as it takes, so a thread pool would
+	still stall the loop, and with it the heartbeats of every other activity
+	on the worker. Documents under the size threshold are parsed inline, where
+	handing them to another process would cost more than it saves."""
+
+	def __init__(
+		self,
+		threshold_bytes: int = PARSE_OFFLOAD_THRESHOLD_BYTES,
+		max_workers: int = PARSE_OFFLOAD_MAX_WORKERS,
+		executor: Optional[Executor] = None,
+	) -> None:
+		self.threshold_bytes = threshold_bytes
+		self._max_workers = max_workers
+		self._executor = executor
+		self._completed = 0
+
+	def _get_executor(self) -> Executor:
+		# Started on first use, so that workers that never see a large document
+		# don't pay for it, not even for importing it. Forking a process that
+		# runs the SDK's threads isn't safe, so the pool always spawns fresh
+		# interpreters.
+		if self._executor is None:
+			import multiprocessing
+			from concurrent.futures import ProcessPoolExecutor
+
+			self._executor = ProcessPoolExecutor(
+				max_workers=self._max_workers or None,
+				mp_context=multiprocessing.get_context("spawn"),
+			)
+
+		return self._executor
+
+	async def run(self, size: int, fn: Callable[..., T], *args: Any) -> T:
+		"""Call a module level function with the given arguments, in the pool if
+		the document it works on is at least the threshold size."""
+
+		if self.threshold_bytes <= 0 or size < self.threshold_bytes:
+			return fn(*args)
+
+		logger.debug(f"Parsing {size} byte(s) with {fn.__name__} in the parsing pool")
+		from concurrent.futures.process import BrokenProcessPool
+
+		try:
+			result = await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+		except BrokenProcessPool as e:
+			# A pool that never completed anything can't start its processes, e.g.
+			# the entry module fails when they import it again, so stop trying.
+			# Otherwise a process died, and the next document gets a fresh pool.
+			if self._completed == 0:
+				logger.error(f"The parsing pool can't start, parsing on the event loop from now on: {e}")
+				self.threshold_bytes = 0
+			else:
+				logger.warning(f"A parsing pool process died, starting a new pool: {e}")
+			self.shutdown()
+			return fn(*args)
+
+		self._completed += 1
+		return result
+
+	def shutdown(self) -> None:
+		if self._executor is not None:
+			self._executor.shutdown(wait=False, cancel_futures=True)
+			self._executor = None
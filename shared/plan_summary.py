@@ -0,0 +1,178 @@
+import re
+import json
+import hashlib
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+# Matches the tokens that matter for tracking where we are in a JSON document:
+# complete strings (so that brackets inside of them are skipped), a string
+# that is still open at the end of the buffer, and brackets.
+_TOKEN = re.compile(
+	r'(?P<string>"[^"\\]*(?:\\.[^"\\]*)*")'
+	r'|(?P<open>"[^"\\]*(?:\\.[^"\\]*)*\\?\Z)'
+	r'|(?P<bracket>[{}\[\]])'
+)
+
+# Longest string attribute value kept in a ResourceChange
+MAX_ATTRIBUTE_CHARS = 1024
+
+# Terraform reports a replacement as a pair of actions, in either order
+_REPLACE_ACTIONS = (["delete", "create"], ["create", "delete"])
+
+
+@dataclass
+class ResourceChange:
+	address: str
+	type: str
+	name: str = ""
+	provider: str = ""
+	action: str = "no-op"
+	# Only the top level, scalar attributes of the planned values are kept,
+	# which is what the policy checks need, without the full nested objects.
+	after: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class PlanSummary:
+	digest: str = ""
+	counts: Dict[str, int] = field(default_factory=dict)
+	by_action: Dict[str, List[int]] = field(default_factory=dict)
+	by_type: Dict[str, List[int]] = field(default_factory=dict)
+	changes: List[ResourceChange] = field(default_factory=list)
+
+	@property
+	def has_changes(self) -> bool:
+		return any(action != "no-op" for action in self.by_action)
+
+	def changes_for_action(self, action: str) -> List[ResourceChange]:
+		return [self.changes[i] for i in self.by_action.get(action, [])]
+
+	def changes_for_type(self, resource_type: str) -> List[ResourceChange]:
+		return [self.changes[i] for i in self.by_type.get(resource_type, [])]
+
+	def compact(self) -> "PlanSummary":
+		"""The digest and counts alone, without the resource changes."""
+
+		return PlanSummary(digest=self.digest, counts=dict(self.counts))
+
+	def to_dict(self) -> dict:
+		return asdict(self)
+
+	@classmethod
+	def from_dict(cls, data: dict) -> "PlanSummary":
+		return cls(
+			digest=data.get("digest", ""),
+			counts=data.get("counts", {}),
+			by_action=data.get("by_action", {}),
+			by_type=data.get("by_type", {}),
+			changes=[ResourceChange(**c) for c in data.get("changes", [])],
+		)
+
+
+def normalize_action(actions: List[str]) -> str:
+	"""Collapse Terraform's list of actions for a change into a single action."""
+
+	if actions in _REPLACE_ACTIONS:
+		return "replace"
+
+	return actions[0] if actions else "no-op"
+
+
+class PlanSummaryBuilder:
+	"""Build a PlanSummary from the output of 'terraform show -json' as it
+	streams in, without ever holding the whole plan document in memory.
+
+	Only the elements of the top level 'resource_changes' array are decoded,
+	one at a time, while the rest of the document is skimmed for brackets, so
+	memory is bounded by the largest single resource change."""
+
+	def __init__(self) -> None:
+		self._buffer = ""
+		self._scan_pos = 0
+		self._depth = 0
+		self._last_key: Optional[str] = None
+		self._in_resource_changes = False
+		self._element_start: Optional[int] = None
+		self._summary = PlanSummary()
+
+	def feed(self, chunk: str) -> None:
+		self._buffer += chunk
+		position = self._scan_pos
+
+		for match in _TOKEN.finditer(self._buffer, position):
+			# The rest of this string arrives with the next chunk
+			if match.lastgroup == "open":
+				break
+
+			token = match.group()
+			position = match.end()
+
+			if match.lastgroup == "string":
+				if self._depth == 1:
+					self._last_key = token
+			elif token in "{[":
+				if self._depth == 1 and token == "[" and self._last_key == '"resource_changes"':
+					self._in_resource_changes = True
+				elif self._in_resource_changes and self._depth == 2 and token == "{":
+					self._element_start = match.start()
+				self._depth += 1
+			else:
+				self._depth -= 1
+				if self._in_resource_changes and self._depth == 2 and self._element_start is not None:
+					self._add_change(json.loads(self._buffer[self._element_start:match.end()]))
+					self._element_start = None
+				elif self._in_resource_changes and self._depth == 1:
+					self._in_resource_changes = False
+		else:
+			# Nothing but numbers, literals and separators are left
+			position = len(self._buffer)
+
+		# Keep a resource change that is still being read, drop everything else
+		keep_from = position if self._element_start is None else self._element_start
+		self._buffer = self._buffer[keep_from:]
+		self._scan_pos = position - keep_from
+		if self._element_start is not None:
+			self._element_start = 0
+
+	def _add_change(self, raw: dict) -> None:
+		change = raw.get("change") or {}
+		after = change.get("after") or {}
+
+		resource_change = ResourceChange(
+			address=raw.get("address", ""),
+			type=raw.get("type", ""),
+			name=raw.get("name", ""),
+			provider=raw.get("provider_name", ""),
+			action=normalize_action(change.get("actions", [])),
+			after={
+				k: v[:MAX_ATTRIBUTE_CHARS] if isinstance(v, str) else v
+				for k, v in after.items()
+				if isinstance(v, (str, int, float, bool)) or v is None
+			} if isinstance(after, dict) else {},
+		)
+
+		index = len(self._summary.changes)
+		self._summary.changes.append(resource_change)
+		self._summary.counts[resource_change.action] = self._summary.counts.get(resource_change.action, 0) + 1
+		self._summary.by_action.setdefault(resource_change.action, []).append(index)
+		self._summary.by_type.setdefault(resource_change.type, []).append(index)
+
+	def finish(self) -> PlanSummary:
+		# The digest covers what the plan does, rather than the raw document,
+		# which also carries a timestamp and differs between identical plans.
+		digest = hashlib.sha256()
+		for change in sorted(self._summary.changes, key=lambda c: c.address):
+			digest.update(json.dumps(
+				[change.address, change.action, change.after], sort_keys=True, default=str
+			).encode())
+
+		self._summary.digest = digest.hexdigest()
+		return self._summary
+
+
+def summarize_plan(plan_json: str) -> PlanSummary:
+	"""Build a PlanSummary from a complete 'terraform show -json' document."""
+
+	builder = PlanSummaryBuilder()
+	builder.feed(plan_json)
+	return builder.finish()
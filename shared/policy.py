@@ -0,0 +1,169 @@
+import re
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from shared.plan_summary import PlanSummary, ResourceChange
+
+# Number of decisions kept, keyed by the digest of the plan they were made for
+POLICY_DECISION_CACHE_SIZE = 1024
+
+# Rules used when no rules file is configured
+DEFAULT_POLICY_RULES = [
+	{
+		"name": "no-account-admins",
+		"resource_type": "temporalcloud_user",
+		"actions": ["create", "update", "replace"],
+		"conditions": [{"attribute": "account_access", "operator": "in", "value": ["admin", "owner"]}],
+		"message": "Users must not be granted admin access at the account level",
+	},
+	{
+		"name": "no-namespace-deletes",
+		"resource_type": "temporalcloud_namespace",
+		"actions": ["delete", "replace"],
+		"message": "Namespaces must not be deleted or replaced by an apply",
+	},
+]
+
+
+# Operators a rule condition can apply to a planned attribute
+POLICY_OPERATORS = ("eq", "ne", "in", "not_in", "matches", "exists", "gt", "lt")
+
+
+def _predicate(attribute: str, operator: str, value: Any) -> Callable[[Dict[str, Any]], bool]:
+	"""Build a predicate over the planned attributes of a change, doing any
+	expensive preparation, like compiling a regular expression, only once."""
+
+	if operator == "eq":
+		return lambda after: after.get(attribute) == value
+	if operator == "ne":
+		return lambda after: after.get(attribute) != value
+	if operator in ("in", "not_in"):
+		values = frozenset(value)
+		if operator == "in":
+			return lambda after: after.get(attribute) in values
+		return lambda after: after.get(attribute) not in values
+	if operator == "matches":
+		pattern = re.compile(value)
+		return lambda after: isinstance(after.get(attribute), str) and pattern.search(after[attribute]) is not None
+	if operator == "exists":
+		return lambda after: (attribute in after) == bool(value)
+	if operator == "gt":
+		return lambda after: isinstance(after.get(attribute), (int, float)) and after[attribute] > value
+	if operator == "lt":
+		return lambda after: isinstance(after.get(attribute), (int, float)) and after[attribute] < value
+
+	raise ValueError(f"Unknown policy operator: {operator}")
+
+
+@dataclass
+class PolicyViolation:
+	rule: str
+	address: str
+	message: str
+
+
+@dataclass
+class PolicyDecision:
+	digest: str = ""
+	passed: bool = True
+	violations: List[PolicyViolation] = field(default_factory=list)
+
+
+@dataclass
+class _CompiledRule:
+	name: str
+	actions: frozenset
+	predicates: List[Callable[[Dict[str, Any]], bool]]
+	message: str
+
+	def violated_by(self, change: ResourceChange) -> bool:
+		if self.actions and change.action not in self.actions:
+			return False
+
+		return all(predicate(change.after) for predicate in self.predicates)
+
+
+class PolicyEngine:
+	"""Evaluates plan summaries against a set of rules, each of which matches
+	a resource type, a set of actions and predicates on the planned values.
+
+	Rules are compiled once and indexed by resource type, so a plan costs a
+	lookup per resource change rather than a pass over every rule, and
+	decisions are cached by plan digest."""
+
+	def __init__(self, rules: List[dict], cache_size: int = POLICY_DECISION_CACHE_SIZE) -> None:
+		self._rules_by_type: Dict[str, List[_CompiledRule]] = {}
+		self._wildcard_rules: List[_CompiledRule] = []
+		self._cache: "OrderedDict[str, PolicyDecision]" = OrderedDict()
+		self._cache_size = cache_size
+
+		for rule in rules:
+			compiled = self._compile(rule)
+			resource_type = rule.get("resource_type", "*")
+			if resource_type == "*":
+				self._wildcard_rules.append(compiled)
+			else:
+				self._rules_by_type.setdefault(resource_type, []).append(compiled)
+
+	def _compile(self, rule: dict) -> _CompiledRule:
+		"""Turn a rule into predicates up front, failing on a bad rule at
+		startup rather than on the first plan that reaches it."""
+
+		predicates = []
+		for condition in rule.get("conditions", []):
+			operator = condition.get("operator", "eq")
+			if operator not in POLICY_OPERATORS:
+				raise ValueError(f"Policy rule {rule.get('name')} uses an unknown operator: {operator}")
+			predicates.append(_predicate(condition["attribute"], operator, condition.get("value")))
+
+		return _CompiledRule(
+			name=rule["name"],
+			actions=frozenset(rule.get("actions", [])),
+			predicates=predicates,
+			message=rule.get("message", rule["name"]),
+		)
+
+	def evaluate(self, summary: PlanSummary) -> PolicyDecision:
+		if summary.digest:
+			cached = self._cache.get(summary.digest)
+			if cached is not None:
+				self._cache.move_to_end(summary.digest)
+				return cached
+
+		# The summary is already indexed by resource type, so types without
+		# any rules are skipped without looking at their changes.
+		violations = []
+		for resource_type, indices in summary.by_type.items():
+			rules = self._rules_by_type.get(resource_type, []) + self._wildcard_rules
+			if not rules:
+				continue
+
+			for index in indices:
+				change = summary.changes[index]
+				if change.action == "no-op":
+					continue
+
+				for rule in rules:
+					if rule.violated_by(change):
+						violations.append(PolicyViolation(rule=rule.name, address=change.address, message=rule.message))
+
+		decision = PolicyDecision(digest=summary.digest, passed=not violations, violations=violations)
+
+		if summary.digest:
+			self._cache[summary.digest] = decision
+			if len(self._cache) > self._cache_size:
+				self._cache.popitem(last=False)
+
+		return decision
+
+
+def load_policy_rules(path: Optional[str] = None) -> List[dict]:
+	"""Load the rules from a JSON file, or fall back to the default rules."""
+
+	if not path:
+		return DEFAULT_POLICY_RULES
+
+	with open(path, "r") as fh:
+		return json.load(fh)
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two looks at a workflow, however many pages are watching it
+PROGRESS_POLL_INTERVAL_SECS = 1.0
+
+# Fetches the progress of a workflow, given the digest of the plan the hub already has. The
+# payload carries the plan only when its digest changed, and "closed" once the workflow is over.
+ProgressFetcher = Callable[[str, str], Awaitable[dict]]
+
+
+class _Watcher:
+	def __init__(self) -> None:
+		self.subscribers: Set[asyncio.Queue] = set()
+		self.task: Optional[asyncio.Task] = None
+		# The last payload sent, with the plan, for pages that subscribe later
+		self.latest: Optional[dict] = None
+
+
+class ProgressHub:
+	"""Watches each workflow with a single task, shared by every page that
+	subscribed to it, and pushes its progress to them only when it changes.
+
+	A watcher stops once its workflow is over, after sending the last update
+	and then None to every subscriber, or as soon as its last subscriber
+	leaves. Pages that poll rather than subscribe share a single fetch per
+	workflow and plan digest while one is in flight. Everything runs on the
+	event loop the hub is used from."""
+
+	def __init__(self, fetch: ProgressFetcher, poll_interval_secs: float = PROGRESS_POLL_INTERVAL_SECS) -> None:
+		self._fetch = fetch
+		self._poll_interval_secs = poll_interval_secs
+		self._watchers: Dict[str, _Watcher] = {}
+		self._fetches: Dict[Tuple[str, str], asyncio.Future] = {}
+
+	@property
+	def watching(self) -> List[str]:
+		return list(self._watchers)
+
+	async def fetch(self, wf_id: str, known_plan_digest: str = "") -> dict:
+		"""Fetch the progress of a workflow once, joining the fetch already in
+		flight for the same workflow and plan digest, if there is one."""
+
+		key = (wf_id, known_plan_digest)
+		future = self._fetches.get(key)
+
+		if future is None:
+			future = self._fetches[key] = asyncio.ensure_future(self._fetch(wf_id, known_plan_digest))
+			future.add_done_callback(lambda _: self._fetches.pop(key, None))
+
+		# A caller that goes away doesn't cancel the fetch for the others, and
+		# each one gets its own copy of the payload to change.
+		return dict(await asyncio.shield(future))
+
+	def subscribe(self, wf_id: str) -> asyncio.Queue:
+		queue: asyncio.Queue = asyncio.Queue()
+		watcher = self._watchers.get(wf_id)
+
+		if watcher is None:
+			watcher = self._watchers[wf_id] = _Watcher()
+			watcher.task = asyncio.get_running_loop().create_task(self._watch(wf_id, watcher))
+		elif watcher.latest is not None:
+			queue.put_nowait(watcher.latest)
+
+		watcher.subscribers.add(queue)
+		return queue
+
+	def unsubscribe(self, wf_id: str, queue: asyncio.Queue) -> None:
+		watcher = self._watchers.get(wf_id)
+		if watcher is None:
+			return
+
+		watcher.subscribers.discard(queue)
+		if not watcher.subscribers:
+			self._stop(wf_id, watcher)
+
+	def _stop(self, wf_id: str, watcher: _Watcher) -> None:
+		if self._watchers.get(wf_id) is watcher:
+			del self._watchers[wf_id]
+		if watcher.task is not None and watcher.task is not asyncio.current_task():
+			watcher.task.cancel()
+
+	async def _watch(self, wf_id: str, watcher: _Watcher) -> None:
+		plan_digest = ""
+		plan = None
+
+		try:
+			while True:
+				try:
+					payload = await self._fetch(wf_id, plan_digest)
+				except Exception as e:
+					# e.g. not started yet, try again on the next tick
+					logger.debug(f"Progress of {wf_id} not available: {e}")
+					await asyncio.sleep(self._poll_interval_secs)
+					continue
+
+				closed = payload.pop("closed", False)
+
+				# Only a new plan is sent to the pages that already have one. Workflows
+				# without a plan yet, or without digests at all, send an empty one.
+				new_plan = payload.get("plan")
+				plan_changed = bool(new_plan) and (payload.get("plan_digest", "") != plan_digest or new_plan != plan)
+				if plan_changed:
+					plan_digest, plan = payload.get("plan_digest", ""), new_plan
+
+				changed = watcher.latest is None or plan_changed or \
+					any(watcher.latest.get(key) != value for key, value in payload.items() if key != "plan")
+
+				if changed:
+					watcher.latest = {**payload, "plan": plan}
+					self._broadcast(watcher, {**payload, "plan": new_plan if plan_changed else None})
+
+				if closed:
+					self._broadcast(watcher, None)
+					return
+
+				await asyncio.sleep(self._poll_interval_secs)
+		finally:
+			self._stop(wf_id, watcher)
+
+	def _broadcast(self, watcher: _Watcher, event: Optional[dict]) -> None:
+		for queue in watcher.subscribers:
+			queue.put_nowait(event)
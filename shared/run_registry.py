@@ -0,0 +1,117 @@
+import math
+import sqlite3
+import threading
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+from shared.base import RUN_REGISTRY_MAX_RUNS, RUN_REGISTRY_PAGE_SIZE
+
+
+@dataclass
+class RunPage:
+	runs: List[dict] = field(default_factory=list)
+	number: int = 1
+	pages: int = 1
+	total: int = 0
+
+	@property
+	def has_previous(self) -> bool:
+		return self.number > 1
+
+	@property
+	def has_next(self) -> bool:
+		return self.number < self.pages
+
+
+class RunRegistry:
+	"""The runs started from the web server, most recent first, looked up by
+	workflow ID. Only the most recent max_runs are kept, older ones are
+	evicted as new ones come in.
+
+	Given the path of a SQLite database, every change is also written there,
+	and the runs it holds are loaded back when the registry is created, so
+	they survive a restart of the web server."""
+
+	def __init__(self, max_runs: int = RUN_REGISTRY_MAX_RUNS, db_path: str = "") -> None:
+		self._max_runs = max(1, max_runs)
+		# Oldest first, so that evicting and adding are both O(1)
+		self._runs: "OrderedDict[str, dict]" = OrderedDict()
+		self._lock = threading.Lock()
+		self._db: Optional[sqlite3.Connection] = None
+
+		if db_path:
+			self._db = sqlite3.connect(db_path, check_same_thread=False)
+			self._db.execute(
+				"CREATE TABLE IF NOT EXISTS runs ("
+				"seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, scenario TEXT, status TEXT)"
+			)
+			self._db.commit()
+			self._load()
+
+	def _load(self) -> None:
+		rows = self._db.execute(
+			"SELECT id, scenario, status FROM runs ORDER BY seq DESC LIMIT ?", (self._max_runs,)
+		).fetchall()
+		for run_id, scenario, status in reversed(rows):
+			self._runs[run_id] = {"id": run_id, "scenario": scenario, "status": status}
+
+		# Runs beyond the cap, e.g. after it was lowered
+		self._db.execute("DELETE FROM runs WHERE seq NOT IN (SELECT seq FROM runs ORDER BY seq DESC LIMIT ?)",
+			(self._max_runs,))
+		self._db.commit()
+
+	def __len__(self) -> int:
+		return len(self._runs)
+
+	def __contains__(self, run_id: str) -> bool:
+		return run_id in self._runs
+
+	def get(self, run_id: str) -> Optional[dict]:
+		return self._runs.get(run_id)
+
+	def add(self, run: dict) -> bool:
+		"""Register a run as the most recent one, unless a run with the same
+		ID is already registered. Returns whether it was added."""
+
+		with self._lock:
+			if run["id"] in self._runs:
+				return False
+
+			self._runs[run["id"]] = run
+			evicted: List[str] = []
+			while len(self._runs) > self._max_runs:
+				evicted.append(self._runs.popitem(last=False)[0])
+
+			if self._db is not None:
+				self._db.execute("INSERT OR IGNORE INTO runs (id, scenario, status) VALUES (?, ?, ?)",
+					(run["id"], run.get("scenario"), run.get("status")))
+				self._db.executemany("DELETE FROM runs WHERE id = ?", [(run_id,) for run_id in evicted])
+				self._db.commit()
+
+			return True
+
+	def recent(self, limit: Optional[int] = None) -> List[dict]:
+		"""The most recent runs first."""
+
+		with self._lock:
+			return list(itertools.islice(reversed(self._runs.values()), limit))
+
+	def page(self, number: int = 1, size: int = RUN_REGISTRY_PAGE_SIZE) -> RunPage:
+		"""A page of the runs, most recent first, numbered from 1. Numbers out
+		of range are clamped to the first or last page."""
+
+		size = max(1, size)
+		with self._lock:
+			total = len(self._runs)
+			pages = max(1, math.ceil(total / size))
+			number = min(max(1, number), pages)
+			start = (number - 1) * size
+			runs = list(itertools.islice(reversed(self._runs.values()), start, start + size))
+
+		return RunPage(runs=runs, number=number, pages=pages, total=total)
+
+	def close(self) -> None:
+		if self._db is not None:
+			self._db.close()
+			self._db = None
@@ -0,0 +1,51 @@
+from typing import Dict, List
+
+from shared.base import StackDetails
+
+
+def build_stack_graph(stacks: List[StackDetails]) -> Dict[str, List[str]]:
+	"""Map each stack to the stacks it depends on, rejecting duplicate names,
+	unknown dependencies and cycles before any stack is started."""
+
+	graph: Dict[str, List[str]] = {}
+	for stack in stacks:
+		if stack.name in graph:
+			raise ValueError(f"Stack {stack.name} is defined more than once")
+		graph[stack.name] = list(stack.depends_on)
+
+	for name, dependencies in graph.items():
+		for dependency in dependencies:
+			if dependency not in graph:
+				raise ValueError(f"Stack {name} depends on unknown stack {dependency}")
+
+	# Depth first search, a stack still on the path when it's reached again closes a cycle
+	visiting, visited = set(), set()
+
+	def visit(name: str, path: List[str]) -> None:
+		if name in visited:
+			return
+		if name in visiting:
+			raise ValueError(f"Stacks depend on each other in a cycle: {' -> '.join(path + [name])}")
+
+		visiting.add(name)
+		for dependency in graph[name]:
+			visit(dependency, path + [name])
+		visiting.remove(name)
+		visited.add(name)
+
+	for name in graph:
+		visit(name, [])
+
+	return graph
+
+
+def reverse_stack_graph(graph: Dict[str, List[str]]) -> Dict[str, List[str]]:
+	"""Map each stack to the stacks that depend on it, which is the order they
+	have to be torn down in."""
+
+	dependents: Dict[str, List[str]] = {name: [] for name in graph}
+	for name, dependencies in graph.items():
+		for dependency in dependencies:
+			dependents[dependency].append(name)
+
+	return dependents
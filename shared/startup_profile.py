@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import builtins
+import logging
+import importlib.util
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Report where a worker spends its time between starting and taking its first tasks
+WORKER_PROFILE_STARTUP = os.getenv("WORKER_PROFILE_STARTUP", 'false').lower() in ('true', '1', 't')
+
+# Slowest imports included in the report
+STARTUP_PROFILE_TOP_IMPORTS = int(os.environ.get("STARTUP_PROFILE_TOP_IMPORTS", 25))
+
+
+class StartupProfile:
+	"""Times the first import of every module, like 'python -X importtime'
+	but from inside the worker, and how long the worker takes to reach its
+	first workflow and activity tasks.
+
+	Only depends on the standard library, so that it can be started before
+	anything it is meant to measure is imported."""
+
+	def __init__(self) -> None:
+		self.started = time.perf_counter()
+		# Module name to (inclusive, self) seconds spent in its first import
+		self.imports: Dict[str, Tuple[float, float]] = {}
+		self.milestones: Dict[str, float] = {}
+		self.import_secs = 0.0
+		self._stack: List[float] = []
+		self._original_import = None
+
+	def start(self) -> "StartupProfile":
+		self._original_import = builtins.__import__
+		builtins.__import__ = self._timed_import
+		return self
+
+	def stop_imports(self) -> None:
+		if self._original_import is not None:
+			builtins.__import__ = self._original_import
+			self._original_import = None
+
+	def _timed_import(
+		self, name: str, globals: Optional[dict] = None, locals: Optional[dict] = None, fromlist: tuple = (), level: int = 0
+	) -> Any:
+		module = self._first_import(name, globals, fromlist, level)
+
+		# Already imported modules cost a dictionary lookup, only time first imports
+		if module is None:
+			return self._original_import(name, globals, locals, fromlist, level)
+
+		self._stack.append(0.0)
+		start = time.perf_counter()
+		try:
+			return self._original_import(name, globals, locals, fromlist, level)
+		finally:
+			elapsed = time.perf_counter() - start
+			children = self._stack.pop()
+			if self._stack:
+				self._stack[-1] += elapsed
+			else:
+				self.import_secs += elapsed
+			self.imports.setdefault(module, (elapsed, elapsed - children))
+
+	def _first_import(self, name: str, globals: Optional[dict], fromlist: tuple, level: int) -> Optional[str]:
+		"""The absolute name of the module an import statement loads for the
+		first time, or None if everything it names is already loaded."""
+
+		if level > 0:
+			package = (globals or {}).get("__package__") or ""
+			try:
+				name = importlib.util.resolve_name("." * level + name, package)
+			except (ImportError, ValueError):
+				return None
+
+		if name not in sys.modules:
+			return name
+
+		# 'from package import submodule' loads the submodule
+		for item in fromlist or ():
+			if item != "*" and f"{name}.{item}" not in sys.modules and not hasattr(sys.modules[name], item):
+				return f"{name}.{item}"
+
+		return None
+
+	def mark(self, milestone: str) -> None:
+		"""Record the first time a milestone is reached, since the profile started."""
+
+		if milestone not in self.milestones:
+			self.milestones[milestone] = time.perf_counter() - self.started
+			logger.info(f"Startup: {milestone} after {self.milestones[milestone] * 1000:.1f}ms")
+
+	def report(self, top: int = STARTUP_PROFILE_TOP_IMPORTS) -> str:
+		lines = [f"Imported {len(self.imports)} module(s) in {self.import_secs * 1000:.1f}ms"]
+		lines.append(f"{'self ms':>10} {'total ms':>10}  module")
+
+		slowest = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)[:top]
+		for name, (inclusive, own) in slowest:
+			lines.append(f"{own * 1000:>10.1f} {inclusive * 1000:>10.1f}  {name}")
+
+		for milestone, elapsed in sorted(self.milestones.items(), key=lambda item: item[1]):
+			lines.append(f"{milestone}: {elapsed * 1000:.1f}ms")
+
+		return "\n".join(lines)
+
+	def interceptor(self) -> Any:
+		"""A worker interceptor that marks the first workflow and activity tasks."""
+
+		from temporalio import worker
+
+		profile = self
+
+		class _FirstActivityInterceptor(worker.ActivityInboundInterceptor):
+			async def execute_activity(self, input: worker.ExecuteActivityInput) -> Any:
+				profile.mark("first activity task")
+				return await super().execute_activity(input)
+
+		class _FirstWorkflowInterceptor(worker.WorkflowInboundInterceptor):
+			async def execute_workflow(self, input: worker.ExecuteWorkflowInput) -> Any:
+				# Runs inside the sandbox, but the profile lives outside of it
+				profile.mark("first workflow task")
+				return await super().execute_workflow(input)
+
+		class _FirstTaskInterceptor(worker.Interceptor):
+			def intercept_activity(self, next: worker.ActivityInboundInterceptor) -> worker.ActivityInboundInterceptor:
+				return _FirstActivityInterceptor(next)
+
+			def workflow_interceptor_class(
+				self, input: worker.WorkflowInterceptorClassInput
+			) -> Optional[type]:
+				return _FirstWorkflowInterceptor
+
+		return _FirstTaskInterceptor()
@@ -0,0 +1,185 @@
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
+
+
+@dataclass
+class CapturedOutput:
+	head: List[str] = field(default_factory=list)
+	tail: List[str] = field(default_factory=list)
+	line_count: int = 0
+	byte_count: int = 0
+	log_path: str = ""
+
+	@property
+	def truncated(self) -> bool:
+		return self.line_count > len(self.head) + len(self.tail)
+
+	def summary(self) -> str:
+		"""Render the head and tail of the output, and where to find the rest."""
+
+		lines = list(self.head)
+
+		if self.truncated:
+			omitted = self.line_count - len(self.head) - len(self.tail)
+			lines.append(f"... {omitted} line(s) omitted ...")
+
+		lines.extend(self.tail)
+		lines.append(f"[{self.line_count} line(s), {self.byte_count} byte(s), full log: {self.log_path}]")
+
+		return "\n".join(lines)
+
+
+class RotatingLogFile:
+	"""An append only log file that rolls over to numbered backups once it
+	reaches max_bytes, keeping at most backup_count of them on disk."""
+
+	def __init__(self, path: str, max_bytes: int, backup_count: int) -> None:
+		self.path = path
+		self._max_bytes = max_bytes
+		self._backup_count = backup_count
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		self._fh = open(path, "wb")
+		self._size = 0
+
+	def write(self, data: bytes) -> None:
+		if self._max_bytes > 0 and self._size + len(data) > self._max_bytes and self._size > 0:
+			self._rollover()
+
+		self._fh.write(data)
+		self._size += len(data)
+
+	def _rollover(self) -> None:
+		self._fh.close()
+
+		if self._backup_count > 0:
+			for i in range(self._backup_count - 1, 0, -1):
+				src = f"{self.path}.{i}"
+				if os.path.exists(src):
+					os.replace(src, f"{self.path}.{i + 1}")
+			os.replace(self.path, f"{self.path}.1")
+
+		self._fh = open(self.path, "wb")
+		self._size = 0
+
+	def close(self) -> None:
+		self._fh.close()
+
+
+def prune_logs(directory: str, max_bytes: int, keep: Iterable[str] = ()) -> int:
+	"""Remove the least recently written files of a log directory until it
+	holds at most max_bytes, never removing the files in keep. Returns the
+	number of files removed, 0 and negative sizes leave the directory as is."""
+
+	if max_bytes <= 0:
+		return 0
+
+	keep = {os.path.abspath(path) for path in keep}
+	files = []
+	try:
+		with os.scandir(directory) as entries:
+			for entry in entries:
+				try:
+					if entry.is_file(follow_symlinks=False):
+						stat = entry.stat(follow_symlinks=False)
+						files.append((stat.st_mtime, stat.st_size, entry.path))
+				except FileNotFoundError:
+					continue
+	except FileNotFoundError:
+		return 0
+
+	total = sum(size for _, size, _ in files)
+	removed = 0
+	for _, size, path in sorted(files):
+		if total <= max_bytes:
+			break
+		if os.path.abspath(path) in keep:
+			continue
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			# Pruned by another run in the meantime
+			pass
+		total -= size
+		removed += 1
+
+	return removed
+
+
+class OutputCapture:
+	"""Consume a subprocess stream chunk by chunk, keeping only a bounded head
+	and tail of lines in memory while spilling everything to a log file."""
+
+	def __init__(
+		self,
+		log_path: str,
+		head_lines: int = 50,
+		tail_lines: int = 50,
+		max_line_chars: int = 4096,
+		max_log_bytes: int = 50 * 1024 * 1024,
+		backup_count: int = 3,
+		on_line: Optional[Callable[[str], None]] = None,
+	) -> None:
+		self._log = RotatingLogFile(log_path, max_log_bytes, backup_count)
+		self._head_lines = head_lines
+		self._max_line_chars = max_line_chars
+		self._on_line = on_line
+		self._head: List[str] = []
+		self._tail: deque = deque(maxlen=tail_lines)
+		self._partial = b""
+		self._partial_overflow = False
+		self._line_count = 0
+		self._byte_count = 0
+
+	def feed(self, chunk: bytes) -> None:
+		self._log.write(chunk)
+		self._byte_count += len(chunk)
+
+		lines = (self._partial + chunk).split(b"\n")
+		self._partial = lines.pop()
+
+		for line in lines:
+			self._add_line(line)
+
+		# Never buffer more than a single in memory line worth of a line that
+		# has not been terminated yet, the log file has the rest of it.
+		max_line_bytes = self._max_line_chars * 4
+		if len(self._partial) > max_line_bytes:
+			self._partial = self._partial[:max_line_bytes]
+			self._partial_overflow = True
+
+	def _add_line(self, raw_line: bytes) -> None:
+		# The line overflowed while buffering, so it must not be parsed as a
+		# whole line by the callback.
+		overflowed = self._partial_overflow
+		self._partial_overflow = False
+
+		line = raw_line.decode(errors="replace").rstrip("\r")
+		self._line_count += 1
+
+		if self._on_line is not None and not overflowed:
+			self._on_line(line)
+
+		if len(line) > self._max_line_chars or overflowed:
+			line = line[:self._max_line_chars] + " ...[truncated]"
+
+		if len(self._head) < self._head_lines:
+			self._head.append(line)
+		else:
+			self._tail.append(line)
+
+	def close(self) -> CapturedOutput:
+		if self._partial or self._partial_overflow:
+			self._add_line(self._partial)
+			self._partial = b""
+
+		self._log.close()
+
+		return CapturedOutput(
+			head=self._head,
+			tail=list(self._tail),
+			line_count=self._line_count,
+			byte_count=self._byte_count,
+			log_path=self._log.path,
+		)
@@ -0,0 +1,161 @@
+import json
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+from shared.plan_summary import PlanSummary
+
+# Replacements are applied as a delete and a create, each reported separately
+_OPERATIONS_BY_ACTION = {"replace": 2}
+
+# Diagnostics kept from a run, Terraform can emit the same warning for every resource
+MAX_DIAGNOSTICS = 20
+
+
+@dataclass
+class ApplyProgress:
+	"""Progress of a 'terraform apply' or 'terraform destroy', as sent in the
+	heartbeat details of the activity running it."""
+
+	planned: int = 0
+	completed: int = 0
+	failed: int = 0
+	current_resource: str = ""
+	current_action: str = ""
+	attempt: int = 1
+
+	@property
+	def percent(self) -> int:
+		if self.planned <= 0:
+			return 0
+
+		return min(100, self.completed * 100 // self.planned)
+
+	def to_dict(self) -> dict:
+		return {**asdict(self), "percent": self.percent}
+
+	@classmethod
+	def from_dict(cls, data: dict) -> "ApplyProgress":
+		return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+
+class ProgressTracker:
+	"""Follow the machine readable '-json' event stream of an apply or destroy
+	line by line, counting resources as they are planned and completed, and
+	keeping the final change summary and the diagnostics Terraform reports.
+
+	A tracker resumed from the heartbeat details of a failed attempt counts
+	the resources that attempt completed as done. Terraform won't plan them
+	again, so they are added to both the planned and completed totals."""
+
+	def __init__(
+		self,
+		plan_summary: Optional[PlanSummary] = None,
+		resumed: Optional[ApplyProgress] = None,
+		attempt: int = 1,
+	) -> None:
+		self._baseline = resumed.completed if resumed else 0
+		self._pending: Dict[str, int] = {}
+		# Operations expected from the counts of a compact summary, which doesn't name the resources
+		self._unnamed = 0
+		self._from_summary = False
+		self._completed = 0
+		self._failed = 0
+		self._current_resource = ""
+		self._current_action = ""
+		self._attempt = attempt
+		self._change_counts: Dict[str, int] = {}
+		self._diagnostics: List[str] = []
+
+		# Applying a saved plan doesn't report the planned changes again, so
+		# expect the changes of the approved plan until Terraform says otherwise.
+		if plan_summary is not None and not self._baseline:
+			for change in plan_summary.changes:
+				if change.action != "no-op":
+					self._expect(change.address, change.action)
+			if not plan_summary.changes:
+				self._unnamed = sum(
+					count * _OPERATIONS_BY_ACTION.get(action, 1)
+					for action, count in plan_summary.counts.items() if action != "no-op"
+				)
+			self._from_summary = True
+
+	def _expect(self, address: str, action: str) -> None:
+		self._pending[address] = _OPERATIONS_BY_ACTION.get(action, 1)
+
+	def feed_line(self, line: str) -> None:
+		if not line.startswith("{"):
+			return
+
+		try:
+			event = json.loads(line)
+		except ValueError:
+			return
+
+		event_type = event.get("type")
+
+		if event_type == "planned_change":
+			if self._from_summary:
+				self._pending.clear()
+				self._unnamed = 0
+				self._from_summary = False
+			change = event.get("change") or {}
+			address = (change.get("resource") or {}).get("addr", "")
+			if change.get("action") not in (None, "noop", "no-op", "read"):
+				self._expect(address, change["action"])
+			return
+
+		if event_type == "change_summary":
+			changes = dict(event.get("changes") or {})
+			# The plan made during the apply reports its own summary first
+			if changes.pop("operation", "") != "plan":
+				self._change_counts = changes
+			return
+
+		if event_type == "diagnostic":
+			diagnostic = event.get("diagnostic") or {}
+			if len(self._diagnostics) < MAX_DIAGNOSTICS:
+				self._diagnostics.append(f"{diagnostic.get('severity', 'error')}: {diagnostic.get('summary', '')}")
+			return
+
+		if event_type not in ("apply_start", "apply_progress", "apply_complete", "apply_errored"):
+			return
+
+		hook = event.get("hook") or {}
+		address = (hook.get("resource") or {}).get("addr", "")
+		self._current_resource = address
+		self._current_action = hook.get("action", "")
+
+		if event_type == "apply_complete":
+			if address not in self._pending and self._unnamed:
+				self._unnamed -= 1
+			remaining = self._pending.get(address, 1) - 1
+			if remaining > 0:
+				self._pending[address] = remaining
+				return
+			self._pending.pop(address, None)
+			self._completed += 1
+			self._current_resource, self._current_action = "", ""
+		elif event_type == "apply_errored":
+			self._failed += 1
+
+	def progress(self) -> ApplyProgress:
+		# Pending changes are still to be done, completed ones count as
+		# planned even when Terraform didn't announce them beforehand.
+		return ApplyProgress(
+			planned=self._baseline + self._completed + len(self._pending) + self._unnamed,
+			completed=self._baseline + self._completed,
+			failed=self._failed,
+			current_resource=self._current_resource,
+			current_action=self._current_action,
+			attempt=self._attempt,
+		)
+
+	@property
+	def change_counts(self) -> Dict[str, int]:
+		"""Resources added, changed, imported and removed, as Terraform reported them."""
+
+		return dict(self._change_counts)
+
+	@property
+	def diagnostics(self) -> List[str]:
+		return list(self._diagnostics)
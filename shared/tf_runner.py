@@ -1,114 +1,613 @@
 import os
-import subprocess
+import re
+import json
+import shutil
+import codecs
+import tempfile
 import asyncio
-from typing import Tuple
+import hashlib
+import signal
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional, Tuple
 
 from shared.base import TerraformRunDetails, TerraformApplyError, \
 	TerraformInitError, TerraformPlanError, TerraformOutputError, \
-	TerraformDestroyError
+	TerraformDestroyError, TERRAFORM_LOG_DIR, TERRAFORM_LOG_MAX_BYTES, \
+	TERRAFORM_LOG_BACKUP_COUNT, TERRAFORM_LOG_DIR_MAX_BYTES, TERRAFORM_PLUGIN_CACHE_DIR, \
+	TERRAFORM_PLAN_DIR, TERRAFORM_CANCEL_GRACE_SECS
+from shared.tf_capture import CapturedOutput, OutputCapture, prune_logs
+from shared.plan_summary import PlanSummary, PlanSummaryBuilder
+from shared.tf_scheduler import AdaptiveParallelism, TerraformScheduler
+from shared.tf_state import LocalStateReader, StateSnapshot
+from shared.offload import ParsingPool
+
+# Size of the chunks read from a streamed Terraform subprocess
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# File, inside the .terraform directory, that records the hash of the last successful init
+INIT_HASH_FILENAME = ".init-hash"
+
+# Environment variables that change what 'terraform init' does, beyond the configuration itself
+INIT_ENV_VAR_PREFIXES = ("TF_CLI_ARGS", "TF_WORKSPACE", "TF_DATA_DIR", "TF_PLUGIN_CACHE_DIR")
+
+# Local module sources, e.g. 'source = "./modules/app"', whose configuration init installs too
+LOCAL_MODULE_SOURCE = re.compile(r'\bsource\s*[=:]\s*"(\.\.?/[^"]*)"')
+
+# Record, inside a run's plan directory, of the latest saved plan and its digest
+SAVED_PLAN_RECORD = "latest.json"
+
+# Error Terraform reports when a saved plan no longer applies to the current state
+STALE_PLAN_MESSAGE = "Saved plan is stale"
+
+logger = logging.getLogger(__name__)
+
+
+def _reports_stale_plan(line: str) -> bool:
+	"""Whether a line of the '-json' event stream is the diagnostic Terraform
+	reports when a saved plan no longer applies to the current state."""
+
+	if STALE_PLAN_MESSAGE not in line:
+		return False
+
+	try:
+		event = json.loads(line)
+	except ValueError:
+		return False
+
+	diagnostic = event.get("diagnostic") or {}
+	return event.get("type") == "diagnostic" and STALE_PLAN_MESSAGE in diagnostic.get("summary", "")
+
+
+def _dir_or_temp(directory: str, name: str) -> str:
+	"""A configured directory, or one in the temp dir. Looked up here rather
+	than in shared.base, which workflows import and where the sandbox doesn't
+	allow looking up the temp dir."""
+
+	return directory or os.path.join(tempfile.gettempdir(), name)
 
 
 class TerraformRunner:
 
-	async def _run_cmd_in_dir(self, command: list[str], data: TerraformRunDetails) -> tuple:
-		"""Run a Terraform command and capture the output."""
+	def __init__(
+		self,
+		plugin_cache_dir: str = TERRAFORM_PLUGIN_CACHE_DIR,
+		scheduler: Optional[TerraformScheduler] = None,
+		cancel_grace_secs: float = TERRAFORM_CANCEL_GRACE_SECS,
+		parsing_pool: Optional[ParsingPool] = None,
+	) -> None:
+		self._plugin_cache_dir = plugin_cache_dir
+		self._parsing_pool = parsing_pool or ParsingPool()
+		self._cancel_grace_secs = cancel_grace_secs
+		self._scheduler = scheduler or TerraformScheduler()
+		self._adaptive_parallelism = AdaptiveParallelism(self._scheduler)
+		self._state_reader = LocalStateReader()
+
+		# Terraform silently ignores a plugin cache directory that doesn't exist
+		if self._plugin_cache_dir:
+			os.makedirs(self._plugin_cache_dir, exist_ok=True)
+
+	def _build_env(self, data: TerraformRunDetails) -> Dict[str, str]:
+		"""Copy the environment variables and update with the provided ones."""
 
-		# Copy the environment variables and update with the provided ones
 		env = os.environ.copy()
+
+		# Share downloaded providers between every directory and run on this worker
+		if self._plugin_cache_dir:
+			env.setdefault("TF_PLUGIN_CACHE_DIR", self._plugin_cache_dir)
+
 		env.update(data.env_vars)
+		return env
+
+	async def _run_cmd_in_dir(
+		self,
+		command: list[str],
+		data: TerraformRunDetails,
+		on_stdout: Optional[Callable[[str], None]] = None,
+	) -> tuple:
+		"""Run a Terraform command and capture the output. Given a callback,
+		each chunk of stdout is handed to it as it arrives instead of being
+		kept, and the stdout returned is empty."""
 
 		# Run the command in the specified directory
 		# Create the subprocess and await its completion
+		async with self._owned_process(command, data) as process:
+			# Read the output (non-blocking)
+			stdout_parts: list[str] = []
+			decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+			async def _read_stdout() -> None:
+				while True:
+					chunk = await process.stdout.read(STREAM_CHUNK_BYTES)
+					text = decoder.decode(chunk, final=not chunk)
+					if text:
+						if on_stdout is not None:
+							on_stdout(text)
+						else:
+							stdout_parts.append(text)
+					if not chunk:
+						break
+
+			_, stderr_bytes = await asyncio.gather(_read_stdout(), process.stderr.read())
+			await process.wait()
+			stdout, stderr = "".join(stdout_parts), stderr_bytes.decode(errors="replace")
+
+		return process.returncode, stdout, stderr
+
+	@asynccontextmanager
+	async def _owned_process(
+		self, command: list[str], data: TerraformRunDetails
+	) -> AsyncIterator[asyncio.subprocess.Process]:
+		"""Start a command in a process group of its own, and stop the whole
+		group if the caller is cancelled or fails before the command exits, so
+		that neither Terraform nor its provider plugins outlive the activity."""
+
+		# Copy the environment variables and update with the provided ones
+		env = self._build_env(data)
+
 		process = await asyncio.create_subprocess_exec(
 			*command,
 			env=env,
 			cwd=data.directory,
 			stdout=asyncio.subprocess.PIPE,
-			stderr=asyncio.subprocess.PIPE
+			stderr=asyncio.subprocess.PIPE,
+			start_new_session=True,
 		)
 
-		# Read the output (non-blocking)
-		stdout_bytes, stderr_bytes = await process.communicate()
-		stdout, stderr = stdout_bytes.decode(), stderr_bytes.decode()
+		try:
+			yield process
+		finally:
+			if process.returncode is None:
+				await self._terminate(process)
+
+	async def _terminate(self, process: asyncio.subprocess.Process) -> None:
+		"""Interrupt a process group the way Ctrl-C would, so that Terraform can
+		stop its providers and write its state, and kill it if it doesn't exit
+		within the grace period."""
+
+		logger.warning(f"Interrupting Terraform process {process.pid}")
+		self._signal_group(process, signal.SIGINT)
+
+		# Keep the pipes flowing, a process blocked on a full pipe can't exit
+		drains = [
+			asyncio.create_task(self._discard(stream))
+			for stream in (process.stdout, process.stderr) if stream is not None
+		]
+
+		try:
+			await asyncio.wait_for(process.wait(), self._cancel_grace_secs)
+		except asyncio.TimeoutError:
+			logger.warning(
+				f"Terraform process {process.pid} didn't exit within {self._cancel_grace_secs}s, killing it"
+			)
+			self._signal_group(process, signal.SIGKILL)
+			await process.wait()
+		except asyncio.CancelledError:
+			# Cancelled again while waiting, don't wait any longer
+			self._signal_group(process, signal.SIGKILL)
+			raise
+		finally:
+			for drain in drains:
+				drain.cancel()
+
+		# Providers that ignored the interrupt must not outlive Terraform
+		self._signal_group(process, signal.SIGKILL)
+
+	def _signal_group(self, process: asyncio.subprocess.Process, sig: signal.Signals) -> None:
+		try:
+			os.killpg(process.pid, sig)
+		except (ProcessLookupError, PermissionError):
+			# Every process in the group has already exited
+			pass
+
+	async def _discard(self, stream: asyncio.StreamReader) -> None:
+		while await stream.read(STREAM_CHUNK_BYTES):
+			pass
+
+	async def _stream_cmd_in_dir(
+		self,
+		command: list[str],
+		data: TerraformRunDetails,
+		on_stdout_line: Optional[Callable[[str], None]] = None,
+	) -> Tuple[int, CapturedOutput, CapturedOutput]:
+		"""Run a Terraform command, streaming its output to disk and keeping
+		only a bounded head and tail of each stream in memory. Each complete
+		line of stdout is optionally handed to a callback as it arrives."""
+
+		log_prefix = self._log_prefix(command, data)
+		stdout_capture = OutputCapture(
+			f"{log_prefix}.stdout.log",
+			max_log_bytes=TERRAFORM_LOG_MAX_BYTES,
+			backup_count=TERRAFORM_LOG_BACKUP_COUNT,
+			on_line=on_stdout_line,
+		)
+		stderr_capture = OutputCapture(
+			f"{log_prefix}.stderr.log",
+			max_log_bytes=TERRAFORM_LOG_MAX_BYTES,
+			backup_count=TERRAFORM_LOG_BACKUP_COUNT,
+		)
 
-		return process.returncode, stdout, stderr
+		try:
+			async with self._owned_process(command, data) as process:
+				# Drain both pipes concurrently so neither can fill up and block the process
+				await asyncio.gather(
+					self._drain(process.stdout, stdout_capture),
+					self._drain(process.stderr, stderr_capture),
+				)
+				await process.wait()
+		finally:
+			stdout_output, stderr_output = stdout_capture.close(), stderr_capture.close()
+
+		# Every run leaves its logs behind, so the least recently written ones
+		# make room once the directory is full, never the ones just written.
+		removed = await asyncio.to_thread(
+			prune_logs,
+			os.path.dirname(log_prefix),
+			TERRAFORM_LOG_DIR_MAX_BYTES,
+			(stdout_output.log_path, stderr_output.log_path),
+		)
+		if removed:
+			logger.info(f"Removed {removed} old Terraform log file(s)")
+
+		return process.returncode, stdout_output, stderr_output
+
+	async def _drain(self, stream: asyncio.StreamReader, capture: OutputCapture) -> None:
+		"""Feed a subprocess stream into a capture until it is closed."""
+
+		while True:
+			chunk = await stream.read(STREAM_CHUNK_BYTES)
+			if not chunk:
+				break
+			capture.feed(chunk)
+
+	def _log_prefix(self, command: list[str], data: TerraformRunDetails) -> str:
+		"""Build a stable log file prefix for a run and Terraform subcommand, so
+		that retries of the same step overwrite rather than accumulate logs."""
+
+		run_name = data.id or os.path.basename(os.path.abspath(data.directory))
+		run_name = re.sub(r"[^A-Za-z0-9_.-]", "_", run_name)
+		subcommand = command[1] if len(command) > 1 else command[0]
+
+		return os.path.join(_dir_or_temp(TERRAFORM_LOG_DIR, "terraform-logs"), f"{run_name}-{subcommand}")
+
+	def _init_hash(self, data: TerraformRunDetails, env: Dict[str, str]) -> str:
+		"""Hash everything that determines the result of 'terraform init' for a
+		directory: the configuration, the dependency lock file and the
+		environment that carries backend and CLI settings."""
+
+		digest = hashlib.sha256()
+		self._hash_configuration(data.directory, digest, set())
+
+		for key in sorted(env):
+			if key.startswith(INIT_ENV_VAR_PREFIXES):
+				digest.update(f"{key}={env[key]}".encode())
+
+		return digest.hexdigest()
+
+	def _hash_configuration(self, directory: str, digest: "hashlib._Hash", seen: set) -> None:
+		"""Hash the configuration files of a directory, and of the local modules
+		it calls, since init copies those into .terraform/modules as well."""
+
+		directory = os.path.realpath(directory)
+		if directory in seen or not os.path.isdir(directory):
+			return
+		seen.add(directory)
+
+		module_sources = []
+		for filename in sorted(os.listdir(directory)):
+			if filename.endswith((".tf", ".tf.json")) or filename == ".terraform.lock.hcl":
+				with open(os.path.join(directory, filename), "rb") as fh:
+					content = fh.read()
+				digest.update(filename.encode())
+				digest.update(content)
+				module_sources.extend(LOCAL_MODULE_SOURCE.findall(content.decode(errors="replace")))
+
+		for source in module_sources:
+			digest.update(source.encode())
+			self._hash_configuration(os.path.join(directory, source), digest, seen)
+
+	def _init_hash_path(self, data: TerraformRunDetails) -> str:
+		return os.path.join(data.directory, ".terraform", INIT_HASH_FILENAME)
+
+	def _last_init_hash(self, data: TerraformRunDetails) -> str:
+		"""Get the hash of the last successful init, which lives inside the
+		.terraform directory so that it goes away together with it."""
+
+		try:
+			with open(self._init_hash_path(data), "r") as fh:
+				return fh.read().strip()
+		except FileNotFoundError:
+			return ""
+
+	def _record_init_hash(self, data: TerraformRunDetails, init_hash: str) -> None:
+		# Configurations without providers or modules don't get a .terraform directory
+		os.makedirs(os.path.dirname(self._init_hash_path(data)), exist_ok=True)
+		with open(self._init_hash_path(data), "w") as fh:
+			fh.write(init_hash)
 
 	async def init(self, data: TerraformRunDetails) -> Tuple[str, str]:
 		"""Initialize the Terraform configuration."""
 
-		# Run 'terraform init' command with the '-json' flag
-		returncode, stdout, stderr = await self._run_cmd_in_dir(["terraform", "init", "-json"], data)
+		# Only one command per directory at a time, so that a concurrent init
+		# can reuse the result instead of initializing all over again.
+		async with self._scheduler.slot(data.directory, "init"):
+			env = self._build_env(data)
+			if self._init_hash(data, env) == self._last_init_hash(data):
+				return "Terraform init skipped, configuration unchanged since the last init", ""
+
+			# Run 'terraform init' command with the '-json' flag
+			returncode, stdout, stderr = await self._run_cmd_in_dir(["terraform", "init", "-json"], data)
 
-		if returncode != 0:
-			raise TerraformInitError(f"Terraform init errored: {stderr}")
+			if returncode != 0:
+				raise TerraformInitError(f"Terraform init errored: {stderr}")
+
+			# Init may have written the lock file, so hash after it completes
+			self._record_init_hash(data, self._init_hash(data, env))
 
 		return stdout, stderr
 
-	async def plan(self, data: TerraformRunDetails, activity_id: str) -> Tuple[str, str, str, str]:
-		"""Plan the Terraform configuration."""
+	async def prewarm(self, directories: Iterable[str]) -> None:
+		"""Initialize known directories ahead of time, so that the first run
+		against each of them doesn't pay for a cold init."""
 
-		# Get the regular plan output for display purposes
-		_, plan_stdout, _ = \
-			await self._run_cmd_in_dir(["terraform", "plan"], data)
+		async def _prewarm_directory(directory: str) -> None:
+			try:
+				await self.init(TerraformRunDetails(directory=directory))
+				logger.info(f"Terraform directory prewarmed: {directory}")
+			except Exception as e:
+				logger.warning(f"Terraform directory prewarm failed for {directory}: {e}")
 
-		# Generate a binary plan file with the provided activity ID
-		tfplan_binary_filename = f"{activity_id}.binary"
-		plan_returncode, _, plan_stderr = \
-			await self._run_cmd_in_dir(["terraform", "plan", "-out", tfplan_binary_filename], data)
+		await asyncio.gather(*[_prewarm_directory(d) for d in directories])
 
-		# Remove the binary plan file if there are errors
-		if plan_returncode != 0:
-			await self._run_cmd_in_dir(["rm", tfplan_binary_filename], data)
-			raise TerraformPlanError(f"Terraform plan errored: {plan_stderr}")
+	def _plan_dir(self, data: TerraformRunDetails) -> str:
+		"""Directory holding the saved binary plans of a run."""
 
-		# Show the JSON representation of the plan
-		show_json_returncode, show_json_stdout, show_json_stderr = \
-			await self._run_cmd_in_dir(["terraform", "show", "-json", tfplan_binary_filename], data)
+		run_name = re.sub(r"[^A-Za-z0-9_.-]", "_", data.id or os.path.abspath(data.directory))
+		return os.path.join(_dir_or_temp(TERRAFORM_PLAN_DIR, "terraform-plans"), run_name)
 
-		# Remove the binary plan file
-		await self._run_cmd_in_dir(["rm", tfplan_binary_filename], data)
+	def _record_saved_plan(self, data: TerraformRunDetails, plan_file: str, digest: str) -> None:
+		"""Remember the latest saved plan of a run, and the digest of what it does."""
 
-		if show_json_returncode != 0:
-			raise TerraformPlanError(f"Terraform show JSON errored: {show_json_stderr}")
+		with open(os.path.join(self._plan_dir(data), SAVED_PLAN_RECORD), "w") as fh:
+			json.dump({"plan_file": plan_file, "digest": digest}, fh)
 
-		return show_json_stdout, show_json_stderr, plan_stdout, plan_stderr
+	def _saved_plan_for(self, data: TerraformRunDetails) -> Optional[str]:
+		"""Find the saved plan that matches the plan summary carried by the run,
+		so that the plan that was approved is the one that gets applied."""
 
-	async def apply(self, data: TerraformRunDetails) -> Tuple[str, str]:
-		"""Apply the Terraform configuration."""
+		if data.plan_summary is None:
+			return None
 
-		# Apply the Terraform configuration with the '-json' and '-auto-approve' flags
-		returncode, stdout, stderr = \
-			await self._run_cmd_in_dir(["terraform", "apply", "-json", "-auto-approve"], data)
+		try:
+			with open(os.path.join(self._plan_dir(data), SAVED_PLAN_RECORD), "r") as fh:
+				record = json.load(fh)
+		except (FileNotFoundError, ValueError):
+			return None
 
-		if returncode != 0:
-			raise TerraformApplyError(f"Terraform apply errored: {stderr}")
+		if record.get("digest") != data.plan_summary.digest or not os.path.exists(record.get("plan_file", "")):
+			return None
 
-		return stdout, stderr
+		return record["plan_file"]
 
-	async def destroy(self, data: TerraformRunDetails) -> Tuple[str, str]:
-		"""Destroy the Terraform configuration."""
-		# Destroy the Terraform configuration with the '-json' and '-auto-approve' flags
-		returncode, stdout, stderr = \
-			await self._run_cmd_in_dir(["terraform", "destroy", "-json", "-auto-approve"], data)
+	def _run_flags(self, data: TerraformRunDetails, saved_plan: bool = False) -> list[str]:
+		"""Build the execution flags of a plan, apply or destroy from the run
+		details. Must be called while holding a scheduler slot."""
 
-		if returncode != 0:
-			raise TerraformDestroyError(f"Terraform destroy errored: {stderr}")
+		flags = []
 
-		return stdout, stderr
+		parallelism = data.parallelism
+		if data.adaptive_parallelism:
+			parallelism = self._adaptive_parallelism.parallelism_for(data.directory)
+		if parallelism > 0:
+			flags.append(f"-parallelism={parallelism}")
+
+		if data.lock_timeout:
+			flags.append(f"-lock-timeout={data.lock_timeout}")
+
+		# A saved plan already fixed what is refreshed and targeted, and
+		# Terraform refuses the planning flags when applying one.
+		if not saved_plan:
+			if not data.refresh:
+				flags.append("-refresh=false")
+			flags.extend(f"-target={target}" for target in data.targets)
+
+		return flags
+
+	def _observe_throttling(self, data: TerraformRunDetails, stderr: str) -> None:
+		"""Feed the stderr of a finished command back into the adaptive parallelism."""
+
+		if data.adaptive_parallelism and self._adaptive_parallelism.observe(data.directory, stderr):
+			logger.warning(f"Provider throttling detected in {data.directory}, lowering its parallelism")
+
+	def discard_saved_plans(self, data: TerraformRunDetails) -> None:
+		"""Remove every saved plan of a run."""
 
-	async def output(self, data: TerraformRunDetails) -> Tuple[str, str]:
+		shutil.rmtree(self._plan_dir(data), ignore_errors=True)
+
+	async def plan(self, data: TerraformRunDetails, activity_id: str) -> Tuple[str, str, PlanSummary]:
+		"""Plan the Terraform configuration."""
+
+		async with self._scheduler.slot(data.directory, "plan"):
+			# Generate a binary plan file keyed by the run and activity ID, this is
+			# the only time the state is refreshed and the providers are called.
+			os.makedirs(self._plan_dir(data), exist_ok=True)
+			tfplan_binary_filename = os.path.join(self._plan_dir(data), f"{activity_id}.binary")
+			plan_returncode, _, plan_stderr = await self._run_cmd_in_dir(
+				["terraform", "plan", *self._run_flags(data), "-out", tfplan_binary_filename], data
+			)
+			self._observe_throttling(data, plan_stderr)
+
+			# Remove the binary plan file if there are errors
+			if plan_returncode != 0:
+				self._remove_plan_file(tfplan_binary_filename)
+				raise TerraformPlanError(f"Terraform plan errored: {plan_stderr}")
+
+			plan_stdout, plan_stderr, plan_summary = await self._render_plan(data, tfplan_binary_filename)
+
+			# Keep the binary plan around for the apply
+			self._record_saved_plan(data, tfplan_binary_filename, plan_summary.digest)
+
+			return plan_stdout, plan_stderr, plan_summary
+
+	async def _render_plan(self, data: TerraformRunDetails, tfplan_binary_filename: str) -> Tuple[str, str, PlanSummary]:
+		"""Render the human readable and the JSON representations of the same
+		binary plan concurrently, neither of which needs to refresh state. The
+		compact summary is built from the JSON as it streams in, the JSON itself
+		is never kept. The binary plan is removed if either of them fails."""
+
+		summary_builder = PlanSummaryBuilder()
+		(show_returncode, plan_stdout, plan_stderr), \
+			(show_json_returncode, _, show_json_stderr) = await asyncio.gather(
+				self._run_cmd_in_dir(["terraform", "show", tfplan_binary_filename], data),
+				self._run_cmd_in_dir(
+					["terraform", "show", "-json", tfplan_binary_filename], data, on_stdout=summary_builder.feed
+				),
+			)
+
+		if show_returncode != 0:
+			self._remove_plan_file(tfplan_binary_filename)
+			raise TerraformPlanError(f"Terraform show errored: {plan_stderr}")
+
+		if show_json_returncode != 0:
+			self._remove_plan_file(tfplan_binary_filename)
+			raise TerraformPlanError(f"Terraform show JSON errored: {show_json_stderr}")
+
+		return plan_stdout, plan_stderr, summary_builder.finish()
+
+	async def drift_check(self, data: TerraformRunDetails, activity_id: str) -> Tuple[bool, str, Optional[PlanSummary]]:
+		"""Check whether the real infrastructure drifted from the configuration
+		and its state, without taking the state lock or keeping the plan.
+
+		Returns whether there is drift, and only when there is, the human
+		readable plan and its summary. Plans without changes are never
+		rendered, which is the common case across a fleet."""
+
+		async with self._scheduler.slot(data.directory, "plan"):
+			os.makedirs(self._plan_dir(data), exist_ok=True)
+			tfplan_binary_filename = os.path.join(self._plan_dir(data), f"{activity_id}.drift.binary")
+			try:
+				# With -detailed-exitcode, 0 means no changes, 2 means changes and 1 means an error
+				plan_returncode, _, plan_stderr = await self._run_cmd_in_dir(
+					["terraform", "plan", "-detailed-exitcode", "-lock=false", *self._run_flags(data),
+						"-out", tfplan_binary_filename],
+					data,
+				)
+				self._observe_throttling(data, plan_stderr)
+
+				if plan_returncode == 0:
+					return False, "", None
+
+				if plan_returncode != 2:
+					raise TerraformPlanError(f"Terraform drift check errored: {plan_stderr}")
+
+				plan_stdout, _, plan_summary = await self._render_plan(data, tfplan_binary_filename)
+				return True, plan_stdout, plan_summary
+			finally:
+				self._remove_plan_file(tfplan_binary_filename)
+
+	def _remove_plan_file(self, path: str) -> None:
+		"""Remove a binary plan file, if it exists."""
+
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+	async def apply(
+		self, data: TerraformRunDetails, on_event: Optional[Callable[[str], None]] = None
+	) -> Tuple[CapturedOutput, CapturedOutput]:
+		"""Apply the Terraform configuration, handing each line of the '-json'
+		event stream to the optional callback."""
+
+		async with self._scheduler.slot(data.directory, "apply"):
+			saved_plan = self._saved_plan_for(data)
+
+			if saved_plan is not None:
+				stale = False
+
+				def on_saved_plan_event(line: str) -> None:
+					nonlocal stale
+					# With '-json' the diagnostics are events on stdout, not stderr
+					stale = stale or _reports_stale_plan(line)
+					if on_event is not None:
+						on_event(line)
+
+				# Apply exactly the plan that was approved, without refreshing and
+				# planning all over again. Saved plans never prompt for approval.
+				returncode, stdout, stderr = await self._stream_cmd_in_dir(
+					["terraform", "apply", "-json", *self._run_flags(data, saved_plan=True), saved_plan], data,
+					on_saved_plan_event,
+				)
+
+				# The state changed since the plan was made, so it can't be applied
+				if returncode != 0 and (stale or STALE_PLAN_MESSAGE in stderr.summary()):
+					logger.warning(f"Saved plan {saved_plan} is stale, planning again during apply")
+					saved_plan = None
+			else:
+				# The plan was made on another worker or is no longer available
+				logger.info("No saved plan matches the approved plan, planning again during apply")
+
+			if saved_plan is None:
+				# Apply the Terraform configuration with the '-json' and '-auto-approve' flags
+				returncode, stdout, stderr = await self._stream_cmd_in_dir(
+					["terraform", "apply", "-json", "-auto-approve", *self._run_flags(data)], data, on_event
+				)
+
+			self._observe_throttling(data, stderr.summary())
+
+			if returncode != 0:
+				raise TerraformApplyError(f"Terraform apply errored: {stderr.summary()}")
+
+			self.discard_saved_plans(data)
+
+			return stdout, stderr
+
+	async def destroy(
+		self, data: TerraformRunDetails, on_event: Optional[Callable[[str], None]] = None
+	) -> Tuple[CapturedOutput, CapturedOutput]:
+		"""Destroy the Terraform configuration, handing each line of the '-json'
+		event stream to the optional callback."""
+		async with self._scheduler.slot(data.directory, "destroy"):
+			# Destroy the Terraform configuration with the '-json' and '-auto-approve' flags
+			returncode, stdout, stderr = await self._stream_cmd_in_dir(
+				["terraform", "destroy", "-json", "-auto-approve", *self._run_flags(data)], data, on_event
+			)
+			self._observe_throttling(data, stderr.summary())
+
+			if returncode != 0:
+				raise TerraformDestroyError(f"Terraform destroy errored: {stderr.summary()}")
+
+			return stdout, stderr
+
+	async def state_snapshot(self, data: TerraformRunDetails) -> Optional[StateSnapshot]:
+		"""Read the local state of a directory without starting a process, or
+		None if the state lives in a remote backend or can't be read."""
+
+		state_path = self._state_reader.state_path(data.directory, self._build_env(data))
+		if state_path is None:
+			return None
+
+		try:
+			return await self._state_reader.read_with(state_path, self._parsing_pool)
+		except (OSError, ValueError) as e:
+			# e.g. read while Terraform was writing it
+			logger.warning(f"Terraform state {state_path} could not be read, falling back to terraform: {e}")
+			return None
+
+	async def output(self, data: TerraformRunDetails) -> Tuple[dict, str]:
 		"""Show the output of the Terraform run."""
-		# NOTE: This is a blocking call since it simply returns the output
 
-		# Get the output of the Terraform run in JSON format
-		returncode, stdout, stderr = \
-			await self._run_cmd_in_dir(["terraform", "output", "-json"], data)
+		# Local state can be read directly, without spawning 'terraform output'
+		snapshot = await self.state_snapshot(data)
+		if snapshot is not None:
+			return snapshot.outputs, ""
 
-		if returncode != 0:
-			raise TerraformOutputError(f"Terraform output errored: {stderr}")
+		async with self._scheduler.slot(data.directory, "output"):
+			# Get the output of the Terraform run in JSON format
+			returncode, stdout, stderr = \
+				await self._run_cmd_in_dir(["terraform", "output", "-json"], data)
 
-		return stdout, stderr
+			if returncode != 0:
+				raise TerraformOutputError(f"Terraform output errored: {stderr}")
 
-	def set_plan(self, plan: dict) -> None:
-		"""Set the Terraform plan."""
-		self._tfplan = plan
+			return await self._parsing_pool.run(len(stdout), json.loads, stdout), stderr
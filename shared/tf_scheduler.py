@@ -0,0 +1,239 @@
+import os
+import re
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from enum import IntEnum
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from temporalio.common import MetricMeter
+
+from shared.base import TERRAFORM_MAX_CONCURRENCY, TERRAFORM_MEMORY_PER_PROCESS_MB, \
+	TERRAFORM_PARALLELISM_BUDGET
+
+
+class Priority(IntEnum):
+	"""Scheduling classes, lower values are granted a slot first."""
+	HIGH = 0
+	NORMAL = 1
+	LOW = 2
+
+
+# Short, read mostly commands jump ahead of the long running ones
+PRIORITY_BY_SUBCOMMAND = {
+	"init": Priority.HIGH,
+	"output": Priority.HIGH,
+	"show": Priority.HIGH,
+	"plan": Priority.NORMAL,
+	"apply": Priority.LOW,
+	"destroy": Priority.LOW,
+}
+
+
+# Signs in Terraform's stderr that a provider is being rate limited by its API
+THROTTLING_PATTERN = re.compile(
+	r"\b429\b|throttl|rate exceeded|rate limit|too ?many ?requests|slow ?down", re.IGNORECASE)
+
+# Bounds of the adaptive parallelism, the upper bound is well past Terraform's default of 10
+MIN_ADAPTIVE_PARALLELISM = 1
+MAX_ADAPTIVE_PARALLELISM = 50
+
+
+def default_max_concurrency() -> int:
+	"""Size the number of concurrent Terraform processes to the host, bounded
+	by both the number of cores and the memory a process is expected to use."""
+
+	if TERRAFORM_MAX_CONCURRENCY > 0:
+		return TERRAFORM_MAX_CONCURRENCY
+
+	cpus = os.cpu_count() or 1
+
+	try:
+		memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+	except (AttributeError, ValueError, OSError):
+		return cpus
+
+	return max(1, min(cpus, memory_mb // TERRAFORM_MEMORY_PER_PROCESS_MB))
+
+
+@dataclass
+class SchedulerStats:
+	max_concurrency: int
+	active: int
+	queued: int
+	total_wait_secs: float
+	total_run_secs: float
+	completed: int
+
+
+class TerraformScheduler:
+	"""Worker wide admission control for Terraform processes: a global cap on
+	concurrent commands, granted by priority, and a mutex per directory so two
+	commands never run against the same directory at once.
+
+	Queue depth, time spent waiting for a slot and time spent running are
+	recorded on the given metric meter, so that latency caused by queueing
+	can be told apart from latency caused by Terraform itself."""
+
+	def __init__(self, max_concurrency: Optional[int] = None, metric_meter: Optional[MetricMeter] = None) -> None:
+		self.max_concurrency = max_concurrency or default_max_concurrency()
+		self._active = 0
+		self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+		self._sequence = itertools.count()
+		self._directory_locks: Dict[str, asyncio.Lock] = {}
+		self._directory_users: Dict[str, int] = {}
+		self._total_wait_secs = 0.0
+		self._total_run_secs = 0.0
+		self._completed = 0
+
+		metric_meter = metric_meter or MetricMeter.noop
+		self._queue_depth_gauge = metric_meter.create_gauge(
+			"terraform_scheduler_queue_depth", "Terraform commands waiting for a slot")
+		self._active_gauge = metric_meter.create_gauge(
+			"terraform_scheduler_active", "Terraform commands currently running")
+		self._wait_histogram = metric_meter.create_histogram_timedelta(
+			"terraform_scheduler_wait_time", "Time a Terraform command waited for a slot", "ms")
+		self._run_histogram = metric_meter.create_histogram_timedelta(
+			"terraform_command_duration", "Time a Terraform command held its slot", "ms")
+
+	@property
+	def active(self) -> int:
+		return self._active
+
+	@property
+	def queued(self) -> int:
+		return sum(1 for _, _, waiter in self._waiters if not waiter.done())
+
+	def stats(self) -> SchedulerStats:
+		return SchedulerStats(
+			max_concurrency=self.max_concurrency,
+			active=self._active,
+			queued=self.queued,
+			total_wait_secs=self._total_wait_secs,
+			total_run_secs=self._total_run_secs,
+			completed=self._completed,
+		)
+
+	@asynccontextmanager
+	async def slot(self, directory: str, subcommand: str) -> AsyncIterator[None]:
+		"""Hold the directory and a global slot for the duration of a command."""
+
+		priority = PRIORITY_BY_SUBCOMMAND.get(subcommand, Priority.NORMAL)
+		attrs = {"command": subcommand, "priority": priority.name.lower()}
+		loop = asyncio.get_running_loop()
+		queued_at = loop.time()
+
+		# Always take the directory lock before the global slot, so that a
+		# command waiting on a busy directory never holds a global slot.
+		async with self._directory_lock(os.path.abspath(directory)):
+			await self._acquire(priority)
+
+			started_at = loop.time()
+			self._total_wait_secs += started_at - queued_at
+			self._wait_histogram.record(timedelta(seconds=started_at - queued_at), attrs)
+
+			try:
+				yield
+			finally:
+				finished_at = loop.time()
+				self._total_run_secs += finished_at - started_at
+				self._completed += 1
+				self._run_histogram.record(timedelta(seconds=finished_at - started_at), attrs)
+				self._release()
+
+	@asynccontextmanager
+	async def _directory_lock(self, directory: str) -> AsyncIterator[None]:
+		lock = self._directory_locks.setdefault(directory, asyncio.Lock())
+		self._directory_users[directory] = self._directory_users.get(directory, 0) + 1
+
+		try:
+			async with lock:
+				yield
+		finally:
+			# Forget the lock once nobody holds or waits on it, so that the
+			# table doesn't grow with every directory ever seen.
+			self._directory_users[directory] -= 1
+			if self._directory_users[directory] == 0:
+				del self._directory_users[directory]
+				del self._directory_locks[directory]
+
+	async def _acquire(self, priority: Priority) -> None:
+		if self._active < self.max_concurrency and not self.queued:
+			self._active += 1
+			self._update_gauges()
+			return
+
+		waiter = asyncio.get_running_loop().create_future()
+		heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+		self._update_gauges()
+
+		try:
+			await waiter
+		except asyncio.CancelledError:
+			# The slot was handed over just as the waiter was cancelled
+			if waiter.done() and not waiter.cancelled():
+				self._release()
+			else:
+				waiter.cancel()
+				self._update_gauges()
+			raise
+
+	def _release(self) -> None:
+		self._active -= 1
+
+		# Hand the slot straight to the highest priority waiter
+		while self._waiters:
+			_, _, waiter = heapq.heappop(self._waiters)
+			if not waiter.done():
+				self._active += 1
+				waiter.set_result(None)
+				break
+
+		self._update_gauges()
+
+	def _update_gauges(self) -> None:
+		self._queue_depth_gauge.set(self.queued)
+		self._active_gauge.set(self._active)
+
+
+class AdaptiveParallelism:
+	"""Picks a '-parallelism' for each Terraform command from the worker's
+	current load and from throttling seen in earlier runs of the same stack.
+
+	A worker wide budget of concurrent resource operations is shared between
+	the commands that currently hold a scheduler slot. Each stack then has a
+	factor that is halved whenever its provider was throttled, and recovers
+	by doubling after every run that wasn't throttled."""
+
+	def __init__(self, scheduler: TerraformScheduler, budget: int = TERRAFORM_PARALLELISM_BUDGET) -> None:
+		self._scheduler = scheduler
+		self._budget = budget or 10 * (os.cpu_count() or 1)
+		self._factors: Dict[str, float] = {}
+
+	def parallelism_for(self, directory: str) -> int:
+		share = self._budget // max(1, self._scheduler.active)
+		factor = self._factors.get(os.path.abspath(directory), 1.0)
+
+		return max(MIN_ADAPTIVE_PARALLELISM, min(MAX_ADAPTIVE_PARALLELISM, int(share * factor)))
+
+	def observe(self, directory: str, stderr: str) -> bool:
+		"""Adjust a stack's factor from the stderr of a finished command, and
+		report whether it was throttled."""
+
+		key = os.path.abspath(directory)
+		factor = self._factors.get(key, 1.0)
+		throttled = bool(THROTTLING_PATTERN.search(stderr))
+
+		if throttled:
+			self._factors[key] = max(factor / 2, 1 / MAX_ADAPTIVE_PARALLELISM)
+		elif factor < 1.0:
+			self._factors[key] = min(factor * 2, 1.0)
+
+		# Stacks that are back to full speed don't need to be remembered
+		if self._factors.get(key) == 1.0:
+			del self._factors[key]
+
+		return throttled
@@ -0,0 +1,154 @@
+import os
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from shared.offload import ParsingPool
+
+# The serial sits near the top of a state file, ahead of the outputs and resources
+_SERIAL = re.compile(rb'"serial"\s*:\s*(\d+)')
+_SERIAL_PEEK_BYTES = 4096
+
+# Environment variables that move the state or the data directory somewhere the
+# reader doesn't look, in which case it leaves it to Terraform itself.
+_UNSUPPORTED_ENV_VARS = ("TF_DATA_DIR",)
+
+
+@dataclass
+class StateSnapshot:
+	serial: int = 0
+	lineage: str = ""
+	outputs: Dict[str, dict] = field(default_factory=dict)
+	resource_count: int = 0
+	resource_counts_by_type: Dict[str, int] = field(default_factory=dict)
+
+
+class LocalStateReader:
+	"""Reads outputs, resource counts and the serial straight from the local
+	state file of a directory, without starting a Terraform process.
+
+	Snapshots are cached per state file and only re-parsed when the serial
+	changes, so repeated reads of an unchanged state cost a stat and a read
+	of the first few kilobytes."""
+
+	def __init__(self) -> None:
+		self._cache: Dict[str, Tuple[Tuple[int, int, int], StateSnapshot]] = {}
+
+	def state_path(self, directory: str, env: Dict[str, str]) -> Optional[str]:
+		"""Get the local state file of a directory, or None when the state is
+		kept somewhere only Terraform knows how to read, like a remote backend."""
+
+		if any(env.get(key) for key in _UNSUPPORTED_ENV_VARS):
+			return None
+
+		workspace = env.get("TF_WORKSPACE", "")
+		try:
+			with open(os.path.join(directory, ".terraform", "environment"), "r") as fh:
+				workspace = workspace or fh.read().strip()
+		except FileNotFoundError:
+			pass
+
+		if workspace not in ("", "default"):
+			return None
+
+		path = "terraform.tfstate"
+		try:
+			with open(os.path.join(directory, ".terraform", "terraform.tfstate"), "r") as fh:
+				backend = json.load(fh).get("backend") or {}
+		except FileNotFoundError:
+			backend = {}
+		except ValueError:
+			return None
+
+		if backend.get("type", "local") != "local":
+			return None
+
+		path = (backend.get("config") or {}).get("path") or path
+		return os.path.join(directory, path)
+
+	def _lookup(self, state_path: str) -> Tuple[Optional[StateSnapshot], Tuple[int, int, int], int]:
+		"""Get the snapshot of a state file if it is unchanged since it was last
+		parsed, along with the key to cache a new snapshot under and its size."""
+
+		try:
+			stat = os.stat(state_path)
+		except FileNotFoundError:
+			# Nothing has been applied yet
+			return StateSnapshot(), (0, 0, 0), 0
+
+		if stat.st_size == 0:
+			return StateSnapshot(), (0, 0, 0), 0
+
+		key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+		cached = self._cache.get(state_path)
+		if cached is not None and cached[0] == key:
+			return cached[1], key, stat.st_size
+
+		if cached is not None:
+			with open(state_path, "rb") as fh:
+				match = _SERIAL.search(fh.read(_SERIAL_PEEK_BYTES))
+				serial = int(match.group(1)) if match else -1
+
+			# Rewritten, but with the same serial, so nothing changed
+			if serial >= 0 and cached[1].serial == serial:
+				self._cache[state_path] = (key, cached[1])
+				return cached[1], key, stat.st_size
+
+		return None, key, stat.st_size
+
+	def read(self, state_path: str) -> StateSnapshot:
+		snapshot, key, _ = self._lookup(state_path)
+
+		if snapshot is None:
+			snapshot = load_state(state_path)
+			self._cache[state_path] = (key, snapshot)
+
+		return snapshot
+
+	async def read_with(self, state_path: str, pool: ParsingPool) -> StateSnapshot:
+		"""Like read, but parse large state files in the given parsing pool."""
+
+		snapshot, key, size = self._lookup(state_path)
+
+		if snapshot is None:
+			snapshot = await pool.run(size, load_state, state_path)
+			self._cache[state_path] = (key, snapshot)
+
+		return snapshot
+
+
+def load_state(state_path: str) -> StateSnapshot:
+	"""Parse a state file into a snapshot, this is a module level function so
+	that it can run in a parsing pool process."""
+
+	with open(state_path, "rb") as fh:
+		state = json.load(fh)
+
+	counts_by_type: Dict[str, int] = {}
+	resource_count = 0
+
+	for resource in state.get("resources", []):
+		if resource.get("mode") != "managed":
+			continue
+		instances = len(resource.get("instances", []))
+		resource_count += instances
+		counts_by_type[resource.get("type", "")] = counts_by_type.get(resource.get("type", ""), 0) + instances
+
+	# Match the shape of 'terraform output -json'
+	outputs = {
+		name: {
+			"sensitive": output.get("sensitive", False),
+			"type": output.get("type"),
+			"value": output.get("value"),
+		}
+		for name, output in state.get("outputs", {}).items()
+	}
+
+	return StateSnapshot(
+		serial=state.get("serial", 0),
+		lineage=state.get("lineage", ""),
+		outputs=outputs,
+		resource_count=resource_count,
+		resource_counts_by_type=counts_by_type,
+	)
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import shutil
+import logging
+import tempfile
+
+from shared.base import TerraformRunDetails, TERRAFORM_WORKSPACE_ROOT, TERRAFORM_STATE_DIR
+
+# Files that Terraform or the runner rewrite in place, these are copied into a
+# workspace rather than hard linked so that a run can never modify the template.
+COPIED_FILENAMES = (".terraform.lock.hcl", ".init-hash", "environment", "terraform.tfstate")
+
+# Files in the root of the template that belong to the shared, non isolated runs
+SKIPPED_ROOT_FILENAMES = ("terraform.tfstate", "terraform.tfstate.backup", ".terraform.tfstate.lock.info")
+
+# The state file of a run, inside of its workspace and inside of the saved state directory
+STATE_FILENAME = "terraform.tfstate"
+
+logger = logging.getLogger(__name__)
+
+
+class WorkspaceManager:
+	"""Builds a cheap, isolated copy of a Terraform directory for each run, so
+	that concurrent runs against the same directory don't share a .terraform
+	directory, plan files or local state.
+
+	Workspaces are built by hard linking the files of the template directory,
+	including an already initialized .terraform directory, falling back to a
+	copy when the workspace root is on a different filesystem. Each run keeps
+	its own local state keyed by TerraformRunDetails.id, saved to the state
+	directory after every change, where the workspace of the same run on any
+	worker picks it up. The saved state outlives the workspace for as long as
+	it still tracks resources. Configurations that
+	reference files outside of their own directory (e.g. '../modules') are not
+	supported in isolated workspaces."""
+
+	def __init__(self, root: str = TERRAFORM_WORKSPACE_ROOT, state_dir: str = TERRAFORM_STATE_DIR) -> None:
+		# Looked up here, workflows import shared.base and can't look up the temp dir
+		root = root or os.path.join(tempfile.gettempdir(), "terraform-workspaces")
+		self._runs_dir = os.path.join(root, "runs")
+		self._state_dir = state_dir or os.path.join(root, "state")
+
+	def _run_name(self, data: TerraformRunDetails) -> str:
+		if not data.id:
+			raise ValueError("Isolated workspaces require a TerraformRunDetails.id")
+
+		return re.sub(r"[^A-Za-z0-9_.-]", "_", data.id)
+
+	def path_for(self, data: TerraformRunDetails) -> str:
+		return os.path.join(self._runs_dir, self._run_name(data))
+
+	def _saved_state_path(self, data: TerraformRunDetails) -> str:
+		return os.path.join(self._state_dir, self._run_name(data), STATE_FILENAME)
+
+	def ensure(self, data: TerraformRunDetails) -> str:
+		"""Get the workspace of a run, building it from the template directory
+		the first time it is requested on this worker."""
+
+		workspace = self.path_for(data)
+		if os.path.isdir(workspace):
+			# The run may have moved to another host and back in the meantime
+			self._restore_state(data, workspace)
+			return workspace
+
+		# Build the workspace next to its final location and move it into place,
+		# so that a partially built workspace is never used by a run.
+		building = f"{workspace}.building-{os.getpid()}"
+		shutil.rmtree(building, ignore_errors=True)
+		self._link_tree(os.path.abspath(data.directory), building)
+
+		self._restore_state(data, building)
+
+		try:
+			os.rename(building, workspace)
+		except OSError:
+			# Another activity of the same run built it first
+			shutil.rmtree(building, ignore_errors=True)
+
+		logger.info(f"Terraform workspace ready for {data.id}: {workspace}")
+		return workspace
+
+	def _restore_state(self, data: TerraformRunDetails, workspace: str) -> None:
+		"""Bring the saved state of a run into its workspace, if it is newer."""
+
+		saved_state = self._saved_state_path(data)
+		state = os.path.join(workspace, STATE_FILENAME)
+		if self._serial(saved_state) > self._serial(state):
+			shutil.copy2(saved_state, state)
+
+	def save_state(self, data: TerraformRunDetails) -> None:
+		"""Save the state of a run's workspace to the state directory, unless the
+		saved state is newer, e.g. when the run moved on to another host."""
+
+		state = os.path.join(self.path_for(data), STATE_FILENAME)
+		saved_state = self._saved_state_path(data)
+		if not os.path.exists(state) or self._serial(state) < self._serial(saved_state):
+			return
+
+		# Written next to the saved state and moved into place, so that other
+		# workers never read a partially copied state.
+		os.makedirs(os.path.dirname(saved_state), exist_ok=True)
+		saving = f"{saved_state}.saving-{os.getpid()}"
+		shutil.copy2(state, saving)
+		os.replace(saving, saved_state)
+
+	def _link_tree(self, src_root: str, dst_root: str) -> None:
+		for dirpath, dirnames, filenames in os.walk(src_root):
+			rel_dir = os.path.relpath(dirpath, src_root)
+			dst_dir = os.path.normpath(os.path.join(dst_root, rel_dir))
+			os.makedirs(dst_dir, exist_ok=True)
+
+			# Workspaces of the shared state are never part of a run's workspace
+			if rel_dir == ".":
+				dirnames[:] = [d for d in dirnames if d != "terraform.tfstate.d"]
+
+			for dirname in list(dirnames):
+				src = os.path.join(dirpath, dirname)
+				# Providers in .terraform are symlinks into the plugin cache
+				if os.path.islink(src):
+					os.symlink(os.readlink(src), os.path.join(dst_dir, dirname))
+					dirnames.remove(dirname)
+
+			for filename in filenames:
+				if rel_dir == "." and (filename in SKIPPED_ROOT_FILENAMES or filename.endswith(".binary")):
+					continue
+
+				src = os.path.join(dirpath, filename)
+				dst = os.path.join(dst_dir, filename)
+
+				if os.path.islink(src):
+					os.symlink(os.readlink(src), dst)
+				elif filename in COPIED_FILENAMES:
+					shutil.copy2(src, dst)
+				else:
+					try:
+						os.link(src, dst)
+					except OSError:
+						shutil.copy2(src, dst)
+
+	def release(self, data: TerraformRunDetails) -> None:
+		"""Garbage collect the workspace of a run, keeping its state only if it
+		still tracks resources that would otherwise be orphaned."""
+
+		workspace = self.path_for(data)
+		if not os.path.isdir(workspace):
+			return
+
+		# Decide on the latest state, wherever the run last changed it
+		self._restore_state(data, workspace)
+		if self._has_resources(os.path.join(workspace, STATE_FILENAME)):
+			self.save_state(data)
+		else:
+			shutil.rmtree(os.path.dirname(self._saved_state_path(data)), ignore_errors=True)
+
+		shutil.rmtree(workspace, ignore_errors=True)
+		logger.info(f"Terraform workspace released for {data.id}: {workspace}")
+
+	def _serial(self, state_path: str) -> int:
+		try:
+			with open(state_path, "r") as fh:
+				return json.load(fh).get("serial", 0)
+		except (FileNotFoundError, ValueError):
+			return -1
+
+	def _has_resources(self, state_path: str) -> bool:
+		try:
+			with open(state_path, "r") as fh:
+				return bool(json.load(fh).get("resources"))
+		except (FileNotFoundError, ValueError):
+			return False
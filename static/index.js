@@ -43,12 +43,120 @@ function runWorkflow() {
 		"&deployment_prefix=" + encodeURIComponent(deploymentPrefix);
 }
 
+function formatResourceProgress(resourceProgress) {
+	if (resourceProgress == null || resourceProgress.planned === 0) {
+		return "";
+	}
+
+	var text = " (" + resourceProgress.completed + "/" + resourceProgress.planned +
+		" resources, " + resourceProgress.percent + "%";
+
+	if (resourceProgress.current_resource) {
+		text += ", " + resourceProgress.current_action + " " + resourceProgress.current_resource;
+	}
+
+	return text + ")";
+}
+
+// Digest of the plan currently displayed
+var planDigest = "";
+
+function renderProgress(data, scenario, tfRunID) {
+	// Update the progress bar
+	clearErrorMessage();
+	document.getElementById("progressBar").style.width = data.progress_percent + "%";
+
+	var currentStatusElement = document.getElementById("currentStatus");
+	if (currentStatusElement != null) {
+		currentStatusElement.innerText = data.status + formatResourceProgress(data.resource_progress);
+	}
+
+	// The plan is only sent when it changed since the last update
+	if (scenario !== "destroy" && data.plan != null && data.plan != "") {
+		// Display the Terraform plan
+		document.getElementById("terraformPlan").innerText = stripAnsi(data.plan);
+		document.getElementById("terraformPlanContainer").style.display = "block";
+		planDigest = data.plan_digest || "";
+	}
+
+	if (data.status.includes("approval")) {
+		// Show the appropriate container based on the scenario
+		if (scenario === "human_in_the_loop_signal") {
+			document.getElementById("signalContainer").style.display = "block";
+		} else if (scenario === "human_in_the_loop_update") {
+			document.getElementById("updateContainer").style.display = "block";
+		}
+
+		document.getElementById("newPlanContainer").style.display = "block";
+	}
+
+	if (data.progress_percent === 100) {
+		// Redirect to provisioned confirmation with the tfRunID
+		window.location.href =
+			"/provisioned?wf_id=" + encodeURIComponent(tfRunID) +
+			"&scenario=" + encodeURIComponent(scenario);
+		return true;
+	}
+
+	return false;
+}
+
+function showProgressError(message) {
+	// Log the detailed error message to the console
+	console.error("Error fetching progress:", message);
+
+	// Display the error message in the web browser
+	showErrorMessage(message);
+	// Handle the error by showing a red status bar
+	document.getElementById("progressBar").style.backgroundColor = "red";
+}
+
 function updateProgress() {
+	if (window.EventSource) {
+		streamProgress();
+	} else {
+		pollProgress();
+	}
+}
+
+function streamProgress() {
+	var urlParams = new URLSearchParams(window.location.search);
+	var scenario = urlParams.get("scenario");
+	var tfRunID = urlParams.get("wf_id");
+
+	// The server pushes the progress whenever it changes
+	var source = new EventSource("/progress_stream?wf_id=" + encodeURIComponent(tfRunID));
+
+	source.onmessage = function (event) {
+		var data = JSON.parse(event.data);
+
+		if (data.error) {
+			source.close();
+			showProgressError(data.error);
+		} else if (renderProgress(data, scenario, tfRunID)) {
+			source.close();
+		}
+	};
+
+	// The workflow is over, without reaching 100% (e.g. the apply was denied)
+	source.addEventListener("closed", function () {
+		source.close();
+	});
+
+	source.onerror = function () {
+		// The browser reconnects on its own, unless the stream can't be opened at all
+		if (source.readyState === EventSource.CLOSED) {
+			pollProgress();
+		}
+	};
+}
+
+function pollProgress() {
 	var urlParams = new URLSearchParams(window.location.search);
 	var scenario = urlParams.get("scenario");
 	var tfRunID = urlParams.get("wf_id");
 
-	fetch("/get_progress?wf_id=" + encodeURIComponent(tfRunID))
+	fetch("/get_progress?wf_id=" + encodeURIComponent(tfRunID) + "&plan_digest=" + encodeURIComponent(planDigest))
 		.then(response => {
 			if (response.ok) {
 				return response.json();
@@ -58,50 +166,13 @@ function updateProgress() {
 			}
 		})
 		.then(data => {
-			// Update the progress bar
-			clearErrorMessage();
-			document.getElementById("progressBar").style.width = data.progress_percent + "%";
-
-			var currentStatusElement = document.getElementById("currentStatus");
-			if (currentStatusElement != null) {
-				currentStatusElement.innerText = data.status;
-			}
-
-			if (scenario !== "destroy" && data.plan != "") {
-				// Display the Terraform plan
-				document.getElementById("terraformPlan").innerText = stripAnsi(data.plan);
-				document.getElementById("terraformPlanContainer").style.display = "block";
-			}
-
-			if (data.status.includes("approval")) {
-				// Show the appropriate container based on the scenario
-				if (scenario === "human_in_the_loop_signal") {
-					document.getElementById("signalContainer").style.display = "block";
-				} else if (scenario === "human_in_the_loop_update") {
-					document.getElementById("updateContainer").style.display = "block";
-				}
-
-				document.getElementById("newPlanContainer").style.display = "block";
-			}
-
-			if (data.progress_percent === 100) {
-				// Redirect to provisioned confirmation with the tfRunID
-				window.location.href =
-					"/provisioned?wf_id=" + encodeURIComponent(tfRunID) +
-					"&scenario=" + encodeURIComponent(scenario);
-			} else {
+			if (!renderProgress(data, scenario, tfRunID)) {
 				// Continue updating progress every second
-				setTimeout(updateProgress, 1000);
+				setTimeout(pollProgress, 1000);
 			}
 		})
 		.catch(error => {
-			// Log the detailed error message to the console
-			console.error("Error fetching progress:", error.message);
-
-			// Display the error message in the web browser
-			showErrorMessage(error.message);
-			// Handle the error by showing a red status bar
-			document.getElementById("progressBar").style.backgroundColor = "red";
+			showProgressError(error.message);
 		});
 }
 
@@ -0,0 +1,34 @@
+import os
+import pytest
+from temporalio.api.common.v1 import Payload
+from shared.codec import ChainedCodec, ClaimCheckCodec, EncryptionCodec, LocalFileBlobStore
+
+
+@pytest.mark.asyncio
+async def test_claim_check_offloads_only_large_payloads(tmp_path):
+	codec = ClaimCheckCodec(LocalFileBlobStore(str(tmp_path)), threshold_bytes=1024)
+	small = Payload(metadata={"encoding": b"json/plain"}, data=b'"small"')
+	large = Payload(metadata={"encoding": b"json/plain"}, data=b'"' + b"x" * 4096 + b'"')
+
+	encoded = await codec.encode([small, large])
+
+	assert encoded[0] == small
+	assert encoded[1].metadata["encoding"] == b"binary/claim-check"
+	assert encoded[1].data == b""
+	assert len(os.listdir(tmp_path)) == 1
+
+	assert await codec.decode(encoded) == [small, large]
+
+
+@pytest.mark.asyncio
+async def test_claim_check_chained_after_encryption(tmp_path):
+	store = LocalFileBlobStore(str(tmp_path))
+	codec = ChainedCodec([EncryptionCodec(), ClaimCheckCodec(store, threshold_bytes=1024)])
+	large = Payload(metadata={"encoding": b"json/plain"}, data=b'"' + b"secret" * 1024 + b'"')
+
+	encoded = await codec.encode([large])
+	key = encoded[0].metadata["claim-check-key"].decode()
+
+	# The blob at rest is the encrypted payload, not the plain text
+	assert b"secret" not in await store.get(key)
+	assert await codec.decode(encoded) == [large]
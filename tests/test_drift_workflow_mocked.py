@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from temporalio import activity
+from temporalio.testing import WorkflowEnvironment
+from temporalio.worker import Worker
+from workflows.drift import DriftDetectionWorkflow, StackDriftCheckWorkflow
+from shared.base import DriftDetectionDetails, DriftResult, TerraformRunDetails, TEMPORAL_TASK_QUEUE
+
+checks_started = []
+
+
+@pytest.mark.asyncio
+async def test_overlapping_runs_check_the_same_stacks():
+	checks_started.clear()
+	# Like two runs of the same schedule, the second starting before the first is done
+	data = DriftDetectionDetails(
+		id="drift-detection",
+		runs=[TerraformRunDetails(directory="stack", include_custom_search_attrs=False)],
+		max_jitter_secs=0,
+	)
+
+	async with await WorkflowEnvironment.start_time_skipping() as env:
+		async with Worker(
+			env.client,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			workflows=[DriftDetectionWorkflow, StackDriftCheckWorkflow],
+			activities=[terraform_init_mocked, terraform_drift_check_mocked],
+		):
+			results = await asyncio.gather(*(
+				env.client.execute_workflow(
+					DriftDetectionWorkflow.run,
+					data,
+					id=f"scheduled-drift-detection-{run}",
+					task_queue=TEMPORAL_TASK_QUEUE,
+				)
+				for run in range(2)
+			))
+
+	assert [[result.status for result in run] for run in results] == [["drifted"], ["drifted"]]
+	assert len(checks_started) == 2
+
+@activity.defn(name="terraform_init")
+async def terraform_init_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform init succeeded", "<stderr>"
+
+@activity.defn(name="terraform_drift_check")
+async def terraform_drift_check_mocked(data: TerraformRunDetails) -> DriftResult:
+	# Both checks of the stack are in flight at once
+	checks_started.append(data.id)
+	while len(checks_started) < 2:
+		await asyncio.sleep(0.05)
+	return DriftResult(directory=data.directory, status="drifted", digest="mocked")
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import asyncio
+import logging
+import pytest
+from shared.offload import ParsingPool
+from shared.loop_monitor import EventLoopMonitor
+
+
+@pytest.mark.asyncio
+async def test_large_documents_are_parsed_in_the_pool():
+	pool = ParsingPool(threshold_bytes=1024, max_workers=1)
+	small, large = json.dumps({"a": 1}), json.dumps({"a": "x" * 4096})
+
+	try:
+		assert await pool.run(len(small), json.loads, small) == {"a": 1}
+		assert pool._executor is None
+
+		assert await pool.run(len(large), json.loads, large) == {"a": "x" * 4096}
+		assert pool._executor is not None
+	finally:
+		pool.shutdown()
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# An entry module that, like the worker once did, binds a port when it is
+# imported, which the processes of the pool can't bind again when they
+# import it themselves.
+ENTRY_MODULE_WITH_SIDE_EFFECTS = """
+import os, sys, json, socket, asyncio
+sys.path.insert(0, {repo_dir!r})
+from shared.offload import ParsingPool
+
+exporter = socket.socket()
+exporter.bind(("127.0.0.1", int(os.environ.get("FAKE_EXPORTER_PORT", "0"))))
+os.environ["FAKE_EXPORTER_PORT"] = str(exporter.getsockname()[1])
+
+async def main():
+	pool = ParsingPool(threshold_bytes=1, max_workers=1)
+	document = json.dumps({{"a": 1}})
+	try:
+		print(json.dumps([await pool.run(len(document), json.loads, document) for _ in range(2)]))
+	finally:
+		pool.shutdown()
+
+if __name__ == "__main__":
+	asyncio.run(main())
+"""
+
+
+def test_documents_are_parsed_when_the_entry_module_breaks_the_pool(tmp_path):
+	entry = tmp_path / "entry.py"
+	entry.write_text(ENTRY_MODULE_WITH_SIDE_EFFECTS.format(repo_dir=REPO_DIR))
+
+	result = subprocess.run([sys.executable, str(entry)], capture_output=True, text=True, timeout=60)
+
+	assert result.returncode == 0, result.stderr
+	assert json.loads(result.stdout) == [{"a": 1}, {"a": 1}]
+	assert "parsing on the event loop from now on" in result.stderr
+
+
+def test_pool_processes_can_import_the_worker_again():
+	# What every process of the pool does with the entry module of the worker
+	script = "import runpy\nfor _ in range(2):\n\trunpy.run_path('worker.py', run_name='__mp_main__')\n"
+
+	result = subprocess.run([sys.executable, "-c", script], cwd=REPO_DIR, capture_output=True, text=True, timeout=60)
+
+	assert result.returncode == 0, result.stderr
+
+
+def _block_the_loop() -> None:
+	time.sleep(0.6)
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_reports_stalls_with_the_blocking_code(caplog):
+	monitor = EventLoopMonitor(threshold_secs=0.2, interval_secs=0.05)
+	monitor.start()
+
+	try:
+		with caplog.at_level(logging.WARNING, logger="shared.loop_monitor"):
+			await asyncio.sleep(0.2)
+			assert monitor.stall_count == 0
+
+			_block_the_loop()
+			await asyncio.sleep(0.2)
+	finally:
+		await monitor.stop()
+
+	assert monitor.stall_count == 1
+	assert "_block_the_loop" in caplog.text
@@ -0,0 +1,64 @@
+import json
+from shared.plan_summary import PlanSummary, PlanSummaryBuilder, summarize_plan
+
+PLAN = {
+	"format_version": "1.2",
+	"variables": {"prefix": {"value": "has \"resource_changes\": [ {brackets} in it \\"}},
+	"planned_values": {"root_module": {"resources": [{"address": "a", "values": {"x": [1, 2]}}]}},
+	"resource_changes": [
+		{
+			"address": "kubernetes_namespace.kuard",
+			"type": "kubernetes_namespace",
+			"name": "kuard",
+			"provider_name": "registry.terraform.io/hashicorp/kubernetes",
+			"change": {"actions": ["create"], "after": {"id": None, "metadata": [{"name": "kuard-namespace"}]}},
+		},
+		{
+			"address": "temporalcloud_user.admin",
+			"type": "temporalcloud_user",
+			"name": "admin",
+			"provider_name": "registry.terraform.io/temporalio/temporalcloud",
+			"change": {"actions": ["delete", "create"], "after": {"email": "a@b.c", "account_access": "admin"}},
+		},
+		{
+			"address": "kubernetes_deployment.kuard",
+			"type": "kubernetes_deployment",
+			"name": "kuard",
+			"provider_name": "registry.terraform.io/hashicorp/kubernetes",
+			"change": {"actions": ["no-op"], "after": {"wait_for_rollout": True}},
+		},
+	],
+	"output_changes": {"instructions": {"actions": ["create"]}},
+	"timestamp": "2024-11-21T13:32:06Z",
+}
+
+
+def test_summary_indexes_changes_by_action_and_type():
+	summary = summarize_plan(json.dumps(PLAN))
+
+	assert summary.counts == {"create": 1, "replace": 1, "no-op": 1}
+	assert [c.address for c in summary.changes_for_action("replace")] == ["temporalcloud_user.admin"]
+	assert [c.address for c in summary.changes_for_type("kubernetes_namespace")] == ["kubernetes_namespace.kuard"]
+	assert summary.changes_for_type("temporalcloud_user")[0].after["account_access"] == "admin"
+	# Nested attributes are not kept in the compact summary
+	assert "metadata" not in summary.changes[0].after
+	assert summary.has_changes
+	assert PlanSummary.from_dict(summary.to_dict()) == summary
+
+
+def test_summary_is_the_same_for_any_chunking():
+	document = json.dumps(PLAN, indent=1)
+	expected = summarize_plan(document)
+
+	for chunk_size in (1, 2, 3, 7, 64):
+		builder = PlanSummaryBuilder()
+		for i in range(0, len(document), chunk_size):
+			builder.feed(document[i:i + chunk_size])
+		assert builder.finish() == expected
+
+
+def test_digest_ignores_the_plan_timestamp():
+	later = dict(PLAN, timestamp="2024-11-22T00:00:00Z")
+
+	assert summarize_plan(json.dumps(PLAN)).digest == summarize_plan(json.dumps(later)).digest
+	assert not summarize_plan(json.dumps(dict(PLAN, resource_changes=[]))).has_changes
@@ -0,0 +1,55 @@
+import pytest
+from shared.plan_summary import PlanSummary, ResourceChange
+from shared.policy import DEFAULT_POLICY_RULES, PolicyEngine
+
+
+def _summary(digest: str, *changes: ResourceChange) -> PlanSummary:
+	summary = PlanSummary(digest=digest, changes=list(changes))
+	for index, change in enumerate(changes):
+		summary.by_type.setdefault(change.type, []).append(index)
+		summary.by_action.setdefault(change.action, []).append(index)
+	return summary
+
+
+def test_default_rules_fail_account_admins_and_namespace_deletes():
+	engine = PolicyEngine(DEFAULT_POLICY_RULES)
+
+	decision = engine.evaluate(_summary(
+		"one",
+		ResourceChange(address="temporalcloud_user.admin", type="temporalcloud_user", action="create",
+			after={"account_access": "admin"}),
+		ResourceChange(address="temporalcloud_user.dev", type="temporalcloud_user", action="create",
+			after={"account_access": "developer"}),
+		ResourceChange(address="temporalcloud_namespace.ns", type="temporalcloud_namespace", action="delete"),
+		ResourceChange(address="kubernetes_namespace.kuard", type="kubernetes_namespace", action="delete"),
+	))
+
+	assert not decision.passed
+	assert [(v.rule, v.address) for v in decision.violations] == [
+		("no-account-admins", "temporalcloud_user.admin"),
+		("no-namespace-deletes", "temporalcloud_namespace.ns"),
+	]
+
+	assert engine.evaluate(_summary(
+		"two", ResourceChange(address="kubernetes_namespace.kuard", type="kubernetes_namespace", action="create")
+	)).passed
+
+
+def test_decisions_are_cached_by_digest():
+	engine = PolicyEngine([{"name": "no-public", "resource_type": "*", "conditions": [
+		{"attribute": "name", "operator": "matches", "value": "^public-"},
+	]}], cache_size=1)
+	public = ResourceChange(address="a.b", type="a", action="create", after={"name": "public-bucket"})
+
+	first = engine.evaluate(_summary("digest", public))
+	assert not first.passed
+	assert engine.evaluate(_summary("digest")) is first
+
+	# The oldest decision is evicted once the cache is full
+	engine.evaluate(_summary("other"))
+	assert engine.evaluate(_summary("digest", public)) is not first
+
+
+def test_unknown_operators_fail_when_compiling():
+	with pytest.raises(ValueError):
+		PolicyEngine([{"name": "bad", "conditions": [{"attribute": "a", "operator": "like", "value": 1}]}])
@@ -0,0 +1,128 @@
+import asyncio
+import pytest
+from shared.progress_hub import ProgressHub
+
+
+class FakeWorkflow:
+	"""Progress of a workflow, and every fetch made for it."""
+
+	def __init__(self) -> None:
+		self.status = "planning"
+		self.plan_digest = ""
+		self.closed = False
+		self.fetches = []
+
+	async def fetch(self, wf_id: str, known_plan_digest: str) -> dict:
+		self.fetches.append(known_plan_digest)
+		return {
+			"status": self.status,
+			"plan_digest": self.plan_digest,
+			"plan": f"plan {self.plan_digest}" if self.plan_digest and self.plan_digest != known_plan_digest else None,
+			"closed": self.closed,
+		}
+
+
+async def _next(queue: asyncio.Queue):
+	return await asyncio.wait_for(queue.get(), timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_subscribers_share_a_watcher_and_only_get_changes():
+	workflow = FakeWorkflow()
+	hub = ProgressHub(workflow.fetch, poll_interval_secs=0.01)
+
+	first = hub.subscribe("wf")
+	assert (await _next(first))["status"] == "planning"
+
+	workflow.status, workflow.plan_digest = "planned", "abc"
+	event = await _next(first)
+	assert (event["status"], event["plan"]) == ("planned", "plan abc")
+
+	# A page that joins later gets the latest progress, with the plan
+	second = hub.subscribe("wf")
+	assert (await _next(second))["plan"] == "plan abc"
+	assert hub.watching == ["wf"]
+
+	# Nothing changed, so nothing is pushed, and the plan isn't fetched again
+	await asyncio.sleep(0.05)
+	assert first.empty() and second.empty()
+	assert workflow.fetches[-1] == "abc"
+
+	workflow.status, workflow.closed = "applied", True
+	for queue in (first, second):
+		assert (await _next(queue))["status"] == "applied"
+		assert await _next(queue) is None
+	assert hub.watching == []
+
+
+@pytest.mark.asyncio
+async def test_watcher_stops_when_the_last_subscriber_leaves():
+	workflow = FakeWorkflow()
+	hub = ProgressHub(workflow.fetch, poll_interval_secs=0.01)
+
+	first = hub.subscribe("wf")
+	second = hub.subscribe("wf")
+	await _next(first)
+
+	hub.unsubscribe("wf", first)
+	assert hub.watching == ["wf"]
+
+	hub.unsubscribe("wf", second)
+	assert hub.watching == []
+
+	fetches = len(workflow.fetches)
+	await asyncio.sleep(0.05)
+	assert len(workflow.fetches) == fetches
+
+
+@pytest.mark.asyncio
+async def test_empty_plans_without_a_digest_are_not_pushed_again():
+	fetches = []
+
+	# Like a deprovision workflow, which never has a plan digest
+	async def fetch(wf_id: str, known_plan_digest: str) -> dict:
+		fetches.append(known_plan_digest)
+		return {"status": "destroying", "plan_digest": "", "plan": "", "closed": False}
+
+	hub = ProgressHub(fetch, poll_interval_secs=0.01)
+	queue = hub.subscribe("wf")
+	assert (await _next(queue))["status"] == "destroying"
+
+	while len(fetches) < 20:
+		await asyncio.sleep(0.01)
+	assert queue.empty()
+
+	hub.unsubscribe("wf", queue)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_polls_share_one_fetch():
+	workflow = FakeWorkflow()
+	workflow.plan_digest = "abc"
+	release = asyncio.Event()
+
+	async def slow_fetch(wf_id: str, known_plan_digest: str) -> dict:
+		payload = await workflow.fetch(wf_id, known_plan_digest)
+		await release.wait()
+		return payload
+
+	hub = ProgressHub(slow_fetch)
+	polls = [asyncio.ensure_future(hub.fetch("wf", "abc")) for _ in range(5)]
+	# A page without the plan yet needs its own fetch, which sends it
+	first_poll = asyncio.ensure_future(hub.fetch("wf"))
+	await asyncio.sleep(0.01)
+
+	# A page that goes away doesn't cancel the fetch for the others
+	polls.pop().cancel()
+	release.set()
+
+	payloads = await asyncio.gather(*polls)
+	assert workflow.fetches == ["abc", ""]
+	assert all(payload["plan"] is None for payload in payloads)
+	assert (await first_poll)["plan"] == "plan abc"
+
+	# Each poll gets its own copy, and a later poll fetches again
+	payloads[0].pop("closed")
+	assert "closed" in payloads[1]
+	await hub.fetch("wf", "abc")
+	assert workflow.fetches == ["abc", "", "abc"]
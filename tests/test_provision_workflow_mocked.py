@@ -1,4 +1,5 @@
 import pytest
+import asyncio
 import dataclasses
 import json
 from temporalio.client import WorkflowHistory
@@ -8,7 +9,7 @@ from temporalio.worker import Worker
 from temporalio import converter
 from temporalio import activity
 from workflows.apply import ProvisionInfraWorkflow
-from shared.base import TerraformRunDetails, TEMPORAL_TASK_QUEUE
+from shared.base import ApplyDecisionDetails, TerraformRunDetails, WorkflowSnapshot, TEMPORAL_TASK_QUEUE
 from shared.codec import EncryptionCodec
 
 @pytest.mark.asyncio
@@ -67,6 +68,150 @@ async def test_successful_provisioning():
 
 			assert "mocked output details" in output["output"]
 
+@pytest.mark.asyncio
+async def test_provisioning_stays_on_the_host_task_queue():
+
+	async with await WorkflowEnvironment.start_time_skipping() as env:
+		mock_input = TerraformRunDetails(
+			directory="terraform/minikube_kuard",
+			include_custom_search_attrs=False,
+		)
+
+		# The shared task queue can only init, the rest of the run has to
+		# follow the host task queue init advertised.
+		async with Worker(
+			env.client,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			workflows=[ProvisionInfraWorkflow],
+			activities=[terraform_init_on_host_mocked, policy_check_mocked],
+		), Worker(
+			env.client,
+			task_queue=HOST_TASK_QUEUE,
+			activities=[terraform_plan_mocked, terraform_apply_mocked, terraform_output_mocked],
+		):
+			output = await env.client.execute_workflow(
+				ProvisionInfraWorkflow.run,
+				mock_input,
+				id="test-provision-host-affinity-workflow-id",
+				task_queue=TEMPORAL_TASK_QUEUE,
+			)
+
+			assert "mocked output details" in output["output"]
+
+@pytest.mark.asyncio
+async def test_busy_host_is_waited_for_and_a_gone_one_left():
+
+	async with await WorkflowEnvironment.start_time_skipping() as env:
+		mock_input = TerraformRunDetails(
+			directory="terraform/minikube_kuard",
+			include_custom_search_attrs=False,
+		)
+		host_checks.clear()
+
+		# Nothing polls the host task queue until the host has been checked on
+		# once, and it still polls, so the run stays there.
+		async with Worker(
+			env.client,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			workflows=[ProvisionInfraWorkflow],
+			activities=[terraform_init_on_host_mocked, policy_check_mocked, host_task_queue_polled_mocked],
+		):
+			handle = await env.client.start_workflow(
+				ProvisionInfraWorkflow.run,
+				mock_input,
+				id="test-provision-busy-host-workflow-id",
+				task_queue=TEMPORAL_TASK_QUEUE,
+			)
+			while not host_checks:
+				await asyncio.sleep(0.1)
+
+			async with Worker(
+				env.client,
+				task_queue=HOST_TASK_QUEUE,
+				activities=[terraform_plan_mocked, terraform_apply_mocked, terraform_output_mocked],
+			):
+				assert "mocked output details" in (await handle.result())["output"]
+
+		# A host that stopped polling is left, the run ends up on the shared task queue
+		async with Worker(
+			env.client,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			workflows=[ProvisionInfraWorkflow],
+			activities=[
+				terraform_init_on_host_mocked,
+				terraform_plan_mocked,
+				terraform_apply_mocked,
+				terraform_output_mocked,
+				policy_check_mocked,
+				host_task_queue_gone_mocked,
+			],
+		):
+			output = await env.client.execute_workflow(
+				ProvisionInfraWorkflow.run,
+				mock_input,
+				id="test-provision-gone-host-workflow-id",
+				task_queue=TEMPORAL_TASK_QUEUE,
+			)
+
+			assert "mocked output details" in output["output"]
+
+@pytest.mark.asyncio
+async def test_snapshot_leaves_out_the_plan_the_caller_already_has():
+
+	async with await WorkflowEnvironment.start_time_skipping() as env:
+		mock_input = TerraformRunDetails(
+			directory="terraform/minikube_kuard",
+			include_custom_search_attrs=False,
+			soft_fail_policy=True,
+		)
+
+		async with Worker(
+			env.client,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			workflows=[ProvisionInfraWorkflow],
+			activities=[terraform_init_mocked, terraform_plan_with_summary_mocked, policy_check_soft_fail_mocked],
+		):
+			handle = await env.client.start_workflow(
+				ProvisionInfraWorkflow.run,
+				mock_input,
+				id="test-provision-snapshot-workflow-id",
+				task_queue=TEMPORAL_TASK_QUEUE,
+			)
+
+			# The failed policy check holds the workflow until a decision comes in
+			while await handle.query(ProvisionInfraWorkflow.get_current_status) != "awaiting approval decision":
+				await asyncio.sleep(0.1)
+
+			snapshot = await handle.query(ProvisionInfraWorkflow.get_snapshot, "", result_type=WorkflowSnapshot)
+			assert (snapshot.plan_digest, snapshot.plan) == ("mocked-digest", "Terraform plan succeeded")
+
+			snapshot = await handle.query(ProvisionInfraWorkflow.get_snapshot, "mocked-digest", result_type=WorkflowSnapshot)
+			assert (snapshot.status, snapshot.plan_digest, snapshot.plan) == \
+				("awaiting approval decision", "mocked-digest", None)
+
+			# An outdated digest gets the plan again
+			snapshot = await handle.query(ProvisionInfraWorkflow.get_snapshot, "outdated", result_type=WorkflowSnapshot)
+			assert snapshot.plan == "Terraform plan succeeded"
+
+			await handle.signal(ProvisionInfraWorkflow.signal_apply_decision, ApplyDecisionDetails(is_approved=False))
+			assert await handle.result() == {}
+
+HOST_TASK_QUEUE = f"{TEMPORAL_TASK_QUEUE}-test-host"
+host_checks = []
+
+@activity.defn(name="host_task_queue_polled")
+async def host_task_queue_polled_mocked(task_queue: str) -> bool:
+	host_checks.append(task_queue)
+	return True
+
+@activity.defn(name="host_task_queue_polled")
+async def host_task_queue_gone_mocked(task_queue: str) -> bool:
+	return False
+
+@activity.defn(name="terraform_init")
+async def terraform_init_on_host_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform init succeeded", "<stderr>", HOST_TASK_QUEUE
+
 @activity.defn(name="terraform_init")
 async def terraform_init_mocked(data: TerraformRunDetails) -> tuple:
     return "Terraform init succeeded", "<stderr>"
@@ -75,6 +220,10 @@ async def terraform_init_mocked(data: TerraformRunDetails) -> tuple:
 async def terraform_plan_mocked(data: TerraformRunDetails) -> tuple:
     return "Terraform plan succeeded", "mocked plan JSON details"
 
+@activity.defn(name="terraform_plan")
+async def terraform_plan_with_summary_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform plan succeeded", {"digest": "mocked-digest", "counts": {"create": 1}}
+
 @activity.defn(name="terraform_apply")
 async def terraform_apply_mocked(data: TerraformRunDetails) -> str:
 	return "Terraform apply succeeded"
@@ -87,6 +236,10 @@ async def terraform_output_mocked(data: TerraformRunDetails) -> dict:
 async def policy_check_mocked(data: TerraformRunDetails) -> bool:
 	return True
 
+@activity.defn(name="policy_check")
+async def policy_check_soft_fail_mocked(data: TerraformRunDetails) -> bool:
+	return not data.soft_fail_policy
+
 @activity.defn(name="terraform_destroy")
 async def terraform_destroy_mocked(data: TerraformRunDetails) -> str:
 	return "Terraform destroy succeeded"
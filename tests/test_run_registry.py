@@ -0,0 +1,45 @@
+from shared.run_registry import RunRegistry
+
+
+def _run(index: int) -> dict:
+	return {"id": f"provision-infra-{index}", "scenario": "happy_path", "status": "applied"}
+
+
+def test_runs_are_listed_most_recent_first_and_evicted_past_the_cap():
+	registry = RunRegistry(max_runs=3)
+
+	for index in range(5):
+		assert registry.add(_run(index))
+	assert not registry.add({**_run(4), "status": "failed"})
+
+	assert [run["id"] for run in registry.recent()] == [f"provision-infra-{i}" for i in (4, 3, 2)]
+	assert registry.get("provision-infra-4")["status"] == "applied"
+	assert "provision-infra-1" not in registry
+
+	page = registry.page(2, size=2)
+	assert [run["id"] for run in page.runs] == ["provision-infra-2"]
+	assert (page.number, page.pages, page.total) == (2, 2, 3)
+	assert page.has_previous and not page.has_next
+
+	# Out of range pages are clamped
+	assert registry.page(9, size=2).number == 2
+	assert registry.page(0, size=2).number == 1
+
+
+def test_runs_are_kept_across_restarts(tmp_path):
+	db_path = str(tmp_path / "runs.db")
+
+	registry = RunRegistry(max_runs=10, db_path=db_path)
+	for index in range(4):
+		registry.add(_run(index))
+	registry.close()
+
+	# Reopened with a lower cap, only the most recent runs are kept
+	registry = RunRegistry(max_runs=2, db_path=db_path)
+	assert [run["id"] for run in registry.recent()] == ["provision-infra-3", "provision-infra-2"]
+	registry.add(_run(4))
+	registry.close()
+
+	registry = RunRegistry(max_runs=10, db_path=db_path)
+	assert [run["id"] for run in registry.recent()] == ["provision-infra-4", "provision-infra-3"]
+	registry.close()
@@ -0,0 +1,99 @@
+import pytest
+from temporalio import activity
+from temporalio.testing import WorkflowEnvironment
+from temporalio.worker import Worker
+from workflows.stack_entity import StackEntityWorkflow
+from shared.base import StackEntityState, StackRequest, TerraformRunDetails, TEMPORAL_TASK_QUEUE
+
+applies = []
+
+
+def test_duplicate_requests_are_folded_into_the_queued_one():
+	entity = StackEntityWorkflow()
+	entity._state = StackEntityState(run=TerraformRunDetails(directory="terraform/minikube_kuard"))
+
+	first_apply = entity._enqueue(StackRequest(kind="apply"))
+	assert entity._enqueue(StackRequest(kind="apply")) == first_apply
+	assert entity._enqueue(StackRequest(kind="plan")) == first_apply
+	destroy = entity._enqueue(StackRequest(kind="destroy"))
+
+	assert [(r.kind, r.seq, r.merged) for r in entity._state.pending] == [("apply", first_apply, 2), ("destroy", destroy, 0)]
+
+
+def test_requests_are_not_folded_across_a_conflicting_one():
+	entity = StackEntityWorkflow()
+	entity._state = StackEntityState(run=TerraformRunDetails(directory="terraform/minikube_kuard"))
+
+	first_apply = entity._enqueue(StackRequest(kind="apply"))
+	destroy = entity._enqueue(StackRequest(kind="destroy"))
+	# Applied last, so the stack must end up applied
+	second_apply = entity._enqueue(StackRequest(kind="apply"))
+	assert entity._enqueue(StackRequest(kind="plan")) == second_apply
+	third_destroy = entity._enqueue(StackRequest(kind="destroy"))
+
+	assert [(r.kind, r.seq, r.merged) for r in entity._state.pending] == [
+		("apply", first_apply, 0), ("destroy", destroy, 0), ("apply", second_apply, 1), ("destroy", third_destroy, 0),
+	]
+
+
+@pytest.mark.asyncio
+async def test_stack_entity_batches_applies():
+	applies.clear()
+
+	async with await WorkflowEnvironment.start_time_skipping() as env:
+		state = StackEntityState(
+			run=TerraformRunDetails(directory="terraform/minikube_kuard", include_custom_search_attrs=False),
+		)
+
+		async with Worker(
+			env.client,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			workflows=[StackEntityWorkflow],
+			activities=[
+				terraform_init_mocked,
+				terraform_plan_mocked,
+				terraform_apply_mocked,
+				terraform_destroy_mocked,
+				terraform_output_mocked,
+				policy_check_mocked,
+			],
+		):
+			handle = await env.client.start_workflow(
+				StackEntityWorkflow.run,
+				state,
+				id="test-stack-entity-id",
+				task_queue=TEMPORAL_TASK_QUEUE,
+			)
+
+			seqs = [await handle.execute_update(StackEntityWorkflow.submit_request, StackRequest(kind="apply")) for _ in range(3)]
+			await env.sleep(60)
+
+			assert len(applies) <= 2
+			assert len(set(seqs)) <= 2
+			assert (await handle.query(StackEntityWorkflow.get_outputs)) == {"output": "mocked output details"}
+			await handle.terminate()
+
+@activity.defn(name="terraform_init")
+async def terraform_init_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform init succeeded", "<stderr>"
+
+@activity.defn(name="terraform_plan")
+async def terraform_plan_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform plan succeeded", {"digest": "mocked"}
+
+@activity.defn(name="terraform_apply")
+async def terraform_apply_mocked(data: TerraformRunDetails) -> str:
+	applies.append(data.directory)
+	return "Terraform apply succeeded"
+
+@activity.defn(name="terraform_output")
+async def terraform_output_mocked(data: TerraformRunDetails) -> dict:
+	return {"output": "mocked output details"}
+
+@activity.defn(name="policy_check")
+async def policy_check_mocked(data: TerraformRunDetails) -> bool:
+	return True
+
+@activity.defn(name="terraform_destroy")
+async def terraform_destroy_mocked(data: TerraformRunDetails) -> str:
+	return "Terraform destroy succeeded"
@@ -0,0 +1,30 @@
+import pytest
+from shared.base import StackDetails, TerraformRunDetails
+from shared.stack_graph import build_stack_graph, reverse_stack_graph
+
+
+def _stack(name: str, *depends_on: str) -> StackDetails:
+	return StackDetails(name=name, run=TerraformRunDetails(directory=f"terraform/{name}"), depends_on=list(depends_on))
+
+
+def test_graph_and_its_teardown_order():
+	graph = build_stack_graph([
+		_stack("tcloud_namespace"),
+		_stack("tcloud_admin_user", "tcloud_namespace"),
+		_stack("minikube_kuard"),
+	])
+
+	assert graph == {"tcloud_namespace": [], "tcloud_admin_user": ["tcloud_namespace"], "minikube_kuard": []}
+	assert reverse_stack_graph(graph) == {
+		"tcloud_namespace": ["tcloud_admin_user"], "tcloud_admin_user": [], "minikube_kuard": [],
+	}
+
+
+@pytest.mark.parametrize("stacks", [
+	[_stack("a", "b"), _stack("b", "c"), _stack("c", "a")],
+	[_stack("a", "missing")],
+	[_stack("a"), _stack("a")],
+])
+def test_invalid_graphs_are_rejected(stacks):
+	with pytest.raises(ValueError):
+		build_stack_graph(stacks)
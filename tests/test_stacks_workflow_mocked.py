@@ -0,0 +1,129 @@
+import pytest
+from temporalio import activity
+from temporalio.client import WorkflowFailureError
+from temporalio.exceptions import ApplicationError
+from temporalio.testing import WorkflowEnvironment
+from temporalio.worker import Worker
+from workflows.apply import ProvisionInfraWorkflow
+from workflows.destroy import DeprovisionInfraWorkflow
+from workflows.stacks import ProvisionStacksWorkflow, DeprovisionStacksWorkflow
+from shared.base import MultiStackRunDetails, StackDetails, TerraformRunDetails, TEMPORAL_TASK_QUEUE
+
+applied, destroyed = [], []
+
+
+def _stacks(fail_fast: bool = True) -> MultiStackRunDetails:
+	def stack(name: str, *depends_on: str) -> StackDetails:
+		return StackDetails(
+			name=name,
+			run=TerraformRunDetails(directory=name, include_custom_search_attrs=False),
+			depends_on=list(depends_on),
+		)
+
+	return MultiStackRunDetails(
+		id="test-stacks",
+		stacks=[stack("namespace"), stack("admin_user", "namespace"), stack("app"), stack("broken")],
+		max_in_flight=2,
+		fail_fast=fail_fast,
+	)
+
+
+async def _run(workflow_run, data: MultiStackRunDetails):
+	async with await WorkflowEnvironment.start_time_skipping() as env:
+		async with Worker(
+			env.client,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			workflows=[ProvisionInfraWorkflow, DeprovisionInfraWorkflow, ProvisionStacksWorkflow, DeprovisionStacksWorkflow],
+			activities=[
+				terraform_init_mocked,
+				terraform_plan_mocked,
+				terraform_apply_mocked,
+				terraform_destroy_mocked,
+				terraform_output_mocked,
+				policy_check_mocked,
+			],
+		):
+			return await env.client.execute_workflow(
+				workflow_run,
+				data,
+				id=f"{data.id}-parent",
+				task_queue=TEMPORAL_TASK_QUEUE,
+			)
+
+
+@pytest.mark.asyncio
+async def test_stacks_continue_on_error():
+	applied.clear()
+	results = await _run(ProvisionStacksWorkflow.run, _stacks(fail_fast=False))
+
+	statuses = {result.name: result.status for result in results}
+	assert statuses == {"namespace": "succeeded", "admin_user": "succeeded", "app": "succeeded", "broken": "failed"}
+	assert applied.index("namespace") < applied.index("admin_user")
+
+
+@pytest.mark.asyncio
+async def test_stacks_fail_fast():
+	with pytest.raises(WorkflowFailureError):
+		await _run(ProvisionStacksWorkflow.run, _stacks(fail_fast=True))
+
+
+@pytest.mark.asyncio
+async def test_hard_failed_policy_blocks_the_dependent_stacks():
+	applied.clear()
+	data = MultiStackRunDetails(
+		id="test-stacks-policy",
+		stacks=[
+			StackDetails(
+				name="namespace",
+				run=TerraformRunDetails(directory="policy_violation", include_custom_search_attrs=False, hard_fail_policy=True),
+			),
+			StackDetails(
+				name="admin_user",
+				run=TerraformRunDetails(directory="admin_user", include_custom_search_attrs=False),
+				depends_on=["namespace"],
+			),
+		],
+		fail_fast=False,
+	)
+	results = await _run(ProvisionStacksWorkflow.run, data)
+
+	statuses = {result.name: result.status for result in results}
+	assert statuses == {"namespace": "failed", "admin_user": "skipped"}
+	assert applied == []
+
+
+@pytest.mark.asyncio
+async def test_stacks_are_torn_down_in_reverse_order():
+	destroyed.clear()
+	results = await _run(DeprovisionStacksWorkflow.run, _stacks(fail_fast=False))
+
+	assert all(result.status == "succeeded" for result in results)
+	assert destroyed.index("admin_user") < destroyed.index("namespace")
+
+@activity.defn(name="terraform_init")
+async def terraform_init_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform init succeeded", "<stderr>"
+
+@activity.defn(name="terraform_plan")
+async def terraform_plan_mocked(data: TerraformRunDetails) -> tuple:
+	return "Terraform plan succeeded", "mocked plan JSON details"
+
+@activity.defn(name="terraform_apply")
+async def terraform_apply_mocked(data: TerraformRunDetails) -> str:
+	if data.directory == "broken":
+		raise ApplicationError("Terraform apply errored", non_retryable=True)
+	applied.append(data.directory)
+	return "Terraform apply succeeded"
+
+@activity.defn(name="terraform_output")
+async def terraform_output_mocked(data: TerraformRunDetails) -> dict:
+	return {"output": data.directory}
+
+@activity.defn(name="policy_check")
+async def policy_check_mocked(data: TerraformRunDetails) -> bool:
+	return data.directory != "policy_violation"
+
+@activity.defn(name="terraform_destroy")
+async def terraform_destroy_mocked(data: TerraformRunDetails) -> str:
+	destroyed.append(data.directory)
+	return "Terraform destroy succeeded"
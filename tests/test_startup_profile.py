@@ -0,0 +1,29 @@
+import sys
+from shared.startup_profile import StartupProfile
+
+
+def test_times_first_imports_of_nested_modules(tmp_path, monkeypatch):
+	package = tmp_path / "profiled_package"
+	package.mkdir()
+	(package / "__init__.py").write_text("")
+	(package / "inner.py").write_text("import time\ntime.sleep(0.02)\n")
+	(package / "outer.py").write_text("from . import inner\n")
+	monkeypatch.syspath_prepend(str(tmp_path))
+
+	profile = StartupProfile().start()
+	try:
+		import profiled_package.outer  # noqa: F401
+		import profiled_package.outer  # noqa: F401,F811
+	finally:
+		profile.stop_imports()
+		for name in [n for n in sys.modules if n.startswith("profiled_package")]:
+			del sys.modules[name]
+
+	inner_total, inner_self = profile.imports["profiled_package.inner"]
+	outer_total, outer_self = profile.imports["profiled_package.outer"]
+	assert inner_self >= 0.02
+	# The nested import counts towards the outer module, but not its own time
+	assert outer_total >= inner_total
+	assert outer_self < inner_self
+	assert profile.import_secs >= outer_total
+	assert "profiled_package.inner" in profile.report()
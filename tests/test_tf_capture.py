@@ -0,0 +1,55 @@
+import os
+from shared.tf_capture import OutputCapture, prune_logs
+
+
+def test_capture_keeps_bounded_head_and_tail(tmp_path):
+	log_path = os.path.join(tmp_path, "apply.stdout.log")
+	capture = OutputCapture(log_path, head_lines=2, tail_lines=2)
+
+	for i in range(1000):
+		capture.feed(f"line {i}\n".encode())
+
+	output = capture.close()
+
+	assert output.head == ["line 0", "line 1"]
+	assert output.tail == ["line 998", "line 999"]
+	assert output.line_count == 1000
+	assert output.truncated
+	assert "996 line(s) omitted" in output.summary()
+
+	with open(log_path) as fh:
+		assert len(fh.read().splitlines()) == 1000
+
+
+def test_capture_rotates_log_and_splits_chunks(tmp_path):
+	log_path = os.path.join(tmp_path, "apply.stdout.log")
+	lines = []
+	capture = OutputCapture(log_path, max_log_bytes=64, backup_count=2, on_line=lines.append)
+
+	payload = b"".join(f"resource {i}\n".encode() for i in range(40))
+	for i in range(0, len(payload), 7):
+		capture.feed(payload[i:i + 7])
+
+	output = capture.close()
+
+	assert lines == [f"resource {i}" for i in range(40)]
+	assert output.byte_count == len(payload)
+	assert os.path.exists(f"{log_path}.1")
+	assert os.path.exists(f"{log_path}.2")
+	assert not os.path.exists(f"{log_path}.3")
+
+
+def test_log_directory_is_pruned_oldest_first(tmp_path):
+	for i, name in enumerate(["run-1-apply.stdout.log", "run-2-apply.stdout.log", "run-3-apply.stdout.log"]):
+		path = os.path.join(tmp_path, name)
+		with open(path, "wb") as fh:
+			fh.write(b"x" * 100)
+		os.utime(path, (1000 + i, 1000 + i))
+
+	# The logs just written are kept, even when they are the oldest
+	keep = os.path.join(tmp_path, "run-1-apply.stdout.log")
+	assert prune_logs(str(tmp_path), max_bytes=150, keep=[keep]) == 2
+	assert sorted(os.listdir(tmp_path)) == ["run-1-apply.stdout.log"]
+
+	assert prune_logs(str(tmp_path), max_bytes=0) == 0
+	assert prune_logs(os.path.join(tmp_path, "missing"), max_bytes=1) == 0
@@ -0,0 +1,84 @@
+import json
+from shared.plan_summary import PlanSummary, ResourceChange
+from shared.tf_progress import ApplyProgress, ProgressTracker
+
+
+def _event(event_type: str, address: str, action: str) -> str:
+	if event_type == "planned_change":
+		return json.dumps({"type": event_type, "change": {"resource": {"addr": address}, "action": action}})
+	return json.dumps({"type": event_type, "hook": {"resource": {"addr": address}, "action": action}})
+
+
+def test_progress_follows_planned_and_completed_events():
+	tracker = ProgressTracker()
+	tracker.feed_line('{"@level":"info","type":"version","terraform":"1.8.0"}')
+	tracker.feed_line(_event("planned_change", "kubernetes_namespace.demo", "create"))
+	tracker.feed_line(_event("planned_change", "kubernetes_deployment.kuard", "replace"))
+	tracker.feed_line("not json")
+
+	tracker.feed_line(_event("apply_start", "kubernetes_namespace.demo", "create"))
+	assert tracker.progress().current_resource == "kubernetes_namespace.demo"
+	tracker.feed_line(_event("apply_complete", "kubernetes_namespace.demo", "create"))
+
+	# A replacement is only done once both the delete and the create are
+	tracker.feed_line(_event("apply_complete", "kubernetes_deployment.kuard", "delete"))
+	progress = tracker.progress()
+	assert (progress.completed, progress.planned, progress.percent) == (1, 2, 50)
+
+	tracker.feed_line(_event("apply_complete", "kubernetes_deployment.kuard", "create"))
+	assert tracker.progress().percent == 100
+
+
+def test_saved_plan_apply_expects_the_approved_changes():
+	summary = PlanSummary(changes=[
+		ResourceChange(address="a.one", type="a", action="create"),
+		ResourceChange(address="a.two", type="a", action="no-op"),
+		ResourceChange(address="a.three", type="a", action="update"),
+	])
+	tracker = ProgressTracker(plan_summary=summary)
+	tracker.feed_line(_event("apply_complete", "a.one", "create"))
+
+	assert (tracker.progress().completed, tracker.progress().planned) == (1, 2)
+
+
+def test_retry_resumes_from_the_previous_attempt():
+	previous = ApplyProgress.from_dict({"planned": 4, "completed": 3, "percent": 75, "attempt": 1})
+	tracker = ProgressTracker(resumed=previous, attempt=2)
+
+	# Only what is left is planned again
+	tracker.feed_line(_event("planned_change", "a.four", "create"))
+	assert tracker.progress().percent == 75
+
+	tracker.feed_line(_event("apply_complete", "a.four", "create"))
+	progress = tracker.progress()
+	assert (progress.completed, progress.planned, progress.attempt) == (4, 4, 2)
+
+
+def test_keeps_the_apply_change_summary_and_diagnostics():
+	tracker = ProgressTracker()
+	tracker.feed_line(json.dumps({"type": "change_summary", "changes": {"add": 2, "change": 0, "remove": 1, "operation": "plan"}}))
+	tracker.feed_line(json.dumps({
+		"type": "diagnostic", "diagnostic": {"severity": "warning", "summary": "Argument is deprecated"},
+	}))
+	tracker.feed_line(json.dumps({"type": "change_summary", "changes": {"add": 1, "change": 0, "remove": 1, "operation": "apply"}}))
+
+	assert tracker.change_counts == {"add": 1, "change": 0, "remove": 1}
+	assert tracker.diagnostics == ["warning: Argument is deprecated"]
+
+
+def test_compact_summary_expects_the_counted_changes():
+	summary = PlanSummary(changes=[
+		ResourceChange(address="a.one", type="a", action="create"),
+		ResourceChange(address="a.two", type="a", action="no-op"),
+		ResourceChange(address="a.three", type="a", action="replace"),
+	], counts={"create": 1, "no-op": 1, "replace": 1}).compact()
+	assert not summary.changes
+	tracker = ProgressTracker(plan_summary=summary)
+
+	# Without the addresses, both halves of the replacement count
+	tracker.feed_line(_event("apply_complete", "a.one", "create"))
+	assert (tracker.progress().completed, tracker.progress().planned) == (1, 3)
+
+	tracker.feed_line(_event("apply_complete", "a.three", "delete"))
+	tracker.feed_line(_event("apply_complete", "a.three", "create"))
+	assert tracker.progress().percent == 100
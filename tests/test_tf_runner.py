@@ -0,0 +1,279 @@
+import os
+import stat
+import asyncio
+import pytest
+from shared.base import TerraformRunDetails, TerraformPlanError
+from shared.tf_runner import TerraformRunner
+from shared.tf_scheduler import TerraformScheduler
+from shared.plan_summary import PlanSummary
+
+# Stands in for terraform during a long apply, with a provider plugin child
+# process, and either stops both on an interrupt or ignores it.
+FAKE_TERRAFORM = """#!/usr/bin/env python3
+import os, signal, subprocess, sys, time
+provider = subprocess.Popen([sys.executable, "-c",
+	"import signal, time; signal.signal(signal.SIGINT, signal.SIG_IGN); time.sleep(60)"])
+
+def interrupted(signum, frame):
+	if os.environ["FAKE_TF_ON_INTERRUPT"] == "ignore":
+		return
+	open(os.environ["FAKE_TF_INTERRUPTED"], "w").write("interrupted")
+	provider.kill()
+	sys.exit(1)
+
+signal.signal(signal.SIGINT, interrupted)
+with open(os.environ["FAKE_TF_PIDS"], "w") as fh:
+	fh.write(f"{os.getpid()} {provider.pid}")
+print("Still creating...", flush=True)
+while True:
+	time.sleep(0.05)
+"""
+
+
+def _is_running(pid: int) -> bool:
+	try:
+		with open(f"/proc/{pid}/stat", "r") as fh:
+			# Killed processes nobody reaped linger as zombies
+			return fh.read().rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+	except FileNotFoundError:
+		return False
+
+
+async def _wait_until_stopped(pids: list[int], timeout: float = 5.0) -> bool:
+	loop = asyncio.get_running_loop()
+	deadline = loop.time() + timeout
+	while any(_is_running(pid) for pid in pids):
+		if loop.time() > deadline:
+			return False
+		await asyncio.sleep(0.05)
+	return True
+
+
+def _run_details(tmp_path, on_interrupt: str) -> TerraformRunDetails:
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+	terraform_path = bin_dir / "terraform"
+	terraform_path.write_text(FAKE_TERRAFORM)
+	terraform_path.chmod(terraform_path.stat().st_mode | stat.S_IEXEC)
+
+	return TerraformRunDetails(
+		id="cancel-test",
+		directory=str(tmp_path),
+		env_vars={
+			"PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+			"FAKE_TF_ON_INTERRUPT": on_interrupt,
+			"FAKE_TF_PIDS": str(tmp_path / "pids"),
+			"FAKE_TF_INTERRUPTED": str(tmp_path / "interrupted"),
+		},
+	)
+
+
+async def _cancel_once_started(tmp_path, command) -> list[int]:
+	task = asyncio.create_task(command)
+
+	while not (tmp_path / "pids").exists() or not (tmp_path / "pids").read_text():
+		await asyncio.sleep(0.05)
+
+	task.cancel()
+	with pytest.raises(asyncio.CancelledError):
+		await task
+
+	return [int(pid) for pid in (tmp_path / "pids").read_text().split()]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc to inspect processes")
+@pytest.mark.asyncio
+async def test_cancelled_apply_interrupts_terraform_and_frees_its_slot(tmp_path):
+	scheduler = TerraformScheduler(max_concurrency=1)
+	runner = TerraformRunner(plugin_cache_dir="", scheduler=scheduler, cancel_grace_secs=5)
+	data = _run_details(tmp_path, on_interrupt="exit")
+
+	pids = await _cancel_once_started(tmp_path, runner.apply(data))
+
+	assert (tmp_path / "interrupted").exists()
+	assert await _wait_until_stopped(pids)
+	assert scheduler.active == 0
+
+	# The slot is free for the next command right away
+	async def next_command():
+		async with scheduler.slot(data.directory, "plan"):
+			pass
+
+	await asyncio.wait_for(next_command(), timeout=1)
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc to inspect processes")
+@pytest.mark.asyncio
+async def test_cancelled_destroy_kills_terraform_that_ignores_the_interrupt(tmp_path):
+	scheduler = TerraformScheduler(max_concurrency=1)
+	runner = TerraformRunner(plugin_cache_dir="", scheduler=scheduler, cancel_grace_secs=0.5)
+	data = _run_details(tmp_path, on_interrupt="ignore")
+
+	loop = asyncio.get_running_loop()
+	started = loop.time()
+	pids = await _cancel_once_started(tmp_path, runner.destroy(data))
+
+	assert not (tmp_path / "interrupted").exists()
+	assert loop.time() - started < 5
+	assert await _wait_until_stopped(pids)
+	assert scheduler.active == 0
+
+
+# Stands in for terraform during a drift check, planning with the exit code
+# it is told to and rendering a plan with a single update.
+FAKE_TERRAFORM_DRIFT = """#!/usr/bin/env python3
+import json, os, sys
+args = sys.argv[1:]
+if args[0] == "plan":
+	open(args[args.index("-out") + 1], "w").write("binary plan")
+	open(os.environ["FAKE_TF_CALLS"], "a").write("plan\\n")
+	sys.exit(int(os.environ["FAKE_TF_PLAN_EXIT"]))
+open(os.environ["FAKE_TF_CALLS"], "a").write(" ".join(args[:2]) + "\\n")
+if "-json" in args:
+	print(json.dumps({"resource_changes": [{
+		"address": "kubernetes_namespace.kuard", "type": "kubernetes_namespace",
+		"change": {"actions": ["update"], "after": {"name": "kuard"}},
+	}]}))
+else:
+	print("~ kubernetes_namespace.kuard will be updated in-place")
+"""
+
+
+def _drift_run_details(tmp_path, plan_exit: int) -> TerraformRunDetails:
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+	terraform_path = bin_dir / "terraform"
+	terraform_path.write_text(FAKE_TERRAFORM_DRIFT)
+	terraform_path.chmod(terraform_path.stat().st_mode | stat.S_IEXEC)
+
+	return TerraformRunDetails(
+		id=f"drift-test-{plan_exit}",
+		directory=str(tmp_path),
+		env_vars={
+			"PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+			"FAKE_TF_PLAN_EXIT": str(plan_exit),
+			"FAKE_TF_CALLS": str(tmp_path / "calls"),
+		},
+	)
+
+
+@pytest.mark.asyncio
+async def test_drift_check_without_changes_skips_rendering_the_plan(tmp_path):
+	runner = TerraformRunner(plugin_cache_dir="", scheduler=TerraformScheduler(max_concurrency=1))
+	data = _drift_run_details(tmp_path, plan_exit=0)
+
+	drifted, plan, summary = await runner.drift_check(data, "1")
+
+	assert (drifted, plan, summary) == (False, "", None)
+	assert (tmp_path / "calls").read_text().split("\n")[:-1] == ["plan"]
+	assert not os.listdir(runner._plan_dir(data))
+
+
+@pytest.mark.asyncio
+async def test_drift_check_with_changes_returns_the_plan(tmp_path):
+	runner = TerraformRunner(plugin_cache_dir="", scheduler=TerraformScheduler(max_concurrency=1))
+	data = _drift_run_details(tmp_path, plan_exit=2)
+
+	drifted, plan, summary = await runner.drift_check(data, "1")
+
+	assert drifted
+	assert "will be updated in-place" in plan
+	assert summary.counts == {"update": 1}
+	assert summary.digest
+	# The plan is never kept around for an apply
+	assert not os.listdir(runner._plan_dir(data))
+
+
+@pytest.mark.asyncio
+async def test_drift_check_fails_on_plan_errors(tmp_path):
+	runner = TerraformRunner(plugin_cache_dir="", scheduler=TerraformScheduler(max_concurrency=1))
+	data = _drift_run_details(tmp_path, plan_exit=1)
+
+	with pytest.raises(TerraformPlanError):
+		await runner.drift_check(data, "1")
+
+
+# Stands in for terraform init on a configuration without providers, which
+# doesn't create a .terraform directory.
+FAKE_TERRAFORM_INIT = """#!/usr/bin/env python3
+import os, sys
+open(os.environ["FAKE_TF_CALLS"], "a").write(" ".join(sys.argv[1:2]) + "\\n")
+"""
+
+
+@pytest.mark.asyncio
+async def test_init_is_cached_until_a_local_module_changes(tmp_path):
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+	terraform_path = bin_dir / "terraform"
+	terraform_path.write_text(FAKE_TERRAFORM_INIT)
+	terraform_path.chmod(terraform_path.stat().st_mode | stat.S_IEXEC)
+
+	stack_dir = tmp_path / "stack"
+	(stack_dir / "mod").mkdir(parents=True)
+	(stack_dir / "main.tf").write_text('module "app" {\n  source = "./mod"\n}\n')
+	(stack_dir / "mod" / "main.tf").write_text('output "name" {\n  value = "kuard"\n}\n')
+
+	runner = TerraformRunner(plugin_cache_dir="", scheduler=TerraformScheduler(max_concurrency=1))
+	data = TerraformRunDetails(
+		directory=str(stack_dir),
+		env_vars={
+			"PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+			"FAKE_TF_CALLS": str(tmp_path / "calls"),
+		},
+	)
+
+	await runner.init(data)
+	await runner.init(data)
+	assert (tmp_path / "calls").read_text().split() == ["init"]
+
+	(stack_dir / "mod" / "main.tf").write_text('output "name" {\n  value = "kuard-v2"\n}\n')
+	await runner.init(data)
+	assert (tmp_path / "calls").read_text().split() == ["init", "init"]
+
+
+# Stands in for terraform apply, reporting a stale saved plan the way '-json'
+# does, as a diagnostic event on stdout, and applying without a plan file.
+FAKE_TERRAFORM_STALE = """#!/usr/bin/env python3
+import json, os, sys
+args = sys.argv[1:]
+open(os.environ["FAKE_TF_CALLS"], "a").write(" ".join(args) + "\\n")
+if "-auto-approve" in args:
+	print(json.dumps({"type": "change_summary", "changes": {"add": 1, "change": 0, "remove": 0, "operation": "apply"}}))
+	sys.exit(0)
+print(json.dumps({"type": "diagnostic", "diagnostic": {"severity": "error", "summary": "Saved plan is stale"}}))
+sys.exit(1)
+"""
+
+
+@pytest.mark.asyncio
+async def test_stale_saved_plan_is_planned_again_during_apply(tmp_path):
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+	terraform_path = bin_dir / "terraform"
+	terraform_path.write_text(FAKE_TERRAFORM_STALE)
+	terraform_path.chmod(terraform_path.stat().st_mode | stat.S_IEXEC)
+
+	runner = TerraformRunner(plugin_cache_dir="", scheduler=TerraformScheduler(max_concurrency=1))
+	data = TerraformRunDetails(
+		id="stale-plan-test",
+		directory=str(tmp_path),
+		plan_summary=PlanSummary(digest="approved"),
+		env_vars={
+			"PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+			"FAKE_TF_CALLS": str(tmp_path / "calls"),
+		},
+	)
+
+	os.makedirs(runner._plan_dir(data), exist_ok=True)
+	plan_file = os.path.join(runner._plan_dir(data), "1.binary")
+	open(plan_file, "w").write("binary plan")
+	runner._record_saved_plan(data, plan_file, "approved")
+
+	events = []
+	await runner.apply(data, on_event=events.append)
+
+	calls = (tmp_path / "calls").read_text().splitlines()
+	assert len(calls) == 2
+	assert calls[0].endswith(plan_file) and "-auto-approve" in calls[1]
+	assert any("Saved plan is stale" in event for event in events)
@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+from shared.tf_scheduler import AdaptiveParallelism, TerraformScheduler
+
+
+@pytest.mark.asyncio
+async def test_short_commands_jump_ahead_of_long_ones():
+	scheduler = TerraformScheduler(max_concurrency=1)
+	order = []
+	release = asyncio.Event()
+
+	async def run(directory: str, subcommand: str, wait_for: asyncio.Event = None):
+		async with scheduler.slot(directory, subcommand):
+			order.append(subcommand)
+			if wait_for is not None:
+				await wait_for.wait()
+
+	holder = asyncio.create_task(run("a", "apply", release))
+	await asyncio.sleep(0)
+
+	queued = [
+		asyncio.create_task(run("b", "destroy")),
+		asyncio.create_task(run("c", "plan")),
+		asyncio.create_task(run("d", "output")),
+	]
+	await asyncio.sleep(0)
+	assert scheduler.queued == 3
+
+	release.set()
+	await asyncio.gather(holder, *queued)
+
+	assert order == ["apply", "output", "plan", "destroy"]
+	assert scheduler.stats().completed == 4
+	assert scheduler.active == 0
+
+
+@pytest.mark.asyncio
+async def test_commands_on_the_same_directory_are_serialized():
+	scheduler = TerraformScheduler(max_concurrency=4)
+	running = 0
+	peak = 0
+
+	async def run(directory: str):
+		nonlocal running, peak
+		async with scheduler.slot(directory, "plan"):
+			running += 1
+			peak = max(peak, running)
+			await asyncio.sleep(0.01)
+			running -= 1
+
+	await asyncio.gather(*[run("same") for _ in range(3)])
+	assert peak == 1
+
+	await asyncio.gather(*[run(f"dir-{i}") for i in range(3)])
+	assert peak == 3
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place():
+	scheduler = TerraformScheduler(max_concurrency=1)
+	release = asyncio.Event()
+
+	async def hold(directory: str):
+		async with scheduler.slot(directory, "apply"):
+			await release.wait()
+
+	holder = asyncio.create_task(hold("a"))
+	await asyncio.sleep(0)
+
+	waiter = asyncio.create_task(hold("b"))
+	await asyncio.sleep(0)
+	assert scheduler.queued == 1
+	waiter.cancel()
+
+	release.set()
+	await holder
+
+	with pytest.raises(asyncio.CancelledError):
+		await waiter
+
+	assert scheduler.active == 0
+	assert scheduler.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_adaptive_parallelism_shares_budget_and_backs_off_when_throttled():
+	scheduler = TerraformScheduler(max_concurrency=4)
+	adaptive = AdaptiveParallelism(scheduler, budget=40)
+
+	assert adaptive.parallelism_for("a") == 40
+
+	async with scheduler.slot("a", "apply"), scheduler.slot("b", "apply"):
+		assert adaptive.parallelism_for("a") == 20
+
+	assert adaptive.observe("a", "Error: creating bucket: StatusCode: 429, Throttling: Rate exceeded")
+	assert adaptive.parallelism_for("a") == 20
+	assert adaptive.parallelism_for("b") == 40
+
+	assert not adaptive.observe("a", "")
+	assert adaptive.parallelism_for("a") == 40
@@ -0,0 +1,47 @@
+import os
+import json
+from shared.tf_state import LocalStateReader
+
+STATE = {
+	"version": 4,
+	"terraform_version": "1.9.0",
+	"serial": 7,
+	"lineage": "abc",
+	"outputs": {
+		"instructions": {"value": "minikube service kuard", "type": "string"},
+		"token": {"value": "secret", "type": "string", "sensitive": True},
+	},
+	"resources": [
+		{"mode": "managed", "type": "kubernetes_namespace", "instances": [{}]},
+		{"mode": "managed", "type": "kubernetes_deployment", "instances": [{}, {}]},
+		{"mode": "data", "type": "kubernetes_service", "instances": [{}]},
+	],
+}
+
+
+def test_reads_outputs_and_resources_from_local_state(tmp_path):
+	with open(os.path.join(tmp_path, "terraform.tfstate"), "w") as fh:
+		json.dump(STATE, fh)
+
+	reader = LocalStateReader()
+	snapshot = reader.read(reader.state_path(str(tmp_path), {}))
+
+	assert snapshot.serial == 7
+	assert snapshot.resource_count == 3
+	assert snapshot.resource_counts_by_type == {"kubernetes_namespace": 1, "kubernetes_deployment": 2}
+	assert snapshot.outputs["instructions"] == {"sensitive": False, "type": "string", "value": "minikube service kuard"}
+	assert snapshot.outputs["token"]["sensitive"]
+	assert reader.read(reader.state_path(str(tmp_path), {})) is snapshot
+
+
+def test_remote_backends_and_missing_state(tmp_path):
+	reader = LocalStateReader()
+
+	assert reader.read(reader.state_path(str(tmp_path), {})).outputs == {}
+	assert reader.state_path(str(tmp_path), {"TF_WORKSPACE": "staging"}) is None
+
+	os.makedirs(os.path.join(tmp_path, ".terraform"))
+	with open(os.path.join(tmp_path, ".terraform", "terraform.tfstate"), "w") as fh:
+		json.dump({"backend": {"type": "s3", "config": {}}}, fh)
+
+	assert reader.state_path(str(tmp_path), {}) is None
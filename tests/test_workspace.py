@@ -0,0 +1,95 @@
+import os
+import json
+import pytest
+from shared.base import TerraformRunDetails
+from shared.workspace import WorkspaceManager, STATE_FILENAME
+
+
+def _template(tmp_path) -> str:
+	template = tmp_path / "template"
+	(template / ".terraform" / "modules").mkdir(parents=True)
+	(template / "main.tf").write_text('resource "null_resource" "demo" {}')
+	(template / ".terraform.lock.hcl").write_text("# lock")
+	(template / ".terraform" / "modules" / "modules.json").write_text("{}")
+	# The state of the shared, non isolated runs
+	(template / STATE_FILENAME).write_text(json.dumps({"serial": 9, "resources": [{}]}))
+	return str(template)
+
+
+def _run(template: str, run_id: str = "stack-demo") -> TerraformRunDetails:
+	return TerraformRunDetails(directory=template, id=run_id, isolated_workspace=True)
+
+
+def _write_state(workspace: str, serial: int, resources: int = 1) -> None:
+	with open(os.path.join(workspace, STATE_FILENAME), "w") as fh:
+		json.dump({"serial": serial, "resources": [{}] * resources}, fh)
+
+
+def _serial(workspace: str) -> int:
+	with open(os.path.join(workspace, STATE_FILENAME), "r") as fh:
+		return json.load(fh)["serial"]
+
+
+def test_workspace_is_linked_from_the_template_and_reused(tmp_path):
+	template = _template(tmp_path)
+	manager = WorkspaceManager(root=str(tmp_path / "workspaces"))
+
+	workspace = manager.ensure(_run(template))
+	assert os.path.samefile(os.path.join(workspace, "main.tf"), os.path.join(template, "main.tf"))
+	assert os.path.exists(os.path.join(workspace, ".terraform", "modules", "modules.json"))
+	# Rewritten in place by Terraform, so never linked
+	assert not os.path.samefile(
+		os.path.join(workspace, ".terraform.lock.hcl"), os.path.join(template, ".terraform.lock.hcl")
+	)
+	assert not os.path.exists(os.path.join(workspace, STATE_FILENAME))
+
+	# Later activities of the same run get the same workspace, as they left it
+	_write_state(workspace, serial=1)
+	assert manager.ensure(_run(template)) == workspace
+	assert _serial(workspace) == 1
+	assert manager.ensure(_run(template, "stack-other")) != workspace
+
+
+def test_workspace_without_a_run_id_is_rejected(tmp_path):
+	manager = WorkspaceManager(root=str(tmp_path / "workspaces"))
+
+	with pytest.raises(ValueError):
+		manager.ensure(_run(_template(tmp_path), run_id=""))
+
+
+def test_state_is_kept_after_cleanup_only_while_it_tracks_resources(tmp_path):
+	template = _template(tmp_path)
+	manager = WorkspaceManager(root=str(tmp_path / "workspaces"))
+
+	workspace = manager.ensure(_run(template))
+	_write_state(workspace, serial=3)
+	manager.release(_run(template))
+	assert not os.path.exists(workspace)
+
+	# The next workflow of the same stack, e.g. the deprovisioning, starts from it
+	workspace = manager.ensure(_run(template))
+	assert _serial(workspace) == 3
+
+	_write_state(workspace, serial=4, resources=0)
+	manager.release(_run(template))
+	assert not os.path.exists(os.path.join(manager.ensure(_run(template)), STATE_FILENAME))
+
+
+def test_state_follows_the_run_to_another_host(tmp_path):
+	template = _template(tmp_path)
+	state_dir = str(tmp_path / "shared-state")
+	first_host = WorkspaceManager(root=str(tmp_path / "first"), state_dir=state_dir)
+	second_host = WorkspaceManager(root=str(tmp_path / "second"), state_dir=state_dir)
+
+	_write_state(first_host.ensure(_run(template)), serial=1)
+	first_host.save_state(_run(template))
+
+	# The first host is gone, the run carries on from the second one
+	workspace = second_host.ensure(_run(template))
+	assert _serial(workspace) == 1
+	_write_state(workspace, serial=2)
+	second_host.save_state(_run(template))
+
+	# A stale workspace never overwrites the newer saved state, it is brought up to date
+	first_host.save_state(_run(template))
+	assert _serial(first_host.ensure(_run(template))) == 2
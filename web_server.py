@@ -1,24 +1,48 @@
 import uuid
 import os
 import re
+import json
+import asyncio
 from dataclasses import dataclass, field
-from typing import Dict
-from flask import Flask, render_template, request, jsonify
-from shared.base import get_temporal_client, TerraformRunDetails, ApplyDecisionDetails, \
-	TEMPORAL_ADDRESS, TEMPORAL_NAMESPACE, TEMPORAL_TASK_QUEUE, ENCRYPT_PAYLOADS
+from typing import Callable, Dict, Optional
+from aiohttp import web
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from shared.base import get_temporal_client, TerraformRunDetails, ApplyDecisionDetails, WorkflowSnapshot, \
+	TEMPORAL_ADDRESS, TEMPORAL_NAMESPACE, TEMPORAL_TASK_QUEUE, ENCRYPT_PAYLOADS, RUN_REGISTRY_MAX_RUNS, \
+	RUN_REGISTRY_DB
 
 from workflows.apply import ProvisionInfraWorkflow
 from workflows.destroy import DeprovisionInfraWorkflow
+from shared.progress_hub import ProgressHub
+from shared.run_registry import RunRegistry
 
-from temporalio.exceptions import ApplicationError
+from temporalio.client import WorkflowExecutionStatus
+from temporalio.exceptions import ApplicationError, WorkflowAlreadyStartedError
 from temporalio.common import TypedSearchAttributes, SearchAttributeKey, \
-	SearchAttributePair
+	SearchAttributePair, WorkflowIDConflictPolicy, WorkflowIDReusePolicy
 
 # Get the TF_VAR_prefix environment variable, defaulting to "temporal-sa" if not set
 # NOTE: This is a specific env var for mat for Terraform.
 TF_VAR_prefix = os.environ.get("TF_VAR_prefix", "temporal-sa")
 
-app = Flask(__name__)
+# Port the web server listens on
+WEB_SERVER_PORT = int(os.environ.get("WEB_SERVER_PORT", 3000))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+routes = web.RouteTableDef()
+templates = Environment(
+	loader=FileSystemLoader(os.path.join(BASE_DIR, "templates")),
+	autoescape=select_autoescape(["html"]),
+)
+
+def _url_for(endpoint: str, filename: str = "") -> str:
+	# The templates only link to static files by endpoint
+	if endpoint != "static":
+		raise ValueError(f"Unknown endpoint: {endpoint}")
+	return f"/static/{filename}"
+
+templates.globals["url_for"] = _url_for
 
 # Define search attribute keys for workflow search
 provision_status_key = SearchAttributeKey.for_text("provisionStatus")
@@ -26,7 +50,10 @@ tf_directory_key = SearchAttributeKey.for_text("tfDirectory")
 scenario_key = SearchAttributeKey.for_text("scenario")
 temporal_ui_url = TEMPORAL_ADDRESS.replace("7233", "8233") if "localhost" in TEMPORAL_ADDRESS \
 	else "https://cloud.temporal.io"
-tf_runs = []
+tf_runs = RunRegistry(max_runs=RUN_REGISTRY_MAX_RUNS, db_path=RUN_REGISTRY_DB)
+
+# Seconds without progress after which a stream sends a comment, to keep proxies from closing it
+PROGRESS_STREAM_KEEPALIVE_SECS = 15
 
 DIRECTORY = "./terraform/minikube_kuard"
 
@@ -71,9 +98,22 @@ SCENARIOS = {
 }
 
 def _safe_insert_tf_run(tf_run: dict):
-	global tf_runs
-	# Always insert the run as the first item in the list
-	tf_runs.insert(0, tf_run) if tf_run["id"] not in [run["id"] for run in tf_runs] else None
+	# Registered as the most recent run, unless it already is registered
+	tf_runs.add(tf_run)
+
+def _get_runs_page(request: web.Request):
+	try:
+		number = int(request.query.get("page", 1))
+	except ValueError:
+		number = 1
+	return tf_runs.page(number)
+
+def _page_url(request: web.Request) -> Callable[[int], str]:
+	# Links to another page of the runs, keeping the rest of the query
+	return lambda number: str(request.rel_url.update_query(page=number))
+
+def _render_template(template: str, **context) -> web.Response:
+	return web.Response(text=templates.get_template(template).render(**context), content_type="text/html")
 
 def _scrub_sensitive_data(tf_workflow_output: dict):
 	for key, value in tf_workflow_output.items():
@@ -81,25 +121,30 @@ def _scrub_sensitive_data(tf_workflow_output: dict):
 			tf_workflow_output[key]["value"] = "<sensitive>"
 	return tf_workflow_output
 
-# Global variable to store the Temporal client
+# A single Temporal client, and its connection, is shared by every request,
+# all of which run on the same event loop.
 temporal_client = None
+temporal_client_lock = asyncio.Lock()
 
 async def _get_singleton_temporal_client():
 	global temporal_client
-	if temporal_client is None:
-		temporal_client = await get_temporal_client()
+	async with temporal_client_lock:
+		if temporal_client is None:
+			temporal_client = await get_temporal_client()
 	return temporal_client
 
 # Define the main route
-@app.route("/", methods=["GET", "POST"])
-async def main():
+@routes.get("/")
+@routes.post("/")
+async def main(request: web.Request):
 	# Generate a unique workflow ID
 	wf_id = f"provision-infra-{uuid.uuid4()}"
 
-	return render_template(
+	return _render_template(
 		"index.html",
 		wf_id=wf_id,
-		tf_runs=tf_runs,
+		tf_runs=_get_runs_page(request),
+		page_url=_page_url(request),
 		scenarios=SCENARIOS,
 		temporal_host_url=TEMPORAL_ADDRESS,
 		temporal_ui_url=temporal_ui_url,
@@ -108,13 +153,14 @@ async def main():
 	)
 
 # Define the run_workflow route
-@app.route("/run_workflow", methods=["GET", "POST"])
-async def run_workflow():
+@routes.get("/run_workflow")
+@routes.post("/run_workflow")
+async def run_workflow(request: web.Request):
 	# Get the selected scenario and workflow ID from the request arguments
-	selected_scenario = request.args.get("scenario", "")
-	wf_id = request.args.get("wf_id", "")
-	ephemeral_ttl = int(request.args.get("ephemeral_ttl", 15))
-	deployment_prefix = request.args.get("deployment_prefix", "temporal-sa")
+	selected_scenario = request.query.get("scenario", "")
+	wf_id = request.query.get("wf_id", "")
+	ephemeral_ttl = int(request.query.get("ephemeral_ttl", 15))
+	deployment_prefix = request.query.get("deployment_prefix", "temporal-sa")
 
 	# Set Temporal Cloud environment variables based on the selected scenario
 	tcloud_env_vars = {
@@ -142,46 +188,31 @@ async def run_workflow():
 
 	# Get the Temporal client
 	client = await _get_singleton_temporal_client()
-	no_existing_workflow = False
+	tf_workflow = DeprovisionInfraWorkflow.run if selected_scenario == "destroy" else ProvisionInfraWorkflow.run
 
 	try:
-		# Check if the workflow already exists
-		tf_workflow = client.get_workflow_handle(wf_id)
-		await tf_workflow.describe()
-	except Exception as e:
-		no_existing_workflow = True
-
-	if no_existing_workflow:
-		if selected_scenario != "destroy":
-			# Start the workflow if it doesn't exist
-			await client.start_workflow(
-				ProvisionInfraWorkflow.run,
-				tf_run_details,
-				id=wf_id,
-				task_queue=TEMPORAL_TASK_QUEUE,
-				search_attributes=TypedSearchAttributes([
-					SearchAttributePair(provision_status_key, ""),
-					SearchAttributePair(tf_directory_key, DIRECTORY),
-					SearchAttributePair(scenario_key, selected_scenario)
-				]),
-			)
-		else:
-			await client.start_workflow(
-				DeprovisionInfraWorkflow.run,
-				tf_run_details,
-				id=wf_id,
-				task_queue=TEMPORAL_TASK_QUEUE,
-				search_attributes=TypedSearchAttributes([
-					SearchAttributePair(provision_status_key, ""),
-					SearchAttributePair(tf_directory_key, DIRECTORY),
-					SearchAttributePair(scenario_key, selected_scenario)
-				]),
-			)
+		# Reloading the page of a run attaches to its workflow instead of
+		# starting another one, without asking the cluster about it first.
+		await client.start_workflow(
+			tf_workflow,
+			tf_run_details,
+			id=wf_id,
+			task_queue=TEMPORAL_TASK_QUEUE,
+			id_conflict_policy=WorkflowIDConflictPolicy.USE_EXISTING,
+			id_reuse_policy=WorkflowIDReusePolicy.REJECT_DUPLICATE,
+			search_attributes=TypedSearchAttributes([
+				SearchAttributePair(provision_status_key, ""),
+				SearchAttributePair(tf_directory_key, DIRECTORY),
+				SearchAttributePair(scenario_key, selected_scenario)
+			]),
+		)
+	except WorkflowAlreadyStartedError:
+		# The run is already over, its page shows how it ended
+		pass
 
-	return render_template(
+	return _render_template(
 		"provisioning.html",
 		wf_id=wf_id,
-		tf_runs=tf_runs,
 		selected_scenario=selected_scenario,
 		temporal_host_url=TEMPORAL_ADDRESS,
 		temporal_ui_url=temporal_ui_url,
@@ -189,39 +220,118 @@ async def run_workflow():
 		payloads_encrypted=ENCRYPT_PAYLOADS
 	)
 
+async def _get_resource_progress(client, workflow_desc) -> Optional[dict]:
+	"""Get the per resource progress of a running apply or destroy from the
+	heartbeat details of the pending activity, if there is one."""
+
+	for pending_activity in workflow_desc.raw_description.pending_activities:
+		if not pending_activity.heartbeat_details.payloads:
+			continue
+
+		details = await client.data_converter.decode(pending_activity.heartbeat_details.payloads)
+
+		# Heartbeats that carry progress are dicts, older ones plain strings
+		if details and isinstance(details[0], dict) and "percent" in details[0]:
+			return {"activity": pending_activity.activity_type.name, **details[0]}
+
+	return None
+
+async def _get_progress_payload(client, wf_id: str, known_plan_digest: str) -> dict:
+	"""Everything the provisioning page shows about a workflow, the plan only
+	if its digest differs from the one given, and whether the workflow is over."""
+
+	tf_workflow = client.get_workflow_handle(wf_id)
+
+	# Describing is served by the cluster, check for a failed workflow
+	# before asking a worker to answer a query for it.
+	workflow_desc = await tf_workflow.describe()
+
+	if workflow_desc.status == WorkflowExecutionStatus.FAILED:
+		return {"error": f"Workflow failed: {wf_id}", "closed": True}
+
+	# A single query for everything the page shows
+	snapshot = await tf_workflow.query("get_snapshot", known_plan_digest, result_type=WorkflowSnapshot)
+
+	return {
+		"status": snapshot.status,
+		"progress_percent": snapshot.progress,
+		"reason": snapshot.reason,
+		"plan_digest": snapshot.plan_digest,
+		"plan": snapshot.plan,
+		"resource_progress": await _get_resource_progress(client, workflow_desc),
+		"closed": workflow_desc.status != WorkflowExecutionStatus.RUNNING,
+	}
+
 # Define the get_progress route
-@app.route('/get_progress')
-async def get_progress():
-	wf_id = request.args.get('wf_id', "")
+@routes.get('/get_progress')
+async def get_progress(request: web.Request):
+	wf_id = request.query.get('wf_id', "")
 	payload = {
 		"progress": 0,
 		"status": "uninitialized",
-		"plan": None
+		"plan": None,
+		"resource_progress": None
 	}
 
+	# The digest of the plan the page already shows, so it isn't sent again
+	known_plan_digest = request.query.get('plan_digest', "")
+
 	try:
-		client = await _get_singleton_temporal_client()
-		tf_workflow = client.get_workflow_handle(wf_id)
-		payload["status"] = await tf_workflow.query("get_current_status")
-		payload["progress_percent"] = await tf_workflow.query("get_progress")
-		payload["plan"] = await tf_workflow.query("get_plan")
-		workflow_desc = await tf_workflow.describe()
-
-		if workflow_desc.status == 3:
-			error_message = "Workflow failed: {wf_id}"
-			print(f"Error in get_progress route: {error_message}")
-			return jsonify({"error": error_message}), 500
-
-		return jsonify(payload)
+		# Pages polling the same workflow at once share a single query
+		payload = await progress_hub.fetch(wf_id, known_plan_digest)
+		payload.pop("closed")
+
+		if "error" in payload:
+			print(f"Error in get_progress route: {payload['error']}")
+			return web.json_response(payload, status=500)
+
+		return web.json_response(payload)
 	except Exception as e:
 		print(e)
-		return jsonify(payload)
+		return web.json_response(payload)
+
+# The progress streams share one watcher per workflow, and the polls one query
+# per workflow at a time, on the server's event loop
+async def _fetch_progress(wf_id: str, known_plan_digest: str) -> dict:
+	client = await _get_singleton_temporal_client()
+	return await _get_progress_payload(client, wf_id, known_plan_digest)
+
+progress_hub = ProgressHub(_fetch_progress)
+
+# Define the progress_stream route, pushing the progress as server-sent events
+@routes.get('/progress_stream')
+async def progress_stream(request: web.Request):
+	wf_id = request.query.get('wf_id', "")
+
+	response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+	await response.prepare(request)
+
+	queue = progress_hub.subscribe(wf_id)
+	try:
+		while True:
+			try:
+				event = await asyncio.wait_for(queue.get(), timeout=PROGRESS_STREAM_KEEPALIVE_SECS)
+			except asyncio.TimeoutError:
+				# Also how a closed page is noticed, the write fails
+				await response.write(b": keepalive\n\n")
+				continue
+
+			# The workflow is over
+			if event is None:
+				await response.write(b"event: closed\ndata: {}\n\n")
+				break
+
+			await response.write(f"data: {json.dumps(event)}\n\n".encode())
+	finally:
+		progress_hub.unsubscribe(wf_id, queue)
+
+	return response
 
 # Define the provisioned route
-@app.route('/provisioned')
-async def provisioned():
-	wf_id = request.args.get("wf_id", "")
-	scenario = request.args.get("scenario", "")
+@routes.get('/provisioned')
+async def provisioned(request: web.Request):
+	wf_id = request.query.get("wf_id", "")
+	scenario = request.query.get("scenario", "")
 
 	client = await _get_singleton_temporal_client()
 	tf_workflow = client.get_workflow_handle(wf_id)
@@ -236,10 +346,11 @@ async def provisioned():
 
 	tf_workflow_output = _scrub_sensitive_data(tf_workflow_output)
 
-	return render_template(
+	return _render_template(
 		"provisioned.html",
 		wf_id=wf_id,
-		tf_runs=tf_runs,
+		tf_runs=_get_runs_page(request),
+		page_url=_page_url(request),
 		tf_workflow_output=tf_workflow_output,
 		tf_run_status=status,
 		temporal_host_url=TEMPORAL_ADDRESS,
@@ -249,11 +360,12 @@ async def provisioned():
 	)
 
 # Define the signal route
-@app.route('/signal', methods=["POST"])
-async def signal():
-	wf_id = request.args.get("wf_id", "")
-	signal_type = request.json.get("signalType", "")
-	payload = request.json.get("payload", False)
+@routes.post('/signal')
+async def signal(request: web.Request):
+	wf_id = request.query.get("wf_id", "")
+	body = await request.json()
+	signal_type = body.get("signalType", "")
+	payload = body.get("payload", False)
 
 	try:
 		client = await _get_singleton_temporal_client()
@@ -271,16 +383,17 @@ async def signal():
 
 	except Exception as e:
 		print(f"Error sending signal: {str(e)}")
-		return jsonify({"error": str(e)}), 500
+		return web.json_response({"error": str(e)}, status=500)
 
-	return "Signal received successfully", 200
+	return web.Response(text="Signal received successfully", status=200)
 
 # Define the update route
-@app.route('/update', methods=["POST"])
-async def update():
-	wf_id = request.args.get("wf_id", "")
-	decision = request.json.get("decision", False)
-	reason = request.json.get("reason", "")
+@routes.post('/update')
+async def update(request: web.Request):
+	wf_id = request.query.get("wf_id", "")
+	body = await request.json()
+	decision = body.get("decision", False)
+	reason = body.get("reason", "")
 
 	try:
 		client = await _get_singleton_temporal_client()
@@ -292,12 +405,18 @@ async def update():
 		)
 		result = await wf_handle.execute_update("update_apply_decision", apply_decision)
 
-		return jsonify({"result": result}), 200
+		return web.json_response({"result": result}, status=200)
 	except Exception as e:
 		print(f"Error sending update: {str(e)}")
-		# return jsonify({"error": ""}), 500
-		return jsonify({"result": "Error sending update. Make sure your reason is not empty."}), 422
+		# return web.json_response({"error": ""}, status=500)
+		return web.json_response({"result": "Error sending update. Make sure your reason is not empty."}, status=422)
+
+def build_web_server() -> web.Application:
+	app = web.Application()
+	app.add_routes(routes)
+	app.router.add_static("/static", os.path.join(BASE_DIR, "static"))
+	return app
 
-# Run the Flask app
+# Run the web server, on a single event loop for its whole life
 if __name__ == "__main__":
-	app.run(debug=True, port=3000)
+	web.run_app(build_web_server(), port=WEB_SERVER_PORT)
@@ -1,46 +1,121 @@
 import asyncio
 import logging
 import os
+from shared.startup_profile import StartupProfile, WORKER_PROFILE_STARTUP
+
+# Started ahead of every other import, so that it can time them. Not in the
+# processes of the parsing pool, which import this module again.
+startup_profile = StartupProfile().start() if WORKER_PROFILE_STARTUP and __name__ == "__main__" else None
+
 from temporalio.worker import Worker
 from temporalio.runtime import Runtime, TelemetryConfig, PrometheusConfig
-from shared.base import get_temporal_client
+from shared.base import get_temporal_client, TERRAFORM_PREWARM_DIRS, TEMPORAL_HOST_TASK_QUEUE
 from shared.activities import ProvisioningActivities
+from shared.loop_monitor import EventLoopMonitor
 from workflows.apply import ProvisionInfraWorkflow
 from workflows.destroy import DeprovisionInfraWorkflow
+from workflows.stacks import ProvisionStacksWorkflow, DeprovisionStacksWorkflow
+from workflows.stack_entity import StackEntityWorkflow
+from workflows.drift import DriftDetectionWorkflow, StackDriftCheckWorkflow
 
 # Get the task queue name from the environment variable, defaulting to "provision-infra"
 TEMPORAL_TASK_QUEUE = os.environ.get("TEMPORAL_TASK_QUEUE", "provision-infra")
 
-prometheus_runtime = \
-	Runtime(telemetry=TelemetryConfig(metrics=PrometheusConfig(bind_address="127.0.0.1:9000")))
-
 async def main() -> None:
 	logging.basicConfig(level=logging.INFO)
+	if startup_profile:
+		startup_profile.mark("imports done")
+
+	# Created here rather than when the module is imported, since the processes
+	# of the parsing pool import it again and only one can bind the exporter.
+	prometheus_runtime = \
+		Runtime(telemetry=TelemetryConfig(metrics=PrometheusConfig(bind_address="127.0.0.1:9000")))
 
 	# Get the Temporal client
 	client = await get_temporal_client(prometheus_runtime)
 
-	# Create an instance of the ProvisioningActivities class
-	activities = ProvisioningActivities()
+	# Create an instance of the ProvisioningActivities class, publishing the
+	# Terraform scheduler metrics alongside the SDK metrics. Init advertises
+	# this host's task queue, so that the rest of each run stays here.
+	activities = ProvisioningActivities(
+		metric_meter=prometheus_runtime.metric_meter,
+		host_task_queue=TEMPORAL_HOST_TASK_QUEUE,
+		client=client,
+	)
+
+	# Both workers identify themselves by this host's task queue, so that the
+	# host can be told apart from the other pollers of the shared task queue.
+	identity = f"{os.getpid()}@{TEMPORAL_HOST_TASK_QUEUE}"
+
+	interceptors = [startup_profile.interceptor()] if startup_profile else []
 
 	# Create a worker instance
 	worker: Worker = Worker(
 		client,
 		task_queue=TEMPORAL_TASK_QUEUE,
-		workflows=[ProvisionInfraWorkflow, DeprovisionInfraWorkflow],
+		identity=identity,
+		interceptors=interceptors,
+		workflows=[
+			ProvisionInfraWorkflow,
+			DeprovisionInfraWorkflow,
+			ProvisionStacksWorkflow,
+			DeprovisionStacksWorkflow,
+			StackEntityWorkflow,
+			DriftDetectionWorkflow,
+			StackDriftCheckWorkflow,
+		],
 		activities=[
 			activities.terraform_init,
 			activities.terraform_plan,
+			activities.terraform_drift_check,
+			activities.terraform_apply,
+			activities.terraform_destroy,
+			activities.terraform_output,
+			activities.policy_check,
+			activities.cleanup_workspace,
+			activities.host_task_queue_polled,
+		]
+	)
+
+	# Poll this host's task queue too, for the activities of the runs that
+	# were initialized here.
+	host_worker: Worker = Worker(
+		client,
+		task_queue=TEMPORAL_HOST_TASK_QUEUE,
+		identity=identity,
+		interceptors=interceptors,
+		activities=[
+			activities.terraform_plan,
+			activities.terraform_drift_check,
 			activities.terraform_apply,
 			activities.terraform_destroy,
 			activities.terraform_output,
 			activities.policy_check,
+			activities.cleanup_workspace,
 		]
 	)
 
+	# Initialize the known Terraform directories in the background, so that
+	# the first workflow against each of them doesn't pay for a cold init.
+	prewarm_task = asyncio.create_task(activities.prewarm(TERRAFORM_PREWARM_DIRS))
+
+	# Report anything that blocks the event loop long enough to delay the
+	# heartbeats of the other activities running on this worker.
+	loop_monitor = EventLoopMonitor(metric_meter=prometheus_runtime.metric_meter)
+	loop_monitor.start()
+
+	if startup_profile:
+		startup_profile.stop_imports()
+		startup_profile.mark("worker ready")
+		print(startup_profile.report())
+
 	# Run the worker
-	print("Worker running...")
-	await worker.run()
+	print(f"Worker running, with host task queue {TEMPORAL_HOST_TASK_QUEUE}...")
+	try:
+		await asyncio.gather(worker.run(), host_worker.run())
+		await prewarm_task
+	finally:
+		await loop_monitor.stop()
 
 
 if __name__ == "__main__":
@@ -7,11 +7,15 @@ from temporalio.common import RetryPolicy
 from temporalio.exceptions import ApplicationError
 # NOTE: for init, policy_check, plan and outputs, they shouldn't take longer
 # than 300 seconds.
-from shared.base import ApplyDecisionDetails, TERRAFORM_COMMON_TIMEOUT_SECS
+from shared.base import ApplyDecisionDetails, WorkflowSnapshot, TERRAFORM_COMMON_TIMEOUT_SECS, \
+	COALESCED_PROVISION_STATUSES, COALESCE_UPSERTS_PATCH
+
+from workflows.host_affinity import HostAffinity
 
 with workflow.unsafe.imports_passed_through():
 	from shared.activities import ProvisioningActivities
-	from shared.base import TerraformRunDetails
+	from shared.base import TerraformRunDetails, TerraformRunResult
+	from shared.plan_summary import PlanSummary
 
 
 @workflow.defn
@@ -24,13 +28,36 @@ class ProvisionInfraWorkflow:
 		self._current_status = "uninitialized"
 		self._progress = 0
 		self._tf_plan_output = ""
+		self._host_affinity = HostAffinity()
 
 	def _custom_upsert(self, data: TerraformRunDetails, payload: dict):
-		if data.include_custom_search_attrs:
-			workflow.upsert_search_attributes(payload)
+		if not data.include_custom_search_attrs:
+			return
+
+		# Only write the statuses worth searching for, the rest are still
+		# available through the status query. Histories from before this
+		# change have an upsert for every status.
+		if payload.get("provisionStatus", [""])[0] in COALESCED_PROVISION_STATUSES \
+				and workflow.patched(COALESCE_UPSERTS_PATCH):
+			return
+
+		workflow.upsert_search_attributes(payload)
 
 	@workflow.run
 	async def run(self, data: TerraformRunDetails) -> dict:
+		try:
+			return await self._provision(data)
+		finally:
+			# Garbage collect the isolated workspace once the run is over,
+			# whether it succeeded or not.
+			if data.isolated_workspace:
+				await self._host_affinity.execute_activity(
+					ProvisioningActivities.cleanup_workspace,
+					data,
+					start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+				)
+
+	async def _provision(self, data: TerraformRunDetails) -> dict:
 		self._custom_upsert(data, {"provisionStatus": ["uninitialized"]})
 		self._tf_run_details = data
 
@@ -44,12 +71,7 @@ class ProvisionInfraWorkflow:
 
 		self._progress = 10
 		self._current_status = "initializing"
-		await workflow.execute_local_activity_method(
-			ProvisioningActivities.terraform_init,
-			data,
-			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
-			retry_policy=tf_init_retry_policy,
-		)
+		await self._host_affinity.init(data, tf_init_retry_policy)
 		self._custom_upsert(data, {"provisionStatus": ["initialized"]})
 		self._progress = 20
 		self._current_status = "initialized"
@@ -61,17 +83,23 @@ class ProvisionInfraWorkflow:
 		self._custom_upsert(data, {"provisionStatus": ["planning"]})
 		self._progress = 30
 		self._current_status = "planning"
-		self._tf_plan_output, tf_plan_output_json = await workflow.execute_activity_method(
+		tf_plan_result = await self._host_affinity.execute_activity(
 			ProvisioningActivities.terraform_plan,
 			data,
 			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
 			retry_policy=tf_plan_retry_policy,
 		)
+		self._tf_plan_output = tf_plan_result[0]
 		self._custom_upsert(data, {"provisionStatus": ["planned"]})
 		self._progress = 40
 		self._current_status = "planned"
 
-		data.plan = tf_plan_output_json
+		# Hand the compact plan summary to the next steps rather than the full
+		# plan JSON, plans from before the summary existed only carry the JSON.
+		if isinstance(tf_plan_result[-1], dict):
+			data.plan_summary = PlanSummary.from_dict(tf_plan_result[-1])
+		else:
+			data.plan = tf_plan_result[1]
 
 		policy_retry_policy = RetryPolicy(
 			maximum_attempts=5,
@@ -90,6 +118,11 @@ class ProvisionInfraWorkflow:
 		self._progress = 60
 		self._current_status = "policy checked"
 
+		# Only the policy check needs the resource changes, the steps after it
+		# get by with the digest and the counts.
+		if data.plan_summary is not None:
+			data.plan_summary = data.plan_summary.compact()
+
 		hard_fail = data.hard_fail_policy and not policy_not_failed
 
 		if not policy_not_failed and not hard_fail:
@@ -115,11 +148,12 @@ class ProvisionInfraWorkflow:
 			self._progress = 100
 			self._current_status = "policy_hard_failed"
 			workflow.logger.info("Workflow apply hard failed policy check, no work to do.")
+			self._fail_unless_applied(data)
 		elif policy_not_failed or self._apply_approved:
 			self._custom_upsert(data, {"provisionStatus": ["applying"]})
 			self._progress = 70
 			self._current_status = "applying"
-			apply_output = await workflow.execute_activity_method(
+			apply_output = await self._host_affinity.execute_activity(
 				ProvisioningActivities.terraform_apply,
 				data,
 				start_to_close_timeout=timedelta(seconds=data.apply_timeout_secs),
@@ -129,12 +163,16 @@ class ProvisionInfraWorkflow:
 			self._custom_upsert(data, {"provisionStatus": ["applied"]})
 			self._progress = 80
 			self._current_status = "applied"
-			workflow.logger.info(f"Workflow apply output {json.dumps(apply_output)}")
+			# Applies from before the compact result returned the output itself
+			if isinstance(apply_output, TerraformRunResult):
+				workflow.logger.info(f"Workflow apply result: {apply_output.summary()}")
+			else:
+				workflow.logger.info(f"Workflow apply output {json.dumps(apply_output)}")
 
 			workflow.logger.info("Sleeping for 3 seconds to slow execution down")
 			await asyncio.sleep(3)
 
-			show_output = await workflow.execute_activity_method(
+			show_output = await self._host_affinity.execute_activity(
 				ProvisioningActivities.terraform_output,
 				data,
 				start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
@@ -144,6 +182,7 @@ class ProvisionInfraWorkflow:
 			self._custom_upsert(data, {"provisionStatus": ["rejected"]})
 			self._current_status = "rejected"
 			workflow.logger.info("Workflow apply denied, no work to do.")
+			self._fail_unless_applied(data)
 
 		if data.ephemeral:
 			self._current_status = "waiting for destroy"
@@ -152,7 +191,7 @@ class ProvisionInfraWorkflow:
 
 			self._progress = 90
 			self._current_status = "destroying"
-			await workflow.execute_activity_method(
+			await self._host_affinity.execute_activity(
 				ProvisioningActivities.terraform_destroy,
 				data,
 				start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
@@ -162,7 +201,7 @@ class ProvisionInfraWorkflow:
 
 			workflow.logger.info("Infrastructure destroyed")
 
-			show_output = await workflow.execute_activity_method(
+			show_output = await self._host_affinity.execute_activity(
 				ProvisioningActivities.terraform_output,
 				data,
 				start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
@@ -173,6 +212,17 @@ class ProvisionInfraWorkflow:
 
 		return show_output
 
+	def _fail_unless_applied(self, data: TerraformRunDetails) -> None:
+		"""Fail a run that is required to apply, so that whatever depends on it
+		doesn't start on infrastructure that was never applied."""
+
+		if data.require_apply:
+			raise ApplicationError(
+				f"Terraform plan not applied: {self._current_status}",
+				type="TerraformNotAppliedError",
+				non_retryable=True,
+			)
+
 	# Update to request continuation
 	@workflow.signal
 	async def request_continue_as_new(self) -> None:
@@ -215,3 +265,20 @@ class ProvisionInfraWorkflow:
 	def get_progress(self) -> int:
 		workflow.logger.info("Progress query received.")
 		return self._progress
+
+	@workflow.query
+	def get_snapshot(self, known_plan_digest: str = "") -> WorkflowSnapshot:
+		"""Everything the UI polls for in a single query, the plan itself is
+		left out when the caller already has the plan with the same digest."""
+
+		workflow.logger.info("Snapshot query received.")
+		plan_summary = self._tf_run_details.plan_summary if self._tf_run_details else None
+		plan_digest = plan_summary.digest if plan_summary else ""
+
+		return WorkflowSnapshot(
+			status=self._current_status,
+			progress=self._progress,
+			reason=self._reason,
+			plan_digest=plan_digest,
+			plan=None if plan_digest and plan_digest == known_plan_digest else self._tf_plan_output,
+		)
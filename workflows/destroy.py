@@ -1,11 +1,14 @@
 from datetime import timedelta
 from temporalio import workflow
 from temporalio.common import RetryPolicy
-from shared.base import TERRAFORM_COMMON_TIMEOUT_SECS
+from shared.base import WorkflowSnapshot, TERRAFORM_COMMON_TIMEOUT_SECS, \
+	COALESCED_PROVISION_STATUSES, COALESCE_UPSERTS_PATCH
+
+from workflows.host_affinity import HostAffinity
 
 with workflow.unsafe.imports_passed_through():
 	from shared.activities import ProvisioningActivities
-	from shared.base import TerraformRunDetails
+	from shared.base import TerraformRunDetails, TerraformRunResult
 
 @workflow.defn
 class DeprovisionInfraWorkflow:
@@ -16,13 +19,36 @@ class DeprovisionInfraWorkflow:
 		self._current_status = "uninitialized"
 		self._progress = 0
 		self._tf_plan_output = ""
+		self._host_affinity = HostAffinity()
 
 	def _custom_upsert(self, data: TerraformRunDetails, payload: dict):
-		if data.include_custom_search_attrs:
-			workflow.upsert_search_attributes(payload)
+		if not data.include_custom_search_attrs:
+			return
+
+		# Only write the statuses worth searching for, the rest are still
+		# available through the status query. Histories from before this
+		# change have an upsert for every status.
+		if payload.get("provisionStatus", [""])[0] in COALESCED_PROVISION_STATUSES \
+				and workflow.patched(COALESCE_UPSERTS_PATCH):
+			return
+
+		workflow.upsert_search_attributes(payload)
 
 	@workflow.run
 	async def run(self, data: TerraformRunDetails) -> dict:
+		try:
+			return await self._deprovision(data)
+		finally:
+			# Garbage collect the isolated workspace once the run is over,
+			# whether it succeeded or not.
+			if data.isolated_workspace:
+				await self._host_affinity.execute_activity(
+					ProvisioningActivities.cleanup_workspace,
+					data,
+					start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+				)
+
+	async def _deprovision(self, data: TerraformRunDetails) -> dict:
 		self._custom_upsert(data, {"provisionStatus": ["uninitialized"]})
 		self._tf_run_details = data
 
@@ -36,12 +62,7 @@ class DeprovisionInfraWorkflow:
 
 		self._progress = 10
 		self._current_status = "initializing"
-		await workflow.execute_local_activity_method(
-			ProvisioningActivities.terraform_init,
-			data,
-			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
-			retry_policy=tf_init_retry_policy,
-		)
+		await self._host_affinity.init(data, tf_init_retry_policy)
 		self._custom_upsert(data, {"provisionStatus": ["initialized"]})
 		self._progress = 33
 		self._current_status = "initialized"
@@ -55,7 +76,7 @@ class DeprovisionInfraWorkflow:
 		self._progress = 66
 		self._custom_upsert(data, {"provisionStatus": ["destroying"]})
 		self._current_status = "destroying"
-		await workflow.execute_activity_method(
+		destroy_result = await self._host_affinity.execute_activity(
 			ProvisioningActivities.terraform_destroy,
 			data,
 			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
@@ -65,8 +86,10 @@ class DeprovisionInfraWorkflow:
 		self._current_status = "destroyed"
 
 		workflow.logger.info("Infrastructure destroyed")
+		if isinstance(destroy_result, TerraformRunResult):
+			workflow.logger.info(f"Workflow destroy result: {destroy_result.summary()}")
 
-		show_output = await workflow.execute_activity_method(
+		show_output = await self._host_affinity.execute_activity(
 			ProvisioningActivities.terraform_output,
 			data,
 			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
@@ -91,3 +114,14 @@ class DeprovisionInfraWorkflow:
 	def get_progress(self) -> int:
 		workflow.logger.info("Progress query received.")
 		return self._progress
+
+	@workflow.query
+	def get_snapshot(self, known_plan_digest: str = "") -> WorkflowSnapshot:
+		"""Everything the UI polls for in a single query."""
+
+		workflow.logger.info("Snapshot query received.")
+		return WorkflowSnapshot(
+			status=self._current_status,
+			progress=self._progress,
+			plan=self._tf_plan_output,
+		)
@@ -0,0 +1,137 @@
+import asyncio
+import dataclasses
+
+from datetime import timedelta
+from typing import Dict, List
+from temporalio import workflow
+from temporalio.common import RetryPolicy
+from temporalio.exceptions import ActivityError, ChildWorkflowError
+from shared.base import TERRAFORM_COMMON_TIMEOUT_SECS
+
+from workflows.host_affinity import HostAffinity
+
+with workflow.unsafe.imports_passed_through():
+	from shared.activities import ProvisioningActivities
+	from shared.base import DriftDetectionDetails, DriftResult, TerraformRunDetails
+
+
+@workflow.defn
+class StackDriftCheckWorkflow:
+	"""Checks a single stack for drift, and records the outcome and the digest
+	of the drift in its search attributes, so drifted stacks can be listed
+	across the fleet without querying every check."""
+
+	def __init__(self) -> None:
+		self._current_status = "uninitialized"
+		self._host_affinity = HostAffinity()
+
+	def _custom_upsert(self, data: TerraformRunDetails, payload: dict):
+		if data.include_custom_search_attrs:
+			workflow.upsert_search_attributes(payload)
+
+	@workflow.run
+	async def run(self, data: TerraformRunDetails) -> DriftResult:
+		self._custom_upsert(data, {"tfDirectory": [data.directory], "driftStatus": ["checking"]})
+
+		try:
+			self._current_status = "initializing"
+			await self._host_affinity.init(
+				data, RetryPolicy(maximum_attempts=5, non_retryable_error_types=["TerraformInitError"])
+			)
+
+			self._current_status = "checking drift"
+			result = await self._host_affinity.execute_activity(
+				ProvisioningActivities.terraform_drift_check,
+				data,
+				start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+				retry_policy=RetryPolicy(
+					initial_interval=timedelta(seconds=3),
+					maximum_attempts=5,
+					non_retryable_error_types=["TerraformMissingEnvVarsErrors"],
+				),
+			)
+		except ActivityError as e:
+			# A stack that can't be checked is reported, not retried forever
+			result = DriftResult(directory=data.directory, status="failed", error=str(e.cause or e))
+
+		self._custom_upsert(data, {"driftStatus": [result.status], "driftDigest": [result.digest]})
+		self._current_status = result.status
+		return result
+
+	@workflow.query
+	def get_current_status(self) -> str:
+		workflow.logger.info("Status query received.")
+		return self._current_status
+
+
+@workflow.defn
+class DriftDetectionWorkflow:
+	"""Checks every stack of a fleet for drift with a StackDriftCheckWorkflow
+	each, a bounded number at a time. Every check starts after a random delay,
+	so that a scheduled run doesn't call every provider at the same moment."""
+
+	def __init__(self) -> None:
+		self._results: Dict[str, DriftResult] = {}
+		self._current_status = "uninitialized"
+		self._in_flight = 0
+
+	@workflow.run
+	async def run(self, data: DriftDetectionDetails) -> List[DriftResult]:
+		self._current_status = "checking"
+		max_in_flight = max(1, data.max_in_flight)
+		runs = [
+			dataclasses.replace(run, id=run.id or f"{data.id}-{index}")
+			for index, run in enumerate(data.runs)
+		]
+		self._results = {run.id: DriftResult(directory=run.directory, status="pending") for run in runs}
+		# The same stacks are checked on every scheduled run, and a check can
+		# outlast the interval, so children are keyed by this run as well.
+		run_suffix = workflow.info().run_id
+
+		# Drawn up front, in order, so that replays wait for the same delays
+		jitters = [workflow.random().uniform(0, max(0, data.max_jitter_secs)) for _ in runs]
+
+		async def check(run: TerraformRunDetails, jitter: float) -> None:
+			await asyncio.sleep(jitter)
+			await workflow.wait_condition(lambda: self._in_flight < max_in_flight)
+			self._in_flight += 1
+			self._results[run.id].status = "running"
+
+			try:
+				self._results[run.id] = await workflow.execute_child_workflow(
+					StackDriftCheckWorkflow.run,
+					run,
+					id=f"{run.id}-drift-{run_suffix}",
+				)
+			except ChildWorkflowError as e:
+				self._results[run.id] = DriftResult(directory=run.directory, status="failed", error=str(e.cause or e))
+			finally:
+				self._in_flight -= 1
+
+		await asyncio.gather(*(check(run, jitter) for run, jitter in zip(runs, jitters)))
+
+		results = list(self._results.values())
+		drifted = [r.directory for r in results if r.status == "drifted"]
+		if drifted:
+			workflow.logger.warning(f"Drift found in: {', '.join(drifted)}")
+
+		self._current_status = "drifted" if drifted else "completed"
+		return results
+
+	@workflow.query
+	def get_current_status(self) -> str:
+		workflow.logger.info("Status query received.")
+		return self._current_status
+
+	@workflow.query
+	def get_drift_results(self) -> List[DriftResult]:
+		workflow.logger.info("Drift results query received.")
+		return list(self._results.values())
+
+	@workflow.query
+	def get_progress(self) -> int:
+		workflow.logger.info("Progress query received.")
+		if not self._results:
+			return 0
+		finished = sum(1 for r in self._results.values() if r.status not in ("pending", "running"))
+		return finished * 100 // len(self._results)
@@ -0,0 +1,91 @@
+from datetime import timedelta
+from typing import Any, Callable, Optional
+from temporalio import workflow
+from temporalio.common import RetryPolicy
+from temporalio.exceptions import ActivityError, TimeoutError, TimeoutType
+from shared.base import TERRAFORM_COMMON_TIMEOUT_SECS, HOST_TASK_QUEUE_SCHEDULE_TO_START_SECS, \
+	HOST_AFFINITY_MAX_REROUTES
+
+with workflow.unsafe.imports_passed_through():
+	from shared.activities import ProvisioningActivities
+	from shared.base import TerraformRunDetails
+
+
+def _host_unavailable(error: ActivityError) -> bool:
+	"""Whether no worker picked the activity up from the host's task queue."""
+
+	return isinstance(error.cause, TimeoutError) and error.cause.type == TimeoutType.SCHEDULE_TO_START
+
+
+class HostAffinity:
+	"""Keeps the activities of a run on the worker that initialized its
+	directory, where '.terraform', the saved plans and any isolated workspace
+	are, by sending them to the task queue that worker advertised from init.
+
+	If nothing picks an activity up from that task queue in time, and the
+	host hasn't polled for a while either, the host is gone: the directory is
+	initialized again on whichever worker runs the workflow now, and the
+	activity follows it there. A host that still polls is only busy, and the
+	activity waits for it. After too many moves the run falls back to the
+	shared task queue."""
+
+	def __init__(self) -> None:
+		self.task_queue: Optional[str] = None
+		self._init_retry_policy: Optional[RetryPolicy] = None
+		self._reroutes = 0
+
+	async def init(self, data: TerraformRunDetails, retry_policy: RetryPolicy) -> tuple:
+		self._init_retry_policy = retry_policy
+		init_result = await workflow.execute_local_activity_method(
+			ProvisioningActivities.terraform_init,
+			data,
+			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+			retry_policy=self._init_retry_policy,
+		)
+
+		# Inits from before host task queues existed, or on workers without
+		# one, only return the output and the run stays on the shared queue.
+		self.task_queue = (init_result[2] or None) if len(init_result) > 2 else None
+		return init_result
+
+	async def _host_polled(self) -> bool:
+		try:
+			return await workflow.execute_local_activity_method(
+				ProvisioningActivities.host_task_queue_polled,
+				self.task_queue,
+				start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+				retry_policy=RetryPolicy(maximum_attempts=3),
+			)
+		except ActivityError as e:
+			# No way to tell, so treat the host as gone, as if it hadn't polled
+			workflow.logger.warning(f"Couldn't check whether {self.task_queue} is polled: {e.cause or e}")
+			return False
+
+	async def execute_activity(self, activity: Callable, data: TerraformRunDetails, **kwargs: Any) -> Any:
+		while self.task_queue is not None:
+			try:
+				return await workflow.execute_activity_method(
+					activity,
+					data,
+					task_queue=self.task_queue,
+					schedule_to_start_timeout=timedelta(seconds=HOST_TASK_QUEUE_SCHEDULE_TO_START_SECS),
+					**kwargs,
+				)
+			except ActivityError as e:
+				if not _host_unavailable(e):
+					raise
+
+			if await self._host_polled():
+				workflow.logger.info(f"{self.task_queue} is busy, waiting for it to pick up {activity.__name__}")
+				continue
+
+			workflow.logger.warning(f"No worker picked up {activity.__name__} from {self.task_queue}")
+			if self._reroutes >= HOST_AFFINITY_MAX_REROUTES:
+				workflow.logger.warning("Falling back to the shared task queue")
+				self.task_queue = None
+				break
+
+			self._reroutes += 1
+			await self.init(data, self._init_retry_policy)
+
+		return await workflow.execute_activity_method(activity, data, **kwargs)
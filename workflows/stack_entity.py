@@ -0,0 +1,248 @@
+import dataclasses
+
+from datetime import timedelta
+from typing import List, Optional
+from temporalio import workflow
+from temporalio.common import RetryPolicy
+from temporalio.exceptions import ActivityError, ApplicationError
+from shared.base import ApplyDecisionDetails, WorkflowSnapshot, TERRAFORM_COMMON_TIMEOUT_SECS, \
+	STACK_REQUEST_KINDS, STACK_ENTITY_MAX_HISTORY_EVENTS, STACK_ENTITY_MAX_HISTORY_BYTES
+
+from workflows.host_affinity import HostAffinity
+
+with workflow.unsafe.imports_passed_through():
+	from shared.activities import ProvisioningActivities
+	from shared.base import StackEntityState, StackRequest, TerraformRunDetails
+	from shared.plan_summary import PlanSummary
+
+
+@workflow.defn
+class StackEntityWorkflow:
+	"""A long lived workflow per stack, that serializes every plan, apply and
+	destroy requested for it. Requests are queued in the order they arrive,
+	and a request identical to the last one waiting is folded into it, so a
+	burst of applies during an in-flight apply results in a single one.
+
+	The workflow continues as new between requests once its history grows
+	large, carrying over only the queue and a compact summary of the stack."""
+
+	def __init__(self) -> None:
+		self._state: Optional[StackEntityState] = None
+		self._in_flight: Optional[StackRequest] = None
+		self._host_affinity = HostAffinity()
+		self._apply_approved = None
+		self._reason = ""
+		self._tf_plan_output = ""
+
+	@workflow.run
+	async def run(self, state: StackEntityState) -> None:
+		self._state = state
+
+		while True:
+			await workflow.wait_condition(lambda: bool(self._state.pending) or self._history_too_large())
+
+			if self._history_too_large():
+				workflow.logger.info(
+					f"Continuing as new after {workflow.info().get_current_history_length()} events, "
+					f"with {len(self._state.pending)} request(s) pending"
+				)
+				workflow.continue_as_new(self._state)
+
+			self._in_flight = self._state.pending.pop(0)
+			try:
+				await self._process(self._in_flight)
+			finally:
+				self._in_flight = None
+				self._state.processed += 1
+
+	def _history_too_large(self) -> bool:
+		info = workflow.info()
+		return info.is_continue_as_new_suggested() \
+			or info.get_current_history_length() >= STACK_ENTITY_MAX_HISTORY_EVENTS \
+			or info.get_current_history_size() >= STACK_ENTITY_MAX_HISTORY_BYTES
+
+	def _enqueue(self, request: StackRequest) -> int:
+		"""Queue a request, or fold it into the last request waiting if that is
+		identical, and return the sequence number it will be processed under.
+
+		Folding into an earlier request would reorder it with the ones queued
+		after it, e.g. an apply folded into [apply, destroy] would leave the
+		stack destroyed."""
+
+		for pending in self._state.pending[-1:]:
+			# An apply plans anyway, so a plan waiting right after it is redundant
+			if pending.kind == request.kind or (request.kind == "plan" and pending.kind == "apply"):
+				pending.merged += 1
+				return pending.seq
+
+		request = dataclasses.replace(request, seq=self._state.next_seq, merged=0)
+		self._state.next_seq += 1
+		self._state.pending.append(request)
+		return request.seq
+
+	async def _process(self, request: StackRequest) -> None:
+		workflow.logger.info(f"Processing {request.kind} request {request.seq}, merged with {request.merged} other(s)")
+		# The plan and approval of a previous request never carry over
+		data = dataclasses.replace(self._state.run, plan="", plan_summary=None)
+		self._apply_approved = None
+		# Every request initializes the directory again, on whichever worker runs it
+		self._host_affinity = HostAffinity()
+
+		try:
+			await self._init(data)
+			if request.kind == "destroy":
+				await self._destroy(data)
+			else:
+				policy_passed = await self._plan(data)
+				if request.kind == "apply":
+					await self._apply(data, policy_passed)
+				else:
+					self._state.status = "planned"
+		except ActivityError as e:
+			# The stack stays available for the next request
+			self._state.status = "failed"
+			workflow.logger.error(f"Stack {request.kind} request {request.seq} failed: {e.cause or e}")
+
+	async def _init(self, data: TerraformRunDetails) -> None:
+		self._state.status = "initializing"
+		await self._host_affinity.init(
+			data, RetryPolicy(maximum_attempts=5, non_retryable_error_types=["TerraformInitError"])
+		)
+
+	async def _plan(self, data: TerraformRunDetails) -> bool:
+		self._state.status = "planning"
+		tf_plan_result = await self._host_affinity.execute_activity(
+			ProvisioningActivities.terraform_plan,
+			data,
+			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+			retry_policy=RetryPolicy(
+				initial_interval=timedelta(seconds=3),
+				non_retryable_error_types=["TerraformMissingEnvVarsErrors"],
+			),
+		)
+		self._tf_plan_output = tf_plan_result[0]
+		data.plan_summary = PlanSummary.from_dict(tf_plan_result[1])
+		self._state.plan_digest = data.plan_summary.digest
+
+		self._state.status = "checking policy"
+		policy_passed = await workflow.execute_activity_method(
+			ProvisioningActivities.policy_check,
+			data,
+			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+			retry_policy=RetryPolicy(maximum_attempts=5, maximum_interval=timedelta(seconds=5)),
+		)
+		# Only the policy check needs the resource changes
+		data.plan_summary = data.plan_summary.compact()
+		return policy_passed
+
+	async def _apply(self, data: TerraformRunDetails, policy_passed: bool) -> None:
+		if not policy_passed and data.hard_fail_policy:
+			self._state.status = "policy_hard_failed"
+			return
+
+		if not policy_passed:
+			self._state.status = "awaiting approval decision"
+			await workflow.wait_condition(lambda: self._apply_approved is not None)
+			if not self._apply_approved:
+				self._state.status = "rejected"
+				return
+
+		self._state.status = "applying"
+		await self._host_affinity.execute_activity(
+			ProvisioningActivities.terraform_apply,
+			data,
+			start_to_close_timeout=timedelta(seconds=data.apply_timeout_secs),
+			heartbeat_timeout=timedelta(seconds=10),
+			retry_policy=self._apply_destroy_retry_policy(),
+		)
+		await self._refresh_outputs(data)
+		self._state.status = "applied"
+
+	async def _destroy(self, data: TerraformRunDetails) -> None:
+		self._state.status = "destroying"
+		await self._host_affinity.execute_activity(
+			ProvisioningActivities.terraform_destroy,
+			data,
+			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+			retry_policy=self._apply_destroy_retry_policy(),
+		)
+		await self._refresh_outputs(data)
+		self._tf_plan_output = ""
+		self._state.plan_digest = ""
+		self._state.status = "destroyed"
+
+	async def _refresh_outputs(self, data: TerraformRunDetails) -> None:
+		self._state.outputs = await self._host_affinity.execute_activity(
+			ProvisioningActivities.terraform_output,
+			data,
+			start_to_close_timeout=timedelta(seconds=TERRAFORM_COMMON_TIMEOUT_SECS),
+			retry_policy=self._apply_destroy_retry_policy(),
+		)
+
+	def _apply_destroy_retry_policy(self) -> RetryPolicy:
+		return RetryPolicy(
+			initial_interval=timedelta(seconds=3),
+			maximum_interval=timedelta(seconds=5),
+			maximum_attempts=100,
+		)
+
+	@workflow.signal
+	def signal_request(self, request: StackRequest) -> None:
+		workflow.logger.info(f"Stack request signal received: {request.kind}")
+		if request.kind not in STACK_REQUEST_KINDS:
+			workflow.logger.warning(f"Ignoring unknown stack request: {request.kind}")
+			return
+		self._enqueue(request)
+
+	@workflow.update
+	def submit_request(self, request: StackRequest) -> int:
+		workflow.logger.info(f"Stack request update received: {request.kind}")
+		return self._enqueue(request)
+
+	@submit_request.validator
+	def validate_request(self, request: StackRequest) -> None:
+		if request.kind not in STACK_REQUEST_KINDS:
+			raise ApplicationError(f"Stack requests must be one of {', '.join(STACK_REQUEST_KINDS)}.")
+
+	@workflow.signal
+	async def signal_apply_decision(self, decision: ApplyDecisionDetails) -> None:
+		workflow.logger.info(f"Signal decision update received: {decision}")
+		self._apply_approved = decision.is_approved
+
+	@workflow.update
+	async def update_apply_decision(self, decision: ApplyDecisionDetails) -> None:
+		workflow.logger.info(f"Apply decision update received: {decision}")
+		self._apply_approved = decision.is_approved
+		self._reason = decision.reason
+
+	@update_apply_decision.validator
+	def validate_apply_decision(self, decision: ApplyDecisionDetails) -> None:
+		if decision.reason == "":
+			workflow.logger.info("Rejecting update apply decision, no reason provided.")
+			raise ApplicationError("Update apply decision must include a reason.")
+
+	@workflow.query
+	def get_pending_requests(self) -> List[StackRequest]:
+		workflow.logger.info("Pending requests query received.")
+		return ([self._in_flight] if self._in_flight else []) + list(self._state.pending)
+
+	@workflow.query
+	def get_outputs(self) -> dict:
+		workflow.logger.info("Outputs query received.")
+		return self._state.outputs
+
+	@workflow.query
+	def get_snapshot(self, known_plan_digest: str = "") -> WorkflowSnapshot:
+		"""Everything the UI polls for in a single query, the plan itself is
+		left out when the caller already has the plan with the same digest."""
+
+		workflow.logger.info("Snapshot query received.")
+		plan_digest = self._state.plan_digest if self._state else ""
+
+		return WorkflowSnapshot(
+			status=self._state.status if self._state else "uninitialized",
+			progress=100 if self._in_flight is None else 0,
+			reason=self._reason,
+			plan_digest=plan_digest,
+			plan=None if plan_digest and plan_digest == known_plan_digest else self._tf_plan_output,
+		)
@@ -0,0 +1,168 @@
+import asyncio
+import dataclasses
+
+from typing import Awaitable, Callable, Dict, List
+from temporalio import workflow
+from temporalio.exceptions import ApplicationError, CancelledError, ChildWorkflowError
+
+from workflows.apply import ProvisionInfraWorkflow
+from workflows.destroy import DeprovisionInfraWorkflow
+
+with workflow.unsafe.imports_passed_through():
+	from shared.base import MultiStackRunDetails, StackDetails, StackResult, TerraformRunDetails
+	from shared.stack_graph import build_stack_graph, reverse_stack_graph
+
+
+class _StackGraphWorkflow:
+	"""Runs a child workflow per stack, in dependency order, starting every
+	stack whose dependencies are done as soon as there is room for it."""
+
+	def __init__(self) -> None:
+		self._results: Dict[str, StackResult] = {}
+		self._current_status = "uninitialized"
+
+	def _stack_graph(self, data: MultiStackRunDetails) -> Dict[str, List[str]]:
+		try:
+			return build_stack_graph(data.stacks)
+		except ValueError as e:
+			# Fail the workflow rather than retrying the workflow task forever
+			raise ApplicationError(str(e), type="InvalidStackGraphError", non_retryable=True)
+
+	def _run_details(self, data: MultiStackRunDetails, stack: StackDetails) -> TerraformRunDetails:
+		"""Key each stack's run by the parent's ID, unless it has its own. A
+		stack whose plan isn't applied fails, rather than letting the stacks
+		that depend on it start."""
+
+		return dataclasses.replace(stack.run, id=stack.run.id or f"{data.id}-{stack.name}", require_apply=True)
+
+	async def _run_graph(
+		self,
+		data: MultiStackRunDetails,
+		graph: Dict[str, List[str]],
+		run_stack: Callable[[StackDetails], Awaitable[dict]],
+	) -> List[StackResult]:
+		stacks = {stack.name: stack for stack in data.stacks}
+		self._results = {name: StackResult(name=name) for name in graph}
+		waiting_on = {name: set(dependencies) for name, dependencies in graph.items()}
+		running: Dict[str, asyncio.Task] = {}
+		max_in_flight = max(1, data.max_in_flight)
+		failed = False
+
+		while waiting_on or running:
+			# Start what is ready, in name order so that replays start the same
+			# stacks in the same order, unless a failure stops everything.
+			if not (failed and data.fail_fast):
+				for name in sorted(n for n, dependencies in waiting_on.items() if not dependencies):
+					if len(running) >= max_in_flight:
+						break
+					del waiting_on[name]
+					self._results[name].status = "running"
+					running[name] = asyncio.create_task(run_stack(stacks[name]))
+
+			# Nothing is running and nothing can start, the rest is blocked by failures
+			if not running:
+				break
+
+			await workflow.wait_condition(lambda: any(task.done() for task in running.values()))
+
+			for name in sorted(n for n, task in running.items() if task.done()):
+				task = running.pop(name)
+				result = self._results[name]
+
+				try:
+					result.outputs = task.result() or {}
+					result.status = "succeeded"
+					for dependencies in waiting_on.values():
+						dependencies.discard(name)
+				except ChildWorkflowError as e:
+					if isinstance(e.cause, CancelledError):
+						result.status = "cancelled"
+						continue
+
+					result.status = "failed"
+					result.error = str(e.cause or e)
+					failed = True
+					workflow.logger.error(f"Stack {name} failed: {result.error}")
+
+					if data.fail_fast:
+						for other in running.values():
+							other.cancel()
+				except asyncio.CancelledError:
+					result.status = "cancelled"
+
+		for name in waiting_on:
+			self._results[name].status = "skipped"
+
+		results = [self._results[name] for name in graph]
+		self._current_status = "failed" if failed else "completed"
+
+		if failed and data.fail_fast:
+			raise ApplicationError(
+				f"Stack(s) failed: {', '.join(r.name for r in results if r.status == 'failed')}",
+				results,
+				type="StackFailedError",
+				non_retryable=True,
+			)
+
+		return results
+
+	@workflow.query
+	def get_current_status(self) -> str:
+		workflow.logger.info("Status query received.")
+		return self._current_status
+
+	@workflow.query
+	def get_stack_results(self) -> List[StackResult]:
+		workflow.logger.info("Stack results query received.")
+		return list(self._results.values())
+
+	@workflow.query
+	def get_progress(self) -> int:
+		workflow.logger.info("Progress query received.")
+		if not self._results:
+			return 0
+		finished = sum(1 for r in self._results.values() if r.status not in ("pending", "running"))
+		return finished * 100 // len(self._results)
+
+
+@workflow.defn
+class ProvisionStacksWorkflow(_StackGraphWorkflow):
+	"""Provisions a set of stacks that depend on each other, each one with its
+	own ProvisionInfraWorkflow, and independent stacks in parallel."""
+
+	@workflow.run
+	async def run(self, data: MultiStackRunDetails) -> List[StackResult]:
+		graph = self._stack_graph(data)
+		self._current_status = "provisioning"
+
+		async def provision(stack: StackDetails) -> dict:
+			run_details = self._run_details(data, stack)
+			return await workflow.execute_child_workflow(
+				ProvisionInfraWorkflow.run,
+				run_details,
+				id=run_details.id,
+			)
+
+		return await self._run_graph(data, graph, provision)
+
+
+@workflow.defn
+class DeprovisionStacksWorkflow(_StackGraphWorkflow):
+	"""Tears a set of stacks down in the reverse order they were provisioned
+	in, each one with its own DeprovisionInfraWorkflow, a stack only once
+	every stack that depends on it is gone."""
+
+	@workflow.run
+	async def run(self, data: MultiStackRunDetails) -> List[StackResult]:
+		graph = reverse_stack_graph(self._stack_graph(data))
+		self._current_status = "deprovisioning"
+
+		async def deprovision(stack: StackDetails) -> dict:
+			run_details = self._run_details(data, stack)
+			return await workflow.execute_child_workflow(
+				DeprovisionInfraWorkflow.run,
+				run_details,
+				id=f"{run_details.id}-destroy",
+			)
+
+		return await self._run_graph(data, graph, deprovision)